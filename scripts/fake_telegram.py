@@ -0,0 +1,77 @@
+"""
+A minimal fake Telegram Bot API server for testing the webhook mode locally.
+
+It answers the Bot API methods the bot calls and, once the bot has registered its webhook,
+POSTs a '/start' update to it with the secret token header.
+
+Usage:
+    python scripts/fake_telegram.py --port 8081 --user-id 123456789
+    # and run the bot with BOT_RUN_MODE=webhook, TELEGRAM_API_URL=http://localhost:8081,
+    # WEBHOOK_BASE_URL=http://localhost:8080, WEBHOOK_SECRET=<any secret>
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+from aiohttp import web
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _make_message(chat_id: int, text: str) -> dict:
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Tester"},
+        "text": text,
+    }
+
+
+async def _send_start_update(url: str, secret_token: str | None, user_id: int):
+    update = {"update_id": next(_update_ids), "message": _make_message(user_id, "/start")}
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token} if secret_token else {}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=update, headers=headers) as response:
+            print(f"Update {update['update_id']} -> {url}: {response.status}")
+
+
+async def _handle_method(request: web.Request) -> web.Response:
+    method = request.match_info["method"]
+    params = dict(await request.post())
+    print(f"{method}: {params}")
+
+    if method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+    elif method == "setWebhook":
+        request.app["webhook"] = params["url"]
+        result = True
+        asyncio.get_running_loop().call_later(
+            1, asyncio.create_task,
+            _send_start_update(params["url"], params.get("secret_token"), request.app["user_id"])
+        )
+    elif method in ("sendMessage", "editMessageText"):
+        result = _make_message(int(params.get("chat_id", request.app["user_id"])), params.get("text", ""))
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--user-id", type=int, required=True, help="Telegram id of the user who sends updates")
+    args = parser.parse_args()
+
+    app = web.Application()
+    app["user_id"] = args.user_id
+    app.router.add_post("/bot{token}/{method}", _handle_method)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
 from .vk_session import VkAPI
 from .google_session import GoogleAPI
+from .async_google_session import AsyncGoogleAPI
 from .telegraph_session import TelegraphAPI
@@ -0,0 +1,63 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Hashable
+
+from .google_session import GoogleAPI, ProtocolRecord
+from src.exceptions import GoogleAPIError
+from src.schemas import EventRegistrationTableDTO
+
+
+class AsyncGoogleAPI:
+    """
+    An async facade over GoogleAPI. Blocking calls run in a bounded thread pool with a timeout,
+    and concurrent identical calls share one request (single-flight).
+    """
+
+    def __init__(self, google_api: GoogleAPI, max_workers: int, timeout: float):
+        """
+        :param google_api: The GoogleAPI object to run the calls of.
+        :param max_workers: The maximum number of calls running at the same time.
+        :param timeout: The number of seconds to wait for a call before raising GoogleAPIError.
+        """
+        self.google_api = google_api
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='google-api')
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    async def _run(self, method_name: str, *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        # Run the call in a copy of the current context to keep the tracing span in the thread.
+        context = contextvars.copy_context()
+        func = functools.partial(context.run, getattr(self.google_api, method_name), *args)
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, func), self.timeout)
+        except asyncio.TimeoutError:
+            # The thread can't be interrupted, its result is just dropped.
+            raise GoogleAPIError(f"Google API call '{method_name}' timed out after {self.timeout} s")
+
+    async def _call(self, method_name: str, *args: Any) -> Any:
+        key = (method_name, *args)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(method_name, *args))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # A cancelled caller doesn't cancel the call shared with the others.
+        return await asyncio.shield(future)
+
+    async def get_protocol_records(self, document_id: str) -> list[ProtocolRecord]:
+        return await self._call('get_protocol_records', document_id)
+
+    async def inspect_table(self, table_url: str) -> (str, bool):
+        return await self._call('inspect_table', table_url)
+
+    async def get_table_title(self, table_url: str) -> str:
+        return await self._call('get_table_title', table_url)
+
+    async def get_event_registration_table_data(self, table_url: str) -> EventRegistrationTableDTO:
+        return await self._call('get_event_registration_table_data', table_url)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -3,15 +3,63 @@ from gspread.exceptions import APIError, SpreadsheetNotFound, GSpreadException
 from builtins import PermissionError
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
+import hashlib
 import re
+import threading
+from itertools import zip_longest
+from typing import Iterator, NamedTuple
 
 from src.exceptions import GoogleAPIError
+from src.metrics import instrument
 from src.utils.person_name import format_person_name
 from datetime import datetime
 from src.schemas import (GoogleDocProtocolDTO, ProtocolPersonDTO, EventRegistrationTableDTO,
                          EventRegistrationTablePersonDTO)
 
+# Only the text of the tables is needed to parse protocols, styles and other elements are left out.
+PROTOCOLS_FIELDS_MASK = (
+    'body/content/table/tableRows/tableCells/content/paragraph(bullet/listId,elements/textRun/content)'
+)
 
+
+class ProtocolRecord(NamedTuple):
+    """
+    A protocol as it is parsed from a document, before validation.
+    """
+    number: str | None
+    status: bool
+    protocol_date: str | None = None
+    full_names: tuple[str, ...] = ()
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        A hash of the number, the date and the persons of the protocol. Names are compared case-insensitively
+        and regardless of their order and spacing, as persons are matched anyway.
+        """
+        full_names = sorted(' '.join(name.casefold().replace('ё', 'е').split()) for name in self.full_names)
+        content = '\n'.join([self.number or '', str(self.status), self.protocol_date or '', *full_names])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def to_dto(self) -> GoogleDocProtocolDTO:
+        if not self.status:
+            return GoogleDocProtocolDTO(status=self.status, number=self.number)
+
+        persons = []
+        for full_name in self.full_names:
+            try:
+                persons.append(ProtocolPersonDTO(full_name=full_name))
+            except ValueError:
+                continue
+        return GoogleDocProtocolDTO(number=self.number, protocol_date=self.protocol_date, persons=persons,
+                                    status=self.status)
+
+
+# Columns of an event registration table: a full name and a checkbox of attendance.
+REQUIRED_COLUMNS = ('ФИО', 'Отметка')
+
+
+@instrument('google')
 class GoogleAPI:
     """
     A class to interact with Google Docs and Sheets APIs.
@@ -23,11 +71,24 @@ class GoogleAPI:
         :param credentials_file: The path to the service account credentials file in JSON format.
         """
         self.credentials_file = credentials_file
-        scopes_docs = ['https://www.googleapis.com/auth/documents.readonly']
-        scopes_sheets = ['https://www.googleapis.com/auth/spreadsheets.readonly']
-        credentials_docs = self._get_credentials(scopes_docs)
-        self.service_docs = self._build_service('docs', 'v1', credentials_docs)
-        self.service_sheets = service_account(filename=self.credentials_file, scopes=scopes_sheets)
+        self.credentials_docs = self._get_credentials(['https://www.googleapis.com/auth/documents.readonly'])
+        self.scopes_sheets = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+        # The HTTP clients of googleapiclient and gspread aren't thread-safe, so every thread gets its own ones.
+        self._local = threading.local()
+        # Positions of the required columns by table id, see '_read_columns'.
+        self._column_positions: dict[str, tuple[int, ...]] = {}
+
+    @property
+    def service_docs(self):
+        if not hasattr(self._local, 'service_docs'):
+            self._local.service_docs = self._build_service('docs', 'v1', self.credentials_docs)
+        return self._local.service_docs
+
+    @property
+    def service_sheets(self):
+        if not hasattr(self._local, 'service_sheets'):
+            self._local.service_sheets = service_account(filename=self.credentials_file, scopes=self.scopes_sheets)
+        return self._local.service_sheets
 
     def _get_credentials(self, scopes: list[str]):
         return Credentials.from_service_account_file(self.credentials_file, scopes=scopes)
@@ -62,90 +123,64 @@ class GoogleAPI:
             return False
 
     @staticmethod
-    def _get_text_from_cell(cell) -> str:
-        return cell['content'][0]['paragraph']['elements'][0]['textRun']['content'].strip()
-
-    @staticmethod
-    def _extract_persons_from_docs(persons_cell: dict) -> list[ProtocolPersonDTO]:
+    def _get_text_from_cell(cell: dict) -> str:
         """
-        Extracts and formats person names from a given cell in a Google Docs document.
-
-        The function iterates through the content of the cell, identifies bullet points,
-        extracts the full name from each bullet point, formats the name into separate first and last names,
-        and creates a ProtocolPersonDTO object for each valid name.
-
-        :param persons_cell: A dictionary representing the cell in the Google Docs document.
-            It contains the content of the cell, including paragraphs and bullet points.
-        :return: A list of ProtocolPersonDTO objects, each representing a person's name.
-            If no valid names are found, an empty list is returned.
+        Returns the text of the first run of the first paragraph in the cell, or an empty string.
         """
-        persons = []
-        for record in persons_cell['content']:
-            if 'bullet' not in record['paragraph']:
-                continue
-
-            full_name = record['paragraph']['elements'][0]['textRun']['content'].strip()
+        for record in cell.get('content', ()):
+            for element in record.get('paragraph', {}).get('elements', ()):
+                return element.get('textRun', {}).get('content', '').strip()
+        return ''
 
-            try:
-                person = ProtocolPersonDTO(full_name=full_name)
-                persons.append(person)
-            except ValueError:
+    @staticmethod
+    def _iter_bullet_texts(cell: dict) -> Iterator[str]:
+        for record in cell.get('content', ()):
+            paragraph = record.get('paragraph', {})
+            if 'bullet' not in paragraph or not paragraph.get('elements'):
                 continue
+            yield paragraph['elements'][0].get('textRun', {}).get('content', '').strip()
 
-        return persons
-
-    def get_protocols_data(self, document_id: str) -> list[GoogleDocProtocolDTO]:
+    @classmethod
+    def iter_protocol_records(cls, document: dict) -> Iterator[ProtocolRecord]:
         """
-        Retrieves and processes protocol data from a Google Docs document.
-
-        The function extracts protocol data from a specified Google Docs document based on certain criteria,
-        such as protocol status, number, date, and persons involved. The extracted data is then formatted
-        into GoogleDocProtocolDTO objects and returned as a list.
-
-        :param document_id: The unique identifier of the Google Docs document.
-        :return: A list of GoogleDocProtocolDTO objects representing the extracted protocol data.
-            If no valid protocols are found, an empty list is returned.
+        Parses protocols from a Google Docs document in one pass, yielding a lightweight record per protocol table.
+        Dates and persons are read only from checked protocols, validation is left to 'ProtocolRecord.to_dto'.
+        :param document: The document fetched with 'PROTOCOLS_FIELDS_MASK'.
+        :return: An iterator of ProtocolRecord objects in the document order.
         """
-        document: dict = self.service_docs.documents().get(documentId=document_id).execute()
-        content: list[dict] = document.get('body').get('content')
-
-        protocols = []
-        for block in content:
-            table = block.get('table')
-
+        for block in document.get('body', {}).get('content', ()):
             # If block isn't a table object, then skip it. Because a protocol should be in table view.
+            table = block.get('table')
             if not table:
                 continue
 
-            table_rows = table.get('tableRows')
-            number = self._get_text_from_cell(table_rows[2]['tableCells'][1])
-            status_text = self._get_text_from_cell(table_rows[0]['tableCells'][0])
-            status = self._convert_protocol_status_to_bool(status_text)
+            table_rows = table.get('tableRows', [])
+            number = cls._get_text_from_cell(table_rows[2]['tableCells'][1])
+            status = cls._convert_protocol_status_to_bool(cls._get_text_from_cell(table_rows[0]['tableCells'][0]))
 
-            if not number.isdigit():
-                number = None
-
-            # If status is 'checked', then create 'GoogleDocProtocolDTO' with a protocol date and persons.
-            # Else create it without a date and persons.
-            if status:
-                protocol_date = self._get_text_from_cell(table_rows[3]['tableCells'][1])
-                if not self._is_protocol_date_valid(protocol_date):
-                    protocol_date = None
-
-                persons = self._extract_persons_from_docs(table_rows[5]['tableCells'][1])
-                protocol = GoogleDocProtocolDTO(number=number, protocol_date=protocol_date, persons=persons,
-                                                status=status)
-            else:
-                protocol = GoogleDocProtocolDTO(status=status, number=number)
-
-            protocols.append(protocol)
+            if not status:
+                yield ProtocolRecord(number=number if number.isdigit() else None, status=False)
+                continue
 
-        return protocols
+            protocol_date = cls._get_text_from_cell(table_rows[3]['tableCells'][1])
+            yield ProtocolRecord(
+                number=number if number.isdigit() else None,
+                status=True,
+                protocol_date=protocol_date if cls._is_protocol_date_valid(protocol_date) else None,
+                full_names=tuple(cls._iter_bullet_texts(table_rows[5]['tableCells'][1]))
+            )
 
-    @staticmethod
-    def _get_worksheet_names(table: Spreadsheet) -> list[str]:
-        worksheets = table.worksheets()
-        return [worksheet.title for worksheet in worksheets]
+    def get_protocol_records(self, document_id: str) -> list[ProtocolRecord]:
+        """
+        Retrieves protocols from a Google Docs document. Only the text runs and bullets of the document
+        are downloaded, and pydantic DTOs are built later, only for the protocols which need processing.
+        :param document_id: The unique identifier of the Google Docs document.
+        :return: A list of ProtocolRecord objects. If no protocols are found, an empty list is returned.
+        """
+        document: dict = self.service_docs.documents().get(
+            documentId=document_id, fields=PROTOCOLS_FIELDS_MASK
+        ).execute()
+        return list(self.iter_protocol_records(document))
 
     def get_table_by_url(self, table_url: str) -> Spreadsheet:
         try:
@@ -172,20 +207,75 @@ class GoogleAPI:
             return False
 
     def check_table_requirements(self, table: Spreadsheet) -> bool:
-        sheet_names = self._get_worksheet_names(table)
-        columns = self._get_worksheet_columns(table, sheet_names[0])
-
-        required_columns = ['ФИО', 'Отметка']
-        if not all(col in columns for col in required_columns):
+        header = self._get_header(table)
+        positions = self._find_column_positions(header, REQUIRED_COLUMNS)
+        if positions is None:
             return False
 
+        self._column_positions[table.id] = positions
         return True
 
     @staticmethod
-    def _get_worksheet_columns(table: Spreadsheet, sheet_name: str) -> list[str]:
-        worksheet = table.worksheet(sheet_name)
-        columns = worksheet.get('1:1')
-        return columns[0]
+    def _get_header(table: Spreadsheet) -> list[str]:
+        """
+        Fetches the first row of the first sheet. A range without a sheet name refers to the first sheet,
+        so the sheet metadata isn't fetched.
+        """
+        response = table.values_batch_get(['1:1'], params={'valueRenderOption': 'UNFORMATTED_VALUE'})
+        rows = response['valueRanges'][0].get('values', [])
+        return [str(value).strip() for value in rows[0]] if rows else []
+
+    @staticmethod
+    def _find_column_positions(header: list[str], column_names: tuple[str, ...]) -> tuple[int, ...] | None:
+        try:
+            return tuple(header.index(name) for name in column_names)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _get_column_letter(position: int) -> str:
+        letters = ''
+        position += 1
+        while position:
+            position, remainder = divmod(position - 1, 26)
+            letters = chr(ord('A') + remainder) + letters
+        return letters
+
+    def _read_columns(self, table: Spreadsheet, column_names: tuple[str, ...]) -> list[tuple]:
+        """
+        Reads the given columns of the first sheet as rows of tuples with raw (unformatted) values.
+        The header and the columns are fetched with one 'values.batchGet' request. Positions of the columns
+        are cached per table and resolved again if the header has changed.
+        :param table: The Spreadsheet object.
+        :param column_names: The names of the columns in the header.
+        :return: A list of tuples with the values of the columns, None for empty cells.
+            An empty list if the table lacks some columns.
+        """
+        for _ in range(2):
+            positions = self._column_positions.get(table.id)
+            if positions is None:
+                positions = self._find_column_positions(self._get_header(table), column_names)
+                if positions is None:
+                    return []
+                self._column_positions[table.id] = positions
+
+            letters = [self._get_column_letter(position) for position in positions]
+            ranges = ['1:1'] + [f'{letter}2:{letter}' for letter in letters]
+            response = table.values_batch_get(
+                ranges, params={'valueRenderOption': 'UNFORMATTED_VALUE', 'majorDimension': 'COLUMNS'}
+            )
+            header_range, *column_ranges = response['valueRanges']
+
+            header = [str(column[0]).strip() if column else '' for column in header_range.get('values', [])]
+            if all(position < len(header) and header[position] == name
+                   for position, name in zip(positions, column_names)):
+                columns = [value_range.get('values', [[]])[0] for value_range in column_ranges]
+                return list(zip_longest(*columns))
+
+            # The columns have been moved since the positions were cached.
+            self._column_positions.pop(table.id, None)
+
+        return []
 
     def get_table_title(self, table_url: str) -> str:
         try:
@@ -194,6 +284,15 @@ class GoogleAPI:
         except SpreadsheetNotFound:
             raise SpreadsheetNotFound(f"table with url {table_url} not found'")
 
+    def inspect_table(self, table_url: str) -> (str, bool):
+        """
+        Opens the table once and returns its title and whether it meets the requirements.
+        :param table_url: The URL of the table.
+        :return: The title of the table and True if it has the required columns, False otherwise.
+        """
+        table = self.get_table_by_url(table_url)
+        return table.title, self.check_table_requirements(table)
+
     def get_worksheet_data(self, table_url: str, sheet_name: str) -> list[dict]:
         try:
             table = self.get_table_by_url(table_url)
@@ -209,19 +308,15 @@ class GoogleAPI:
         if len(parts) >= 2:
             return parts[0], parts[1]
 
-    @staticmethod
-    def _extract_persons_from_sheet(table: Spreadsheet, sheet_name: str) -> list[EventRegistrationTablePersonDTO]:
+    def _extract_persons_from_sheet(self, table: Spreadsheet) -> list[EventRegistrationTablePersonDTO]:
         try:
-            worksheet = table.worksheet(sheet_name)
-            rows = worksheet.get_all_records()
+            rows = self._read_columns(table, REQUIRED_COLUMNS)
 
             persons = []
-            for row in rows:
-                person_full_name = row.get('ФИО')
-                status = row.get('Отметка')
+            for person_full_name, status in rows:
                 if person_full_name and status:
                     try:
-                        person = EventRegistrationTablePersonDTO(full_name=person_full_name, status=status)
+                        person = EventRegistrationTablePersonDTO(full_name=str(person_full_name), status=status)
                         persons.append(person)
                     except ValueError:
                         continue
@@ -232,12 +327,8 @@ class GoogleAPI:
     def get_event_registration_table_data(self, table_url: str) -> EventRegistrationTableDTO:
         try:
             table = self.get_table_by_url(table_url)
-            table_title = self.get_table_title(table_url)
-            sheet_names = self._get_worksheet_names(table)
-            sheet_name = sheet_names[0]
-
-            persons = self._extract_persons_from_sheet(table, sheet_name)
-            event_registration_table = EventRegistrationTableDTO(title=table_title, table_url=table_url,
+            persons = self._extract_persons_from_sheet(table)
+            event_registration_table = EventRegistrationTableDTO(title=table.title, table_url=table_url,
                                                                  persons=persons)
 
             return event_registration_table
@@ -1,6 +1,9 @@
 from telegraph.aio import Telegraph
 
+from src.metrics import instrument
 
+
+@instrument('telegraph')
 class TelegraphAPI:
     def __init__(self):
         self.telegraph = Telegraph()
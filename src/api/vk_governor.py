@@ -0,0 +1,93 @@
+import hashlib
+import threading
+import time
+
+from src.metrics import VK_RATE_LIMIT, VK_THROTTLED
+
+
+class VkRateGovernor:
+    """
+    A thread-safe token bucket limiting the requests made with one access token.
+
+    The rate is adapted to the answers of VK: it grows by 'increase_step' after every successful request
+    up to 'max_rate', and is halved down to 'min_rate' when VK reports too many requests, then the bucket
+    is paused for the backoff delay, so every thread using the token waits.
+    """
+
+    def __init__(self, max_rate: float, min_rate: float, burst: int = 1, increase_step: float = 0.1):
+        """
+        :param max_rate: The maximum number of requests per second, the limit of VK for the token.
+        :param min_rate: The rate the governor never goes below.
+        :param burst: The number of requests which can be made at once after an idle period.
+        :param increase_step: How much the rate grows after every successful request.
+        """
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.increase_step = increase_step
+        self.rate = max_rate
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        # The number of requests made with the token since the start.
+        self.requests = 0
+        VK_RATE_LIMIT.set(self.rate)
+
+    def acquire(self):
+        """
+        Blocks until a request can be made.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                    self._updated_at = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self.requests += 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._paused_until - now
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+                VK_RATE_LIMIT.set(self.rate)
+
+    def on_throttled(self, error_code: int, delay: float):
+        """
+        Slows the requests down after VK reported too many of them.
+        :param error_code: The VK error code, used as a label of the metric.
+        :param delay: The number of seconds no request is made for.
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            VK_RATE_LIMIT.set(self.rate)
+        VK_THROTTLED.labels(code=str(error_code)).inc()
+
+
+_governors: dict[str, VkRateGovernor] = {}
+_governors_lock = threading.Lock()
+
+
+def get_vk_governor(token: str, max_rate: float, min_rate: float) -> VkRateGovernor:
+    """
+    Returns the governor of the access token, so all VkAPI objects using the same token share its limit.
+    :param token: The VK access token.
+    :param max_rate: The maximum number of requests per second, used when the governor is created.
+    :param min_rate: The minimum number of requests per second, used when the governor is created.
+    :return: The VkRateGovernor object.
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+    with _governors_lock:
+        governor = _governors.get(key)
+        if governor is None:
+            governor = _governors[key] = VkRateGovernor(max_rate=max_rate, min_rate=min_rate)
+        return governor
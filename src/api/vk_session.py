@@ -1,156 +1,264 @@
-from datetime import date
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Iterator, NamedTuple
 
 import requests
+from cachetools import TTLCache
+from src.exceptions import VkAPIError
 from src.logging_ import logger
-
-
+from src.metrics import instrument, VK_RETRIES
+from .vk_governor import get_vk_governor
+
+VK_API_URL = 'https://api.vk.com/method'
+# 6 - too many requests per second, 9 - flood control: the token must slow down.
+RATE_LIMIT_ERROR_CODES = {6, 9}
+# 10 - internal server error, worth another try.
+RETRYABLE_ERROR_CODES = RATE_LIMIT_ERROR_CODES | {10}
+# 100 - a parameter is invalid, 113 - invalid user ID: the object doesn't exist, the answer is cached too.
+NOT_FOUND_ERROR_CODES = {100, 113}
+# The maximum page sizes of the methods.
+LIKES_PAGE_SIZE = 1000
+POSTS_PAGE_SIZE = 100
+COMMENTS_PAGE_SIZE = 100
+# The number of replies returned with every top-level comment, threads with more replies are fetched separately.
+THREAD_ITEMS_COUNT = 10
+
+
+class VkObject(NamedTuple):
+    """
+    A user, a group or an application a screen name or a domain is resolved to.
+    """
+    id: int
+    screen_name: str | None
+    type: str
+
+
+class VkPost(NamedTuple):
+    id: int
+    date: datetime
+
+
+@instrument('vk')
 class VkAPI:
-    def __init__(self, token: str, version: str = '5.199'):
+    def __init__(self, token: str, version: str = '5.199', max_rate: float = 3.0, min_rate: float = 0.5,
+                 max_retries: int = 3, backoff: float = 1.0, timeout: float = 10.0, resolver_ttl: int = 24 * 60 * 60,
+                 resolver_negative_ttl: int = 10 * 60, resolver_cache_size: int = 1024):
         """
         Initializes VkAPI instance with access token and API version.
         :param token: VK access token.
         :param version: VK API version. Default is '5.199'.
+        :param max_rate: The maximum number of requests per second made with the token. Default is 3.
+        :param min_rate: The number of requests per second the rate never goes below when throttled. Default is 0.5.
+        :param max_retries: How many times a request is retried after a network or a transient VK error.
+        :param backoff: The base delay in seconds between retries, doubled on every retry.
+        :param timeout: The timeout of a request in seconds.
+        :param resolver_ttl: How long resolved screen names and groups are cached, in seconds.
+        :param resolver_negative_ttl: How long screen names and groups which don't exist are cached, in seconds.
+        :param resolver_cache_size: The maximum number of cached screen names and groups.
         """
         self.token = token
         self.version = version
-
-    def check_vk_user(self, vk_url: str) -> bool:
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.governor = get_vk_governor(token, max_rate=max_rate, min_rate=min_rate)
+        # The methods are called from threads, so the caches are guarded by a lock.
+        self._resolved: TTLCache = TTLCache(maxsize=resolver_cache_size, ttl=resolver_ttl)
+        self._unresolved: TTLCache = TTLCache(maxsize=resolver_cache_size, ttl=resolver_negative_ttl)
+        self._resolver_lock = threading.Lock()
+
+    @property
+    def requests_count(self) -> int:
         """
-        Checks if a VK profile URL is valid and corresponds to a user.
-        :param vk_url: VK profile URL.
-        :return: True if the URL is valid and corresponds to a user, False otherwise.
+        The number of requests made with the token since the start, by every VkAPI object using it.
         """
-        screen_name = vk_url.split('/')[-1]
-        params = {
-            'access_token': self.token,
-            'v': self.version,
-            'screen_name': screen_name
-        }
+        return self.governor.requests
 
-        try:
-            response = requests.get("https://api.vk.com/method/utils.resolveScreenName", params=params)
-            response.raise_for_status()
+    def _get_retry_delay(self, attempt: int, error_code: int | None = None) -> float:
+        # Flood control lasts longer than a per-second limit. The jitter keeps parallel calls from retrying at once.
+        base = self.backoff * 5 if error_code == 9 else self.backoff
+        return base * 2 ** attempt + random.uniform(0, self.backoff)
 
-            data = response.json()
-            return 'response' in data and data['response']['type'] == 'user'
-
-        except requests.exceptions.RequestException as req_err:
-            logger.error(f"Network error while checking user {vk_url}: {req_err}")
-        except ValueError as json_err:
-            logger.error(f"JSON parsing error while checking user {vk_url}: {json_err}")
-        except Exception as err:
-            logger.error(f"Unexpected error while checking user {vk_url}: {err}")
-
-        return False
+    def _request(self, method: str, **params: Any) -> Any:
+        """
+        Calls a VK API method within the rate limit of the token. All the methods used here are reads,
+        so a request failed with a network error or a retryable VK error is retried with a backoff.
+        :param method: The name of the method, e.g. 'wall.get'.
+        :param params: The parameters of the method.
+        :return: The 'response' part of the answer.
+        :raises VkAPIError: If VK returned an error which isn't retryable or the retries are exhausted.
+        :raises requests.exceptions.RequestException: If the network error persists after the retries.
+        """
+        params = {'access_token': self.token, 'v': self.version, **params}
+        attempt = 0
+        while True:
+            self.governor.acquire()
+            try:
+                response = requests.get(f'{VK_API_URL}/{method}', params=params, timeout=self.timeout)
+                response.raise_for_status()
+                data = response.json()
+            except requests.exceptions.RequestException:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._get_retry_delay(attempt))
+            else:
+                error = data.get('error')
+                if error is None:
+                    self.governor.on_success()
+                    return data['response']
+
+                error_code = error.get('error_code')
+                if error_code not in RETRYABLE_ERROR_CODES or attempt >= self.max_retries:
+                    raise VkAPIError(error_code, error.get('error_msg', ''))
+
+                delay = self._get_retry_delay(attempt, error_code)
+                if error_code in RATE_LIMIT_ERROR_CODES:
+                    # Pauses the token for every thread, the next 'acquire' waits for it.
+                    self.governor.on_throttled(error_code, delay)
+                else:
+                    time.sleep(delay)
+
+            attempt += 1
+            VK_RETRIES.labels(method=method).inc()
+
+    def _resolve(self, key: tuple[str, str], fetch: Callable[[], VkObject | None]) -> VkObject | None:
+        with self._resolver_lock:
+            if key in self._resolved:
+                return self._resolved[key]
+            if key in self._unresolved:
+                return None
 
-    def convert_vk_url_to_id(self, vk_url: str) -> int | None:
+        try:
+            vk_object = fetch()
+        except VkAPIError as vk_err:
+            if vk_err.code not in NOT_FOUND_ERROR_CODES:
+                raise
+            vk_object = None
+
+        with self._resolver_lock:
+            if vk_object is None:
+                self._unresolved[key] = True
+            else:
+                self._resolved[key] = vk_object
+                # A group can be requested by its ID and by its screen name, both point to the same entry.
+                if key[0] == 'group':
+                    self._resolved[('group', str(vk_object.id))] = vk_object
+                    if vk_object.screen_name:
+                        self._resolved[('group', vk_object.screen_name.lower())] = vk_object
+        return vk_object
+
+    def _fetch_screen_name(self, screen_name: str) -> VkObject | None:
+        response = self._request('utils.resolveScreenName', screen_name=screen_name)
+        # An unknown screen name is resolved to an empty list.
+        if not response:
+            return None
+        return VkObject(id=response['object_id'], screen_name=screen_name, type=response['type'])
+
+    def _fetch_group(self, domain: str | int) -> VkObject | None:
+        response = self._request('groups.getById', group_id=domain)
+        groups = response.get('groups')
+        if not groups:
+            return None
+        return VkObject(id=groups[0]['id'], screen_name=groups[0].get('screen_name'),
+                        type=groups[0].get('type', 'group'))
+
+    def resolve_screen_name(self, screen_name: str) -> VkObject | None:
         """
-        Converts VK profile URL to user ID.
-        :param vk_url: VK profile URL.
-        :return: User ID corresponding to the given VK profile URL.
+        Resolves a screen name to a user, a group or an application with one request. Results are cached,
+        including screen names which don't exist, so repeated checks of the same name cost nothing.
+        :param screen_name: The screen name, e.g. 'durov' or 'id1'.
+        :return: The VkObject object, or None if the screen name doesn't exist or the request failed.
         """
-        screen_name = vk_url.split('/')[-1]
-        if screen_name.isdigit():
-            return int(screen_name)
-        params = {
-            'access_token': self.token,
-            'v': self.version,
-            'screen_name': screen_name
-        }
         try:
-            response = requests.get("https://api.vk.com/method/utils.resolveScreenName", params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            return data['response']['object_id'] if 'response' in data else None
+            return self._resolve(('screen_name', screen_name.lower()), lambda: self._fetch_screen_name(screen_name))
 
+        except VkAPIError as vk_err:
+            logger.error(f"VK error while resolving screen name {screen_name}: {vk_err}")
         except requests.exceptions.RequestException as req_err:
-            logger.error(f"Network error while converting URL {vk_url} to ID: {req_err}")
+            logger.error(f"Network error while resolving screen name {screen_name}: {req_err}")
         except ValueError as json_err:
-            logger.error(f"JSON parsing error while converting URL {vk_url} to ID: {json_err}")
+            logger.error(f"JSON parsing error while resolving screen name {screen_name}: {json_err}")
         except Exception as err:
-            logger.error(f"Unexpected error while converting URL {vk_url} to ID: {err}")
+            logger.error(f"Unexpected error while resolving screen name {screen_name}: {err}")
 
         return None
 
-    def get_group_id(self, domain: str | int) -> int | None:
+    def resolve_group(self, domain: str | int) -> VkObject | None:
         """
-        Gets group ID by domain.
-        :param domain: VK group domain.
-        :return: Group ID corresponding to the given domain.
+        Gets the ID, the screen name and the type of a group with one request. Results are cached the same way
+        as in 'resolve_screen_name'.
+        :param domain: VK group domain or ID.
+        :return: The VkObject object, or None if the group doesn't exist or the request failed.
         """
-        params = {
-            'access_token': self.token,
-            'v': self.version,
-            'group_id': domain
-        }
         try:
-            response = requests.get('https://api.vk.com/method/groups.getById', params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            return data['response']['groups'][0]['id'] if 'response' in data else None
+            return self._resolve(('group', str(domain).lower()), lambda: self._fetch_group(domain))
 
+        except VkAPIError as vk_err:
+            logger.error(f"VK error while resolving group {domain}: {vk_err}")
         except requests.exceptions.RequestException as req_err:
-            logger.error(f"Network error while getting group ID for {domain}: {req_err}")
+            logger.error(f"Network error while resolving group {domain}: {req_err}")
         except ValueError as json_err:
-            logger.error(f"JSON parsing error while getting group ID for {domain}: {json_err}")
+            logger.error(f"JSON parsing error while resolving group {domain}: {json_err}")
         except Exception as err:
-            logger.error(f"Unexpected error while getting group ID for {domain}: {err}")
+            logger.error(f"Unexpected error while resolving group {domain}: {err}")
 
         return None
 
-    def get_group_screen_name(self, domain: str | int) -> str | None:
+    def check_vk_user(self, vk_url: str) -> bool:
         """
-        Gets group ID by domain.
-        :param domain: VK group domain.
-        :return: Group screen name corresponding to the given domain.
+        Checks if a VK profile URL is valid and corresponds to a user.
+        :param vk_url: VK profile URL.
+        :return: True if the URL is valid and corresponds to a user, False otherwise.
         """
-        params = {
-            'access_token': self.token,
-            'v': self.version,
-            'group_id': domain
-        }
-        try:
-            response = requests.get('https://api.vk.com/method/groups.getById', params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            return data['response']['groups'][0]['screen_name'] if 'response' in data else None
-
-        except requests.exceptions.RequestException as req_err:
-            logger.error(f"Network error while getting group screen name for {domain}: {req_err}")
-        except ValueError as json_err:
-            logger.error(f"JSON parsing error while getting group screen name for {domain}: {json_err}")
-        except Exception as err:
-            logger.error(f"Unexpected error while getting group screen name for {domain}: {err}")
+        vk_object = self.resolve_screen_name(vk_url.split('/')[-1])
+        return vk_object is not None and vk_object.type == 'user'
 
-        return None
+    def convert_vk_url_to_id(self, vk_url: str) -> int | None:
+        """
+        Converts VK profile URL to user ID.
+        :param vk_url: VK profile URL.
+        :return: User ID corresponding to the given VK profile URL.
+        """
+        screen_name = vk_url.split('/')[-1]
+        if screen_name.isdigit():
+            return int(screen_name)
+        vk_object = self.resolve_screen_name(screen_name)
+        return vk_object.id if vk_object else None
 
-    def get_group_posts_ids(self, domain: str, count: int) -> list[int]:
+    def get_group_posts(self, domain: str, since: datetime, limit: int) -> list[VkPost]:
         """
-        Gets IDs of the latest posts in a group.
+        Gets the posts of a group published since the given time, newest first. The wall is read page by page
+        and only until the first post older than 'since', a pinned post doesn't stop the reading.
         :param domain: VK group domain.
-        :param count: Number of posts ro retrieve. Default is 10.
-        :return: List of post IDs.
-        """
-        params = {
-            'access_token': self.token,
-            'v': self.version,
-            'domain': domain,
-            'count': count
-        }
+        :param since: The time of the oldest post to get.
+        :param limit: The maximum number of posts to read from the wall.
+        :return: List of VkPost objects.
+        """
+        posts = []
         try:
-            response = requests.get('https://api.vk.com/method/wall.get', params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            result = []
-            for obj in data.get('response').get('items'):
-                if obj.get('type') == 'post' and date.fromtimestamp(obj.get('date')) >= date(year=2024, month=8, day=1):
-                    result.append(obj.get('id'))
-            return result
-
+            offset = 0
+            while offset < limit:
+                response = self._request('wall.get', domain=domain, offset=offset,
+                                         count=min(POSTS_PAGE_SIZE, limit - offset))
+                items = response.get('items', [])
+                for obj in items:
+                    post_date = datetime.fromtimestamp(obj.get('date'))
+                    if post_date < since:
+                        if obj.get('is_pinned'):
+                            continue
+                        return posts
+                    if obj.get('type') == 'post':
+                        posts.append(VkPost(id=obj.get('id'), date=post_date))
+
+                offset += len(items)
+                if not items or offset >= response.get('count', 0):
+                    break
+            return posts
+
+        except VkAPIError as vk_err:
+            logger.error(f"VK error while getting posts for group {domain}: {vk_err}")
         except requests.exceptions.RequestException as req_err:
             logger.error(f"Network error while getting posts for group {domain}: {req_err}")
         except ValueError as json_err:
@@ -158,83 +266,93 @@ class VkAPI:
         except Exception as err:
             logger.error(f"Unexpected error while getting posts for group {domain}: {err}")
 
-        return []
+        return posts
 
-    def get_post_liked_ids(self, owner_id: int, item_id: int) -> list[int]:
+    def _iter_pages(self, method: str, page_size: int, **params: Any) -> Iterator[dict]:
         """
-        Gets IDs of users who liked a post.
+        Yields the responses of a method returning a list, page by page, until all items are fetched.
+        :param method: The name of the method, e.g. 'likes.getList'.
+        :param page_size: The number of items per page.
+        :param params: The parameters of the method.
+        :return: An iterator of the responses.
+        """
+        offset = 0
+        while True:
+            response = self._request(method, offset=offset, count=page_size, **params)
+            items = response.get('items', [])
+            yield response
+
+            offset += len(items)
+            # 'wall.getComments' counts comments of all levels in 'count', the ones of the requested level
+            # are in 'current_level_count'.
+            total = response.get('current_level_count', response.get('count', 0))
+            if not items or offset >= total:
+                return
+
+    def iter_post_liked_ids(self, owner_id: int, item_id: int) -> Iterator[list[int]]:
+        """
+        Yields IDs of users who liked a post, page by page.
         :param owner_id: Owner ID of the post.
         :param item_id: Post ID.
-        :return: List of user IDs who liked the post.
-        """
-        params = {
-            'access_token': self.token,
-            'v': self.version,
-            'type': 'post',
-            'owner_id': owner_id,
-            'item_id': item_id,
-            'filter': 'likes'
-        }
-        try:
-            response = requests.get('https://api.vk.com/method/likes.getList', params=params)
-            response.raise_for_status()
-
-            data = response.json()
-            return data['response']['items'] if 'response' in data else []
-
-        except requests.exceptions.RequestException as req_err:
-            logger.error(f"Network error while getting likes for post {item_id}: {req_err}")
-        except ValueError as json_err:
-            logger.error(f"JSON parsing error while getting likes for post {item_id}: {json_err}")
-        except Exception as err:
-            logger.error(f"Unexpected error while getting likes for post {item_id}: {err}")
-
-        return []
+        :return: An iterator of lists of user IDs.
+        """
+        for response in self._iter_pages('likes.getList', LIKES_PAGE_SIZE, type='post', owner_id=owner_id,
+                                         item_id=item_id, filter='likes'):
+            yield response['items']
 
-    def get_post_commented_ids(self, owner_id: int, post_id: int, comment_id: int | None = None) -> list[int]:
+    def iter_post_commented_ids(self, owner_id: int, post_id: int) -> Iterator[list[int]]:
         """
-        Gets IDs of users who commented a post.
+        Yields IDs of users who commented a post or replied to its comments, page by page.
+        Replies come with their comments, only threads longer than 'THREAD_ITEMS_COUNT' are requested separately.
+        Deleted comments have no author and are skipped.
         :param owner_id: Owner ID of the post.
         :param post_id: Post ID.
-        :param comment_id: Comment ID to start retrieving comments from. Default is None.
-        :return: List of user IDs who commented on the post.
-        """
-        params = {
-            'access_token': self.token,
-            'v': self.version,
-            'owner_id': owner_id,
-            'count': 100,
-            'post_id': post_id,
-            'comment_id': comment_id
-        }
-        try:
-            response = requests.get('https://api.vk.com/method/wall.getComments', params=params)
-            response.raise_for_status()
-
-            data = response.json()
+        :return: An iterator of lists of user IDs, an ID repeats if the user commented more than once.
+        """
+        for response in self._iter_pages('wall.getComments', COMMENTS_PAGE_SIZE, owner_id=owner_id, post_id=post_id,
+                                         thread_items_count=THREAD_ITEMS_COUNT):
             commented_ids = []
+            for comment in response['items']:
+                if 'from_id' in comment:
+                    commented_ids.append(comment['from_id'])
+
+                thread = comment.get('thread') or {}
+                thread_items = thread.get('items', [])
+                if thread.get('count', 0) > len(thread_items):
+                    for thread_response in self._iter_pages('wall.getComments', COMMENTS_PAGE_SIZE, owner_id=owner_id,
+                                                            post_id=post_id, comment_id=comment['id']):
+                        yield [reply['from_id'] for reply in thread_response['items'] if 'from_id' in reply]
+                else:
+                    commented_ids.extend(reply['from_id'] for reply in thread_items if 'from_id' in reply)
+            yield commented_ids
+
+    def get_post_liked_ids(self, owner_id: int, item_id: int) -> set[int]:
+        """
+        Gets IDs of users who liked a post.
+        :param owner_id: Owner ID of the post.
+        :param item_id: Post ID.
+        :return: Set of user IDs who liked the post.
+        :raises VkAPIError: If VK returns an error for a page.
+        :raises requests.exceptions.RequestException: If the network error persists after the retries.
+        """
+        liked_ids = set()
+        for page in self.iter_post_liked_ids(owner_id, item_id):
+            liked_ids.update(page)
+        return liked_ids
 
-            if 'response' in data:
-                for post in data['response']['items']:
-                    try:
-                        if post['thread']['count'] == 1:
-                            commented_ids.append(*self.get_post_commented_ids(owner_id, post_id, post['id']))
-                        elif post['thread']['count'] > 1:
-                            commented_ids.extend(self.get_post_commented_ids(owner_id, post_id, post['id']))
-                        else:
-                            commented_ids.append(post['from_id'])
-                    except KeyError:
-                        commented_ids.append(post['from_id'])
-            return commented_ids
-
-        except requests.exceptions.RequestException as req_err:
-            logger.error(f"Network error while getting comments for post {post_id}: {req_err}")
-        except ValueError as json_err:
-            logger.error(f"JSON parsing error while getting comments for post {post_id}: {json_err}")
-        except Exception as err:
-            logger.error(f"Unexpected error while getting comments for post {post_id}: {err}")
-
-        return []
+    def get_post_commented_ids(self, owner_id: int, post_id: int) -> set[int]:
+        """
+        Gets IDs of users who commented a post.
+        :param owner_id: Owner ID of the post.
+        :param post_id: Post ID.
+        :return: Set of user IDs who commented on the post.
+        :raises VkAPIError: If VK returns an error for a page.
+        :raises requests.exceptions.RequestException: If the network error persists after the retries.
+        """
+        commented_ids = set()
+        for page in self.iter_post_commented_ids(owner_id, post_id):
+            commented_ids.update(page)
+        return commented_ids
 
     @staticmethod
     def get_post_url(owner_id: int, post_id: int) -> str:
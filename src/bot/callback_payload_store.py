@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import time
+from datetime import datetime, timedelta
+
+from cachetools import TTLCache
+
+from src.database import Database
+from src.logging_ import logger
+
+
+class CallbackPayloadStore:
+    """
+    Keeps the payloads of buttons which don't fit into callback data in the 'callback_payloads' table,
+    so the buttons keep working after a restart and on every bot instance.
+
+    Packing is synchronous, so a new payload is put into a local cache at once and written to the table
+    in batches every 'flush_interval' seconds. A payload missing from the cache is loaded by 'load'
+    before the callback data is unpacked. A payload is kept for 'ttl' seconds since it was packed last time.
+    """
+
+    def __init__(self, maxsize: int = 10_000, cache_ttl: float = 60 * 60):
+        # Payloads are keyed by their hash, so a cached one is never stale.
+        self._cache: TTLCache[str, bytes] = TTLCache(maxsize=maxsize, ttl=cache_ttl)
+        self._pending: dict[str, bytes] = {}
+        self._lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self.db: Database | None = None
+        self.ttl = timedelta(days=7)
+        self.flush_interval = 1.0
+        self.expiry_interval = 60 * 60
+        self._swept_at = time.monotonic()
+
+    def put(self, key: str, payload: bytes):
+        self._cache[key] = payload
+        self._pending[key] = payload
+
+    def get(self, key: str) -> bytes | None:
+        # A pending payload may already be evicted from the cache.
+        return self._cache.get(key) or self._pending.get(key)
+
+    async def load(self, key: str) -> bytes | None:
+        """
+        Returns the payload from the cache, or reads it from the table and caches it.
+        :param key: The key of the payload.
+        :return: The payload, or None if it's unknown or expired.
+        """
+        payload = self.get(key)
+        if payload is None and self.db is not None:
+            payload = await self.db.get_callback_payload(key)
+            if payload is not None:
+                self._cache[key] = payload
+        return payload
+
+    def start(self, db: Database, ttl: timedelta, flush_interval: float):
+        """
+        Starts writing the payloads to the table, the ones packed before are written too.
+        """
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # An empty context, so the task isn't bound to the trace or the identity map of any update.
+        self._flush_task = asyncio.create_task(self._flush_loop(), context=contextvars.Context())
+
+    async def flush(self):
+        """
+        Writes the new payloads to the table in one statement, then deletes expired ones
+        if 'expiry_interval' seconds passed since the last time.
+        :return: None.
+        """
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            if pending:
+                expires_at = datetime.now() + self.ttl
+                try:
+                    await self.db.upsert_callback_payloads([
+                        {'key': key, 'payload': payload, 'expires_at': expires_at}
+                        for key, payload in pending.items()
+                    ])
+                except Exception:
+                    # Retried on the next flush.
+                    self._pending = pending | self._pending
+                    raise
+
+            if time.monotonic() - self._swept_at >= self.expiry_interval:
+                await self.db.delete_expired_callback_payloads()
+                self._swept_at = time.monotonic()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error while writing callback payloads: {e}")
+
+    async def close(self):
+        """
+        Stops the background writing and writes the pending payloads.
+        """
+        if self._flush_task is None:
+            return
+        self._flush_task.cancel()
+        try:
+            await self._flush_task
+        except asyncio.CancelledError:
+            pass
+        self._flush_task = None
+
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error while writing callback payloads on close: {e}")
+
+
+callback_payload_store = CallbackPayloadStore()
@@ -1,29 +1,68 @@
+from datetime import datetime, timedelta
+
 from aiogram.types import CallbackQuery
 from aiogram import Router, F
 
-from src.database import Database
+from src.database import Database, AuditLog
 from src.config_reader import settings
-from src.bot.template_engine import render_template
+from src.bot.template_engine import render_template_async
 from src.bot.utils.points_declension import points_declension
+from src.bot.utils.callback_fabrics import ActionLogsCallback
+from src.bot.keyboards.inline import get_action_logs_kb
 from src.enums import ActionType
 from src.api import TelegraphAPI
 
 router = Router()
 
+EPOCH = datetime(1970, 1, 1)
+
+
+def _pack_changed_at(changed_at: datetime) -> int:
+    """
+    Converts a timestamp of an audit log into microseconds since epoch to fit it into callback data losslessly.
+    """
+    return (changed_at - EPOCH) // timedelta(microseconds=1)
+
 
+def _unpack_changed_at(microseconds: int) -> datetime:
+    return EPOCH + timedelta(microseconds=microseconds)
+
+
+@router.callback_query(ActionLogsCallback.filter())
 @router.callback_query(F.data == "action_logs")
-async def action_logs(callback: CallbackQuery, db: Database, telegraph_api: TelegraphAPI):
+async def action_logs(callback: CallbackQuery, db: Database, telegraph_api: TelegraphAPI,
+                      callback_data: ActionLogsCallback | None = None):
     """
-    This function generates and sends a telegraph page with statistics about the top person in the GUSS-top.
+    This function generates and sends a telegraph page with a page of the action logs, newest first.
+    Only the logs of the requested page are fetched from the database.
     :param telegraph_api: The TelegraphAPI object.
     :param callback: The CallbackQuery object.
     :param db: The Database object.
+    :param callback_data: The ActionLogsCallback object addressing the page (optional, the first page by default).
     :return: None.
     """
-    audit_logs = await db.get_audit_logs(settings.ACTION_LOGS_LIMIT)
-    content = render_template("action_logs.html", audit_logs=audit_logs, action_types=ActionType,
+    before = None
+    if callback_data and callback_data.before_changed_at is not None and callback_data.before_id is not None:
+        before = (_unpack_changed_at(callback_data.before_changed_at), callback_data.before_id)
+
+    # Fetch one extra log to find out whether there is a next page.
+    audit_logs: list[AuditLog] = await db.get_audit_logs_page(settings.ACTION_LOGS_LIMIT + 1, before=before)
+    has_next = len(audit_logs) > settings.ACTION_LOGS_LIMIT
+    audit_logs = audit_logs[:settings.ACTION_LOGS_LIMIT]
+
+    if not audit_logs:
+        await callback.answer("Больше действий нет", show_alert=True)
+        return
+
+    content = await render_template_async("action_logs.html", audit_logs=audit_logs, action_types=ActionType,
                               points_declension=points_declension)
 
     page_url = await telegraph_api.create_page(title='ГУСС-топ | История действий', html_content=content)
 
-    await callback.message.answer(page_url)
+    kb = None
+    if has_next:
+        last_log = audit_logs[-1]
+        kb = get_action_logs_kb(before_changed_at=_pack_changed_at(last_log.changed_at), before_id=last_log.id)
+
+    await callback.message.answer(page_url, reply_markup=kb)
+    await callback.answer()
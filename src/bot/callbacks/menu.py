@@ -1,20 +1,25 @@
 from contextlib import suppress
+from typing import Awaitable, Callable
 
-from aiogram import Router
+from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
 
-from src.bot.utils.callback_fabrics import MenuCallback
+from src.bot.utils.callback_fabrics import MenuCallback, COMPACT_PREFIX, STORED_PREFIX
 from src.bot.handlers.menu_content import get_menu_content
+from src.bot.menu_router import MenuRouter
+from src.bot.job_queue import JobContext, job_queue
 from src.config_reader import settings
 from src.database import Database
-from src.enums import ActionType, MenuName
+from src.enums import ActionType, JobType, MenuName
 from src.bot.utils.states import AddPerson, UpdatePerson, UpdatePersonPoints, AddEventRegistrationTable
 from src.bot.utils.log_action import log_action, ContextData
-from src.api import GoogleAPI, TelegraphAPI
+from src.api import AsyncGoogleAPI, TelegraphAPI
 
 router = Router()
+# Confirm actions by the menu name, at any level. A handler returns the level and the name of the menu to show next.
+confirm_router = MenuRouter()
 
 
 async def add_person(callback: CallbackQuery, db: Database, first_name: str, last_name: str, vk_id: int,
@@ -56,7 +61,8 @@ async def delete_person(callback: CallbackQuery, db: Database, person_id: int):
     :param person_id: The ID of the person to be deleted.
     :return: None.
     """
-    person = await db.get_person(id=person_id)
+    # Loaded with the relationships 'log_action' needs, so it is served from the identity map there.
+    person = await db.get_person(id=person_id, join_committees=True, join_points=True)
 
     context_data = ContextData(person_id=person_id)
 
@@ -80,7 +86,7 @@ async def add_person_committee(callback: CallbackQuery, db: Database, person_id:
     :param committee_id: The ID of the committee.
     :return: None.
     """
-    person = await db.get_person(id=person_id)
+    person = await db.get_person(id=person_id, join_committees=True, join_points=True)
     committee = await db.get_committee(id=committee_id)
 
     context_data = ContextData(person_id=person_id)
@@ -110,9 +116,9 @@ async def update_person_committee(callback: CallbackQuery, db: Database, person_
     :param new_committee_id: The ID of the new committee.
     :return: None.
     """
-    person = await db.get_person(id=person_id)
-    current_committee = await db.get_committee(id=current_committee_id)
-    new_committee = await db.get_committee(id=new_committee_id)
+    person = await db.get_person(id=person_id, join_committees=True, join_points=True)
+    committees = await db.get_committees_by_ids([current_committee_id, new_committee_id])
+    current_committee, new_committee = committees[current_committee_id], committees[new_committee_id]
 
     context_data = ContextData(person_id=person_id)
 
@@ -139,7 +145,7 @@ async def delete_person_committee(callback: CallbackQuery, db: Database, person_
     :param committee_id: The ID of the committee.
     :return: None.
     """
-    person = await db.get_person(id=person_id)
+    person = await db.get_person(id=person_id, join_committees=True, join_points=True)
     committee = await db.get_committee(id=committee_id)
 
     context_data = ContextData(person_id=person_id)
@@ -158,70 +164,88 @@ async def delete_person_committee(callback: CallbackQuery, db: Database, person_
             raise e
 
 
-async def add_points_to_protocol_persons(db: Database, callback: CallbackQuery, committee_id: int, protocol_id: int):
+@job_queue.register(JobType.ADD_COMMITTEE_ATTENDANCE_POINTS, title='Начисление баллов за посещение комитета')
+async def add_points_to_protocol_persons(job: JobContext, committee_id: int, protocol_id: int, username: str) -> str:
     """
     Processes persons in a protocol and adds attendance points to the them based on their participation in the committee protocol.
-    :param db: The Database object for database operations.
-    :param callback: The CallbackQuery object for sending messages to the user.
+    Runs in the job queue, every person is marked before the points are added, so neither a retried job
+    nor a job run by two workers at once adds the points twice.
+    :param job: The JobContext object for database operations and progress reporting.
     :param committee_id: The ID of the committee.
     :param protocol_id: The ID of the protocol.
-    :return: None.
+    :param username: The username of the admin who started the job.
+    :return: The text of the final progress message.
     """
+    db = job.db
     protocol_persons = await db.get_protocol_persons(protocol_id=protocol_id, points_added=False)
-    for protocol_person in protocol_persons:
-        matched_person_id = protocol_person.matched_person_id
-        if not matched_person_id:
-            continue
+    matched_persons = [person for person in protocol_persons if person.matched_person_id]
 
-        await add_committee_attendance_points(callback=callback, db=db, person_id=matched_person_id,
-                                              protocol_id=protocol_id, committee_id=committee_id)
-        await db.update_points_added_mark_in_protocol_person(protocol_person.id)
+    attendance_category = await db.get_category(name='Посещаемость')
+    committee_name = await db.get_committee_name(committee_id)
+    protocol_date = await db.get_protocol_date(protocol_id)
+    comment = f"Посещение {committee_name} за {protocol_date}"
 
-    with suppress(TelegramBadRequest):
-        await callback.answer('Баллы за посещение комитета успешно добавлены', show_alert=True)
+    for done, protocol_person in enumerate(matched_persons, start=1):
+        if await db.claim_points_of_protocol_person(protocol_person.id):
+            await add_attendance_points(
+                db=db, username=username, person_id=protocol_person.matched_person_id,
+                category_id=attendance_category.id, points=settings.COMMITTEE_ATTENDANCE_POINTS, comment=comment,
+                unmark=lambda: db.update_points_added_mark_in_protocol_person(protocol_person.id, mark=False)
+            )
+        await job.report_progress(done, len(matched_persons))
 
+    return 'Баллы за посещение комитета успешно добавлены'
 
-async def add_points_to_table_persons(db: Database, callback: CallbackQuery, table_id: int, points: int):
+
+@job_queue.register(JobType.ADD_EVENT_ATTENDANCE_POINTS, title='Начисление баллов за посещение мероприятия')
+async def add_points_to_table_persons(job: JobContext, table_id: int, points: int, username: str) -> str:
+    db = job.db
     table_title = await db.get_event_registration_table_title(id=table_id)
 
     table_persons = await db.get_event_registration_table_persons(table_id=table_id, points_added=False)
+    matched_persons = [person for person in table_persons if person.matched_person_id]
 
-    for table_person in table_persons:
-        matched_person_id = table_person.matched_person_id
-        if not matched_person_id:
-            continue
-
-        await add_event_attendance_points(callback=callback, db=db, person_id=matched_person_id, event=table_title,
-                                          points=points)
-        await db.update_points_added_mark_in_table_person(table_person.id)
-
-    with suppress(TelegramBadRequest):
-        await callback.answer('Баллы за посещение мероприятия успешно добавлены', show_alert=True)
-
-
-async def add_committee_attendance_points(callback: CallbackQuery, db: Database, protocol_id: int,
-                                          person_id: int, committee_id: int):
     attendance_category = await db.get_category(name='Посещаемость')
-    committee_name = await db.get_committee_name(committee_id)
-    protocol_date = await db.get_protocol_date(protocol_id)
-
-    comment = f"Посещение {committee_name} за {protocol_date}"
-    context_data = ContextData(person_id=person_id, comment=comment)
-
-    async with log_action(db=db, action_type=ActionType.UPDATE_PERSON_POINTS, username=callback.from_user.username,
-                          context_data=context_data):
-        await db.update_person_points(person_id, attendance_category.id, settings.COMMITTEE_ATTENDANCE_POINTS)
-
+    comment = f"Посещение {table_title}"
+
+    for done, table_person in enumerate(matched_persons, start=1):
+        if await db.claim_points_of_table_person(table_person.id):
+            await add_attendance_points(
+                db=db, username=username, person_id=table_person.matched_person_id,
+                category_id=attendance_category.id, points=points, comment=comment,
+                unmark=lambda: db.update_points_added_mark_in_table_person(table_person.id, mark=False)
+            )
+        await job.report_progress(done, len(matched_persons))
 
-async def add_event_attendance_points(callback: CallbackQuery, db: Database, person_id: int, event: str, points: int):
-    attendance_category = await db.get_category(name='Посещаемость')
+    return 'Баллы за посещение мероприятия успешно добавлены'
 
-    comment = f"Посещение {event}"
-    context_data = ContextData(person_id=person_id, comment=comment)
 
-    async with log_action(db=db, action_type=ActionType.UPDATE_PERSON_POINTS, username=callback.from_user.username,
-                          context_data=context_data):
-        await db.update_person_points(person_id, attendance_category.id, points)
+async def add_attendance_points(db: Database, username: str, person_id: int, category_id: int, points: int,
+                                comment: str, unmark: Callable[[], Awaitable[None]]):
+    """
+    Adds attendance points to a person whose record is already marked with 'points_added'.
+    If adding the points fails, the mark is removed, so a retried job adds them. Once the points are added,
+    the mark stays even if writing the audit log fails, and it stays if the job is cancelled, as it's unknown
+    then whether the points were added: the points may be lost, but they are never added twice.
+    :param db: The Database object.
+    :param username: The username of the admin who started the job.
+    :param person_id: The ID of the person.
+    :param category_id: The ID of the attendance category.
+    :param points: The number of points to add.
+    :param comment: The comment of the audit log.
+    :param unmark: Removes the 'points_added' mark of the record.
+    :return: None.
+    """
+    points_added = False
+    try:
+        async with log_action(db=db, action_type=ActionType.UPDATE_PERSON_POINTS, username=username,
+                              context_data=ContextData(person_id=person_id, comment=comment)):
+            await db.update_person_points(person_id, category_id, points)
+            points_added = True
+    except Exception:
+        if not points_added:
+            await unmark()
+        raise
 
 
 async def update_person_points(callback: CallbackQuery, db: Database, person_id: int, category_id: int, new_value: int,
@@ -236,7 +260,7 @@ async def update_person_points(callback: CallbackQuery, db: Database, person_id:
     :param comment: The comment for the update.
     :return: None.
     """
-    person = await db.get_person(id=person_id)
+    person = await db.get_person(id=person_id, join_committees=True, join_points=True)
     category = await db.get_category(id=category_id)
 
     context_data = ContextData(person_id=person_id, comment=comment)
@@ -265,7 +289,7 @@ async def update_first_name(callback: CallbackQuery, db: Database, person_id: in
     :param new_first_name: The new first name.
     :return: None.
     """
-    person = await db.get_person(id=person_id)
+    person = await db.get_person(id=person_id, join_committees=True, join_points=True)
 
     context_data = ContextData(person_id=person_id)
 
@@ -292,7 +316,7 @@ async def update_last_name(callback: CallbackQuery, db: Database, person_id: int
     :param new_last_name: The new last name.
     :return: None.
     """
-    person = await db.get_person(id=person_id)
+    person = await db.get_person(id=person_id, join_committees=True, join_points=True)
 
     context_data = ContextData(person_id=person_id)
 
@@ -321,11 +345,15 @@ async def update_state(cur_state: FSMContext, new_state: str, callback: Callback
     :return: The new state set in the FSM context.
     """
     await cur_state.set_state(new_state)
-    await cur_state.update_data(callback=callback)
-    await cur_state.update_data(callback_data=callback_data)
+    # Only JSON values are kept: the menu is restored from them by 'update_user_menu'.
+    await cur_state.update_data(
+        callback_data=callback_data.model_dump(mode='json'),
+        menu_message={'chat_id': callback.message.chat.id, 'message_id': callback.message.message_id}
+    )
     return await cur_state.get_state()
 
 
+@confirm_router.register(MenuName.CONFIRM_ADD_PERSON)
 async def handle_confirm_add_person(callback: CallbackQuery, db: Database, state: FSMContext,
                                     fsm_data: dict) -> (int, MenuName):
     first_name = fsm_data.get('first_name')
@@ -338,6 +366,7 @@ async def handle_confirm_add_person(callback: CallbackQuery, db: Database, state
     return 0, MenuName.START
 
 
+@confirm_router.register(MenuName.CONFIRM_UPDATE_FIRST_NAME)
 async def handle_confirm_update_first_name(callback: CallbackQuery, db: Database, state: FSMContext,
                                            callback_data: MenuCallback, fsm_data: dict) -> (int, MenuName):
     person_id = callback_data.person_id
@@ -348,6 +377,7 @@ async def handle_confirm_update_first_name(callback: CallbackQuery, db: Database
     return 4, MenuName.PERSON
 
 
+@confirm_router.register(MenuName.CONFIRM_UPDATE_LAST_NAME)
 async def handle_confirm_update_last_name(callback: CallbackQuery, db: Database, state: FSMContext,
                                           callback_data: MenuCallback, fsm_data: dict) -> (int, MenuName):
     person_id = callback_data.person_id
@@ -358,6 +388,7 @@ async def handle_confirm_update_last_name(callback: CallbackQuery, db: Database,
     return 4, MenuName.PERSON
 
 
+@confirm_router.register(MenuName.CONFIRM_DELETE_PERSON)
 async def handle_confirm_delete_person(callback: CallbackQuery, db: Database,
                                        callback_data: MenuCallback) -> (int, MenuName):
     person_id = callback_data.person_id
@@ -366,15 +397,20 @@ async def handle_confirm_delete_person(callback: CallbackQuery, db: Database,
     return 2, MenuName.COMMITTEE
 
 
-async def handle_confirm_add_committee_attendance_points(callback: CallbackQuery, db: Database,
+@confirm_router.register(MenuName.ADD_COMMITTEE_ATTENDANCE_POINTS)
+async def handle_confirm_add_committee_attendance_points(callback: CallbackQuery,
                                                          callback_data: MenuCallback) -> (int, MenuName):
     committee_id = callback_data.committee_id
     protocol_id = callback_data.protocol_id
 
-    await add_points_to_protocol_persons(db=db, callback=callback, committee_id=committee_id, protocol_id=protocol_id)
+    # Large protocols take longer than a callback may wait, so the points are added in the job queue.
+    await job_queue.enqueue(JobType.ADD_COMMITTEE_ATTENDANCE_POINTS, idempotency_key=f'protocol:{protocol_id}',
+                            chat_id=callback.message.chat.id, committee_id=committee_id, protocol_id=protocol_id,
+                            username=callback.from_user.username)
     return 4, MenuName.PROTOCOL
 
 
+@confirm_router.register(MenuName.CONFIRM_ADD_PERSON_COMMITTEE)
 async def handle_confirm_add_person_committee(callback: CallbackQuery, db: Database,
                                               callback_data: MenuCallback) -> (int, MenuName):
     person_id = callback_data.person_id
@@ -384,6 +420,7 @@ async def handle_confirm_add_person_committee(callback: CallbackQuery, db: Datab
     return 4, MenuName.PERSON
 
 
+@confirm_router.register(MenuName.CONFIRM_UPDATE_PERSON_COMMITTEE)
 async def handle_confirm_update_person_committee(callback: CallbackQuery, db: Database,
                                                  callback_data: MenuCallback) -> (int, MenuName):
     person_id = callback_data.person_id
@@ -396,6 +433,7 @@ async def handle_confirm_update_person_committee(callback: CallbackQuery, db: Da
     return 4, MenuName.PERSON
 
 
+@confirm_router.register(MenuName.CONFIRM_DELETE_PERSON_COMMITTEE)
 async def handle_confirm_delete_person_committee(callback: CallbackQuery, db: Database,
                                                  callback_data: MenuCallback) -> (int, MenuName):
     person_id = callback_data.person_id
@@ -406,6 +444,7 @@ async def handle_confirm_delete_person_committee(callback: CallbackQuery, db: Da
     return 4, MenuName.PERSON
 
 
+@confirm_router.register(MenuName.CONFIRM_UPDATE_PERSON_POINTS)
 async def handle_confirm_update_points(callback: CallbackQuery, db: Database, fsm_data: dict,
                                        callback_data: MenuCallback) -> (int, MenuName):
     person_id = callback_data.person_id
@@ -417,6 +456,7 @@ async def handle_confirm_update_points(callback: CallbackQuery, db: Database, fs
     return 4, MenuName.PERSON
 
 
+@confirm_router.register(MenuName.CONFIRM_ADD_EVENT_REGISTRATION_TABLE)
 async def handle_confirm_add_event_registration_table(callback: CallbackQuery, db: Database, callback_data: MenuCallback,
                                                       fsm_data: dict) -> (int, MenuName):
     table_url = fsm_data.get('table_url')
@@ -428,12 +468,15 @@ async def handle_confirm_add_event_registration_table(callback: CallbackQuery, d
     return 1, MenuName.EVENT_REGISTRATION_TABLES_MAIN
 
 
-async def handle_confirm_add_event_attendance_points(callback: CallbackQuery, db: Database,
+@confirm_router.register(MenuName.CONFIRM_ADD_EVENT_ATTENDANCE_POINTS)
+async def handle_confirm_add_event_attendance_points(callback: CallbackQuery,
                                                      callback_data: MenuCallback) -> (int, MenuName):
     table_id = callback_data.table_id
     edit_points = callback_data.edit_points
 
-    await add_points_to_table_persons(db=db, callback=callback, table_id=table_id, points=edit_points)
+    await job_queue.enqueue(JobType.ADD_EVENT_ATTENDANCE_POINTS, idempotency_key=f'event_table:{table_id}',
+                            chat_id=callback.message.chat.id, table_id=table_id, points=edit_points,
+                            username=callback.from_user.username)
     return 3, MenuName.EVENT_REGISTRATION_TABLE
 
 
@@ -468,48 +511,9 @@ async def handle_fsm_state(state: FSMContext, is_back_button: bool) -> (str, dic
     return current_state, fsm_data
 
 
-async def adapt_handler(handler, callback: CallbackQuery, db: Database, callback_data: MenuCallback,
-                        state: FSMContext, fsm_data: dict):
-    """
-    Adapts the handler to accept only the arguments it needs.
-    """
-    handler_params = handler.__code__.co_varnames
-
-    args = {
-        'callback': callback,
-        'db': db
-    }
-
-    if 'callback_data' in handler_params:
-        args['callback_data'] = callback_data
-
-    if 'state' in handler_params:
-        args['state'] = state
-
-    if 'fsm_data' in handler_params:
-        args['fsm_data'] = fsm_data
-
-    return await handler(**args)
-
-
-CONFIRM_HANDLERS = {
-    MenuName.CONFIRM_ADD_PERSON: handle_confirm_add_person,
-    MenuName.CONFIRM_UPDATE_FIRST_NAME: handle_confirm_update_first_name,
-    MenuName.CONFIRM_UPDATE_LAST_NAME: handle_confirm_update_last_name,
-    MenuName.ADD_COMMITTEE_ATTENDANCE_POINTS: handle_confirm_add_committee_attendance_points,
-    MenuName.CONFIRM_DELETE_PERSON: handle_confirm_delete_person,
-    MenuName.CONFIRM_ADD_PERSON_COMMITTEE: handle_confirm_add_person_committee,
-    MenuName.CONFIRM_UPDATE_PERSON_COMMITTEE: handle_confirm_update_person_committee,
-    MenuName.CONFIRM_DELETE_PERSON_COMMITTEE: handle_confirm_delete_person_committee,
-    MenuName.CONFIRM_UPDATE_PERSON_POINTS: handle_confirm_update_points,
-    MenuName.CONFIRM_ADD_EVENT_REGISTRATION_TABLE: handle_confirm_add_event_registration_table,
-    MenuName.CONFIRM_ADD_EVENT_ATTENDANCE_POINTS: handle_confirm_add_event_attendance_points
-}
-
-
 @router.callback_query(MenuCallback.filter())
 async def user_menu(callback: CallbackQuery, callback_data: MenuCallback, db: Database, state: FSMContext,
-                    google_api: GoogleAPI | None = None, telegraph_api: TelegraphAPI | None = None):
+                    google_api: AsyncGoogleAPI | None = None, telegraph_api: TelegraphAPI | None = None):
     """
     Handles callback queries for user menu interactions.
     :param telegraph_api:
@@ -517,7 +521,7 @@ async def user_menu(callback: CallbackQuery, callback_data: MenuCallback, db: Da
     :param callback_data: The MenuCallback object.
     :param db: The Database object.
     :param state: The FSMContext object.
-    :param google_api: The GoogleAPI object (optional).
+    :param google_api: The AsyncGoogleAPI object (optional).
     :return: None.
     """
     current_points = callback_data.current_points
@@ -534,16 +538,15 @@ async def user_menu(callback: CallbackQuery, callback_data: MenuCallback, db: Da
         current_points += edit_points
         callback_data.current_points = 0 if current_points < 0 else current_points
 
-    handler = CONFIRM_HANDLERS.get(menu_name)
-    if handler:
-        callback_data.level, callback_data.menu_name = await adapt_handler(
-            handler=handler,
-            callback=callback,
-            db=db,
-            callback_data=callback_data,
-            state=state,
-            fsm_data=fsm_data
-        )
+    confirm_result = await confirm_router.dispatch(
+        callback_data,
+        callback=callback,
+        db=db,
+        state=state,
+        fsm_data=fsm_data
+    )
+    if confirm_result:
+        callback_data.level, callback_data.menu_name = confirm_result
 
     text, kb = await get_menu_content(
         callback_data=callback_data,
@@ -562,3 +565,10 @@ async def user_menu(callback: CallbackQuery, callback_data: MenuCallback, db: Da
         )
 
         await callback.answer()
+
+
+# Registered after 'user_menu', so it only gets menu buttons whose data can't be unpacked,
+# e.g. the ones whose stored payload has expired.
+@router.callback_query(F.data.startswith(COMPACT_PREFIX) | F.data.startswith(STORED_PREFIX))
+async def expired_menu(callback: CallbackQuery):
+    await callback.answer("Меню устарело, нажмите /start", show_alert=True)
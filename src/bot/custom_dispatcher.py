@@ -5,6 +5,7 @@ from aiogram.dispatcher.event.bases import UNHANDLED
 from aiogram.types import Update, User, Message, CallbackQuery
 
 from src.logging_ import logger
+from src.tracing import start_trace
 
 
 # noinspection PyMethodMayBeStatic
@@ -16,7 +17,8 @@ class CustomDispatcher(Dispatcher):
         )
 
     async def _listen_update(self, update: Update, **kwargs) -> Any:
-        res = await super()._listen_update(update, **kwargs)
+        with start_trace("update", update_id=update.update_id, event_type=update.event_type):
+            res = await super()._listen_update(update, **kwargs)
         if res is UNHANDLED:
             bot: Bot = kwargs.get("bot")
             event_from_user: User = kwargs.get("event_from_user")
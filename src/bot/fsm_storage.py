@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import copy
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+from src.database import Database
+from src.logging_ import logger
+
+
+@dataclass
+class _Record:
+    state: str | None = None
+    data: dict[str, Any] = field(default_factory=dict)
+    expires_at: datetime = field(default_factory=datetime.now)
+    # The monotonic time until which the record is served from the cache without reading the table.
+    cached_until: float = 0.0
+
+    @property
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM storage backed by the 'fsm_states' table, so unfinished flows survive restarts.
+
+    Writes are applied to a local cache at once and flushed to the database in batches every 'flush_interval'
+    seconds. Every write extends the lifetime of the entry by 'ttl', expired entries are removed from the table
+    every 'expiry_interval' seconds.
+    Reads are served from the cache for 'cache_ttl' seconds only, misses included, then the table is read again,
+    so with several bot instances on one database, e.g. webhook replicas, the states written by one of them
+    are seen by the others after at most 'flush_interval' + 'cache_ttl' seconds.
+    The data must be JSON-serializable, keep only ids and packed callback data in it, not aiogram objects.
+    """
+
+    def __init__(self, db: Database, ttl: timedelta, flush_interval: float = 1.0, expiry_interval: float = 600.0,
+                 cache_ttl: float = 5.0):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.expiry_interval = expiry_interval
+        self._swept_at = time.monotonic()
+        self._cache: dict[str, _Record] = {}
+        self._dirty: set[str] = set()
+        self._lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._closed = False
+
+    @staticmethod
+    def _build_key(key: StorageKey) -> str:
+        parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+        if key.thread_id:
+            parts.append(str(key.thread_id))
+        if key.business_connection_id:
+            parts.append(str(key.business_connection_id))
+        parts.append(key.destiny)
+        return ":".join(parts)
+
+    async def _get_record(self, key: StorageKey) -> _Record:
+        storage_key = self._build_key(key)
+        record = self._cache.get(storage_key)
+        # A changed entry is always served from the cache, it's newer than the one in the table.
+        if record is not None and (storage_key in self._dirty or (
+                record.cached_until > time.monotonic() and record.expires_at > datetime.now())):
+            return record
+
+        fsm_state = await self.db.get_fsm_state(storage_key)
+        if fsm_state is None:
+            # Remember the miss too for a short time, an update usually reads the state more than once.
+            record = _Record(expires_at=datetime.now() + self.ttl)
+        else:
+            record = _Record(state=fsm_state.state, data=fsm_state.data, expires_at=fsm_state.expires_at)
+        record.cached_until = time.monotonic() + self.cache_ttl
+        self._cache[storage_key] = record
+        return record
+
+    def _touch(self, key: StorageKey, record: _Record):
+        storage_key = self._build_key(key)
+        record.expires_at = datetime.now() + self.ttl
+        record.cached_until = time.monotonic() + self.cache_ttl
+        self._cache[storage_key] = record
+        self._dirty.add(storage_key)
+
+        if self._flush_task is None and not self._closed:
+            # An empty context, so the task isn't bound to the trace of the update it's started in.
+            self._flush_task = asyncio.create_task(self._flush_loop(), context=contextvars.Context())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get_record(key)
+        record.data = copy.deepcopy(data)
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._get_record(key)).data)
+
+    async def flush(self):
+        """
+        Writes the changed entries to the database: non-empty ones are upserted in one statement,
+        cleared ones are deleted. Then drops the entries older than 'cache_ttl' from the cache, and expired
+        entries from the table if 'expiry_interval' seconds passed since the last time.
+        :return: None.
+        """
+        async with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            states_data, cleared_keys = [], []
+            for storage_key in dirty:
+                record = self._cache.get(storage_key)
+                if record is None or record.is_empty:
+                    cleared_keys.append(storage_key)
+                else:
+                    states_data.append({'key': storage_key, 'state': record.state, 'data': record.data,
+                                        'expires_at': record.expires_at})
+
+            try:
+                if states_data:
+                    await self.db.upsert_fsm_states(states_data)
+                if cleared_keys:
+                    await self.db.delete_fsm_states(cleared_keys)
+            except Exception:
+                # Keep the entries to retry them on the next flush unless they were changed again meanwhile.
+                self._dirty |= dirty
+                raise
+
+            now = time.monotonic()
+            for storage_key in [k for k, r in self._cache.items() if r.cached_until <= now and k not in self._dirty]:
+                del self._cache[storage_key]
+
+            if time.monotonic() - self._swept_at >= self.expiry_interval:
+                await self.db.delete_expired_fsm_states()
+                self._swept_at = time.monotonic()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error while flushing FSM states: {e}")
+
+    async def close(self) -> None:
+        """
+        Stops the background flushing and writes the pending changes. Safe to call more than once.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error while flushing FSM states on close: {e}")
@@ -2,6 +2,7 @@ from aiogram.types import Message
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
 
+import asyncio
 import re
 
 from src.database import Database
@@ -26,7 +27,8 @@ async def process_person_vk_url(message: Message, state: FSMContext, db: Databas
     :return: None.
     """
     vk_url = message.text
-    vk_id = vk_api.convert_vk_url_to_id(vk_url)
+    # VkAPI is blocking. Both calls share one cached 'utils.resolveScreenName' request.
+    vk_id = await asyncio.to_thread(vk_api.convert_vk_url_to_id, vk_url)
     error_valid = ''
 
     await state.update_data(vk_url=vk_url)
@@ -34,7 +36,7 @@ async def process_person_vk_url(message: Message, state: FSMContext, db: Databas
     if not re.match(r'https://vk\.com/[A-Za-z0-9_-]+', vk_url):
         error_valid = 'Неверный формат ссылки'
 
-    elif not vk_api.check_vk_user(vk_url):
+    elif not await asyncio.to_thread(vk_api.check_vk_user, vk_url):
         error_valid = 'Такого пользователя не существует'
 
     elif await db.check_person_exists(vk_id=vk_id):
@@ -1,22 +1,46 @@
+from contextlib import suppress
+
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramBadRequest
 
 from src.database import Database
-from src.bot.callbacks.menu import user_menu
+from src.bot.utils.callback_fabrics import MenuCallback
+from src.bot.handlers.menu_content import get_menu_content
 
 
 async def update_user_menu(db: Database, state: FSMContext, message: Message):
     """
     Updates the user menu based on current state.
+    The menu message and its callback data are taken from the FSM data saved by 'update_state'.
     :param message: The Message object that triggered the function.
     :param db: The Database object.
     :param state: The FSMContext object.
     :return: None.
     """
+    current_state = await state.get_state()
     data = await state.get_data()
-    callback = data.get('callback')
-    callback_data = data.get('callback_data')
+    callback_data_values = data.get('callback_data')
+    menu_message = data.get('menu_message')
 
     if message:
         await message.delete()
-    await user_menu(callback=callback, callback_data=callback_data, db=db, state=state)
+    if not callback_data_values or not menu_message:
+        return
+
+    callback_data = MenuCallback(**callback_data_values)
+    text, kb = await get_menu_content(
+        callback_data=callback_data,
+        fsm_data=data,
+        db=db,
+        current_state=current_state
+    )
+
+    with suppress(TelegramBadRequest):
+        await message.bot.edit_message_text(
+            text=text,
+            chat_id=menu_message['chat_id'],
+            message_id=menu_message['message_id'],
+            reply_markup=kb,
+            disable_web_page_preview=True
+        )
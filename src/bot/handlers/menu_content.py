@@ -1,3 +1,5 @@
+import asyncio
+
 from src.bot.handlers.process_event_registration_tables import process_event_registration_tables
 from src.bot.keyboards.inline import *
 from src.bot.template_engine import render_template
@@ -5,8 +7,22 @@ from src.bot.utils import Paginator, MenuCallback, get_document_process_result_u
 from src.bot.handlers.process_protocols import process_protocols
 from src.config_reader import settings
 from src.database import Database
-from src.api import GoogleAPI, TelegraphAPI
+from src.api import AsyncGoogleAPI, TelegraphAPI
 from src.enums import MenuName, DocumentType
+from src.metrics import track_menu
+from src.bot.menu_router import MenuRouter
+
+menu_router = MenuRouter()
+
+
+async def prefetch_person_committee(db: Database, person_id: int, current_person_committee_id: int, **kwargs):
+    """
+    Loads the person with committees and the person's current committee concurrently into the identity map.
+    """
+    await asyncio.gather(
+        db.get_persons_by_ids([person_id], join_committees=True),
+        db.get_committees_by_ids([current_person_committee_id])
+    )
 
 
 def get_pag_buttons(paginator: Paginator) -> dict[str, str]:
@@ -25,6 +41,7 @@ def get_pag_buttons(paginator: Paginator) -> dict[str, str]:
     return buttons
 
 
+@menu_router.register(level=0, cache_tags=())
 def start_menu(level: int, menu_name: MenuName) -> (str, InlineKeyboardMarkup):
     """
     Returns 'start' menu content.
@@ -38,6 +55,7 @@ def start_menu(level: int, menu_name: MenuName) -> (str, InlineKeyboardMarkup):
     return text, kb
 
 
+@menu_router.register(MenuName.SELECT_COMMITTEE, level=1, cache_tags=('committees',))
 async def select_committee_menu(level: int, menu_name: MenuName, db: Database) -> (str, InlineKeyboardMarkup):
     """
     Returns 'select_committee' menu content.
@@ -53,6 +71,7 @@ async def select_committee_menu(level: int, menu_name: MenuName, db: Database) -
     return text, kb
 
 
+@menu_router.register(MenuName.COMMITTEE, level=2, cache_tags=('committees',))
 async def committee_menu(level: int, menu_name: MenuName, db: Database, committee_id: int) -> (
         str, InlineKeyboardMarkup):
     """
@@ -71,13 +90,14 @@ async def committee_menu(level: int, menu_name: MenuName, db: Database, committe
     return text, kb
 
 
+@menu_router.register(MenuName.COMMITTEE_PROTOCOLS, level=3)
 async def committee_protocols_menu(
         level: int,
         menu_name: MenuName,
         db: Database,
         committee_id: int,
         page: int,
-        google_api: GoogleAPI | None = None
+        google_api: AsyncGoogleAPI | None = None
 ) -> (str, InlineKeyboardMarkup):
     """
     Returns 'committee_protocols' menu content.
@@ -86,7 +106,7 @@ async def committee_protocols_menu(
     :param db: The Database object.
     :param committee_id: The ID of the committee.
     :param page: The current page number.
-    :param google_api: The GoogleAPI object.
+    :param google_api: The AsyncGoogleAPI object.
     :return: A tuple containing the text for the menu and the keyboard markup.
     """
     committee = await db.get_committee(id=committee_id)
@@ -113,6 +133,7 @@ async def committee_protocols_menu(
     return text, kb
 
 
+@menu_router.register(MenuName.COMMITTEE_MEMBERS, level=3, cache_tags=('committees', 'persons'))
 async def committee_members_menu(level: int, menu_name: MenuName, db: Database, committee_id: int,
                                  page: int) -> (str, InlineKeyboardMarkup):
     """
@@ -145,6 +166,7 @@ async def committee_members_menu(level: int, menu_name: MenuName, db: Database,
     return text, kb
 
 
+@menu_router.register(MenuName.PERSON, level=4)
 async def person_menu(level: int, db: Database, menu_name: MenuName, person_id: int,
                       committee_id: int) -> (str, InlineKeyboardMarkup):
     """
@@ -165,6 +187,7 @@ async def person_menu(level: int, db: Database, menu_name: MenuName, person_id:
     return text, kb
 
 
+@menu_router.register(MenuName.PROTOCOL, level=4)
 async def protocol_menu(level: int, db: Database, telegraph_api: TelegraphAPI, menu_name: MenuName, protocol_id: int,
                         committee_id: int) -> (str, InlineKeyboardMarkup):
     """
@@ -196,6 +219,7 @@ async def protocol_menu(level: int, db: Database, telegraph_api: TelegraphAPI, m
     return text, kb
 
 
+@menu_router.register(MenuName.ADD_PERSON, level=1)
 def add_person_menu(level: int, menu_name: MenuName, current_state: str, fsm_data: dict) -> (str, InlineKeyboardMarkup):
     """
     Returns 'add_person' menu content.
@@ -220,6 +244,7 @@ def add_person_menu(level: int, menu_name: MenuName, current_state: str, fsm_dat
     return text, kb
 
 
+@menu_router.register(MenuName.ADD_EVENT_REGISTRATION_TABLE, level=3)
 async def add_event_registration_table_menu(db: Database, level: int, menu_name: MenuName, current_state: str,
                                             fsm_data: dict, event_type_id: int) -> (str, InlineKeyboardMarkup):
     all_valid = fsm_data.get('all_valid')
@@ -234,6 +259,7 @@ async def add_event_registration_table_menu(db: Database, level: int, menu_name:
     return text, kb
 
 
+@menu_router.register(MenuName.EVENT_REGISTRATION_TABLES_MAIN, level=1, cache_tags=())
 async def event_registration_tables_main_menu(level: int, menu_name: MenuName) -> (str, InlineKeyboardMarkup):
     text = render_template(menu_name=menu_name)
     kb = get_event_registration_tables_main_kb(level)
@@ -241,7 +267,8 @@ async def event_registration_tables_main_menu(level: int, menu_name: MenuName) -
     return text, kb
 
 
-async def event_registration_tables_menu(level: int, menu_name: MenuName, db: Database, google_api: GoogleAPI,
+@menu_router.register(MenuName.EVENT_REGISTRATION_TABLES, level=2)
+async def event_registration_tables_menu(level: int, menu_name: MenuName, db: Database, google_api: AsyncGoogleAPI,
                                          page: int) -> (str, InlineKeyboardMarkup):
     tables = await db.get_event_registration_tables()
 
@@ -263,6 +290,7 @@ async def event_registration_tables_menu(level: int, menu_name: MenuName, db: Da
     return text, kb
 
 
+@menu_router.register(MenuName.EVENT_REGISTRATION_TABLE, level=3)
 async def event_registration_table_menu(level: int, menu_name: MenuName, db: Database, table_id: int,
                                         telegraph_api: TelegraphAPI) -> (str, InlineKeyboardMarkup):
     table = await db.get_event_registration_table(id=table_id)
@@ -285,6 +313,7 @@ async def event_registration_table_menu(level: int, menu_name: MenuName, db: Dat
     return text, kb
 
 
+@menu_router.register(MenuName.UPDATE_FIRST_NAME, MenuName.UPDATE_LAST_NAME, level=5)
 async def update_person_name_menu(level: int, menu_name: MenuName, db: Database, person_id: int, fsm_data: dict,
                                   committee_id: int) -> (str, InlineKeyboardMarkup):
     """
@@ -310,6 +339,7 @@ async def update_person_name_menu(level: int, menu_name: MenuName, db: Database,
     return text, kb
 
 
+@menu_router.register(MenuName.PERSON_POINTS, level=5)
 async def person_points_menu(level: int, menu_name: MenuName, db: Database, person_id: int,
                              committee_id: int) -> (str, InlineKeyboardMarkup):
     """
@@ -329,6 +359,7 @@ async def person_points_menu(level: int, menu_name: MenuName, db: Database, pers
     return text, kb
 
 
+@menu_router.register(MenuName.PERSON_COMMITTEE, level=5, prefetch=prefetch_person_committee)
 async def person_committee_menu(
         level: int,
         menu_name: MenuName,
@@ -358,6 +389,7 @@ async def person_committee_menu(
     return text, kb
 
 
+@menu_router.register(MenuName.DELETE_PERSON, level=5)
 async def delete_person_menu(level: int, menu_name: MenuName, db: Database, person_id: int,
                              committee_id: int) -> (str, InlineKeyboardMarkup):
     """
@@ -377,6 +409,7 @@ async def delete_person_menu(level: int, menu_name: MenuName, db: Database, pers
     return text, kb
 
 
+@menu_router.register(MenuName.ADD_PERSON_COMMITTEE, level=5)
 async def add_person_committee_menu(level: int, menu_name: MenuName, db: Database, person_id: int,
                                     committee_id: int) -> (str, InlineKeyboardMarkup):
     """
@@ -397,6 +430,7 @@ async def add_person_committee_menu(level: int, menu_name: MenuName, db: Databas
     return text, kb
 
 
+@menu_router.register(MenuName.POINTS_IN_CATEGORY, level=6)
 async def points_in_category_menu(
         level: int,
         menu_name: MenuName,
@@ -437,6 +471,7 @@ async def points_in_category_menu(
     return text, kb
 
 
+@menu_router.register(MenuName.COMMENT_FOR_UPDATE_POINTS, level=7)
 async def comment_for_update_points_menu(
         level: int,
         menu_name: MenuName,
@@ -483,6 +518,7 @@ async def comment_for_update_points_menu(
     return text, kb
 
 
+@menu_router.register(MenuName.SELECT_EVENT_TYPE, level=2, cache_tags=('event_types',))
 async def select_event_type_menu(level: int, menu_name: MenuName, db: Database) -> (str, InlineKeyboardMarkup):
     event_types = await db.get_event_types()
 
@@ -492,6 +528,7 @@ async def select_event_type_menu(level: int, menu_name: MenuName, db: Database)
     return text, kb
 
 
+@menu_router.register(MenuName.UPDATE_PERSON_COMMITTEE, level=6, prefetch=prefetch_person_committee)
 async def update_person_committee_menu(
         level: int,
         menu_name: MenuName,
@@ -527,209 +564,31 @@ async def update_person_committee_menu(
     return text, kb
 
 
+@track_menu
 async def get_menu_content(
         callback_data: MenuCallback,
         fsm_data: dict | None = None,
         db: Database | None = None,
-        google_api: GoogleAPI | None = None,
+        google_api: AsyncGoogleAPI | None = None,
         telegraph_api: TelegraphAPI | None = None,
         current_state: str | None = None
 ) -> (str, InlineKeyboardMarkup):
     """
     Retrieves the menu content based on the provided callback data.
-    It handles different levels and menu names, and interacts with the database and Google API.
+    The menu is looked up in 'menu_router' by the level and the name from the callback data.
     :param callback_data: The callback data containing menu information.
     :param fsm_data: The Finite State Machine data.
     :param db: The Database object.
-    :param google_api: The GoogleAPI object.
+    :param google_api: The AsyncGoogleAPI object.
     :param telegraph_api: The TelegraphAPI object.
     :param current_state: The current state of the Finite State Machine.
     :return: The menu content as a string and an inline keyboard markup.
     """
-    level = callback_data.level
-    menu_name = callback_data.menu_name
-    committee_id = callback_data.committee_id
-    person_id = callback_data.person_id
-    protocol_id = callback_data.protocol_id
-    category_id = callback_data.category_id
-    table_id = callback_data.table_id
-    event_type_id = callback_data.event_type_id
-    current_points = callback_data.current_points
-    old_points = callback_data.old_points
-    current_person_committee_id = callback_data.current_person_committee_id
-    page = callback_data.page
-
-    if level == 0:
-        return start_menu(level=level, menu_name=menu_name)
-
-    elif level == 1:
-        if menu_name == MenuName.ADD_PERSON:
-            return add_person_menu(
-                level=level,
-                menu_name=menu_name,
-                current_state=current_state,
-                fsm_data=fsm_data
-            )
-        elif menu_name == MenuName.SELECT_COMMITTEE:
-            return await select_committee_menu(level=level, menu_name=menu_name, db=db)
-        elif menu_name == MenuName.EVENT_REGISTRATION_TABLES_MAIN:
-            return await event_registration_tables_main_menu(level=level, menu_name=menu_name)
-
-    elif level == 2:
-        if menu_name == MenuName.COMMITTEE:
-            return await committee_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                committee_id=committee_id,
-            )
-        elif menu_name == MenuName.EVENT_REGISTRATION_TABLES:
-            return await event_registration_tables_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                google_api=google_api,
-                page=page
-            )
-        elif menu_name == MenuName.SELECT_EVENT_TYPE:
-            return await select_event_type_menu(
-                db=db,
-                level=level,
-                menu_name=menu_name
-            )
-
-    elif level == 3:
-        if menu_name == MenuName.COMMITTEE_MEMBERS:
-            return await committee_members_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                committee_id=committee_id,
-                page=page
-            )
-        elif menu_name == MenuName.COMMITTEE_PROTOCOLS:
-            return await committee_protocols_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                google_api=google_api,
-                committee_id=committee_id,
-                page=page
-            )
-        elif menu_name == MenuName.EVENT_REGISTRATION_TABLE:
-            return await event_registration_table_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                table_id=table_id,
-                telegraph_api=telegraph_api
-            )
-        elif menu_name == MenuName.ADD_EVENT_REGISTRATION_TABLE:
-            return await add_event_registration_table_menu(
-                db=db,
-                level=level,
-                menu_name=menu_name,
-                event_type_id=event_type_id,
-                current_state=current_state,
-                fsm_data=fsm_data
-            )
-
-    elif level == 4:
-        if menu_name == MenuName.PERSON:
-            return await person_menu(
-                level=level,
-                db=db,
-                menu_name=menu_name,
-                person_id=person_id,
-                committee_id=committee_id
-            )
-        elif menu_name == MenuName.PROTOCOL:
-            return await protocol_menu(
-                level=level,
-                db=db,
-                menu_name=menu_name,
-                protocol_id=protocol_id,
-                committee_id=committee_id,
-                telegraph_api=telegraph_api
-            )
-
-    elif level == 5:
-        if menu_name == MenuName.PERSON_POINTS:
-            return await person_points_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                person_id=person_id,
-                committee_id=committee_id
-            )
-        elif menu_name == MenuName.PERSON_COMMITTEE:
-            return await person_committee_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                person_id=person_id,
-                committee_id=committee_id,
-                current_person_committee_id=current_person_committee_id
-            )
-        elif menu_name == MenuName.DELETE_PERSON:
-            return await delete_person_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                person_id=person_id,
-                committee_id=committee_id
-            )
-        elif menu_name == MenuName.ADD_PERSON_COMMITTEE:
-            return await add_person_committee_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                person_id=person_id,
-                committee_id=committee_id
-            )
-        elif menu_name in (MenuName.UPDATE_FIRST_NAME, MenuName.UPDATE_LAST_NAME):
-            return await update_person_name_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                person_id=person_id,
-                committee_id=committee_id,
-                fsm_data=fsm_data
-            )
-
-    elif level == 6:
-        if menu_name == MenuName.POINTS_IN_CATEGORY:
-            return await points_in_category_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                person_id=person_id,
-                category_id=category_id,
-                current_points=current_points,
-                old_points=old_points,
-                committee_id=committee_id
-            )
-        elif menu_name == MenuName.UPDATE_PERSON_COMMITTEE:
-            return await update_person_committee_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                person_id=person_id,
-                committee_id=committee_id,
-                current_person_committee_id=current_person_committee_id
-            )
-
-    elif level == 7:
-        if menu_name == MenuName.COMMENT_FOR_UPDATE_POINTS:
-            return await comment_for_update_points_menu(
-                level=level,
-                menu_name=menu_name,
-                db=db,
-                person_id=person_id,
-                category_id=category_id,
-                committee_id=committee_id,
-                current_points=current_points,
-                old_points=old_points,
-                fsm_data=fsm_data,
-                current_state=current_state
-            )
+    return await menu_router.dispatch(
+        callback_data,
+        fsm_data=fsm_data,
+        db=db,
+        google_api=google_api,
+        telegraph_api=telegraph_api,
+        current_state=current_state
+    )
@@ -1,13 +1,16 @@
 from src.config_reader import settings
 from src.schemas import EventRegistrationTablePersonDTO
 from src.database import Database
-from src.api import GoogleAPI
+from src.api import AsyncGoogleAPI
 from src.exceptions import GoogleAPIError
 from src.bot.utils import find_best_matched_person
 from gspread.exceptions import SpreadsheetNotFound
 from builtins import PermissionError
 
+from src.tracing import traced
 
+
+@traced()
 async def process_event_registration_table_persons(db: Database, table_id: int, event_type_id: int,
                                                    table_persons: list[EventRegistrationTablePersonDTO]):
     db_persons_full_names = await db.get_persons_full_names()
@@ -54,12 +57,13 @@ async def process_event_registration_table_persons(db: Database, table_id: int,
         await db.batch_update_event_registration_table_persons(to_update)
 
 
-async def process_event_registration_tables(db: Database, google_api: GoogleAPI):
+@traced()
+async def process_event_registration_tables(db: Database, google_api: AsyncGoogleAPI):
     tables = await db.get_event_registration_tables()
 
     for table in tables:
         try:
-            table_data = google_api.get_event_registration_table_data(table.table_url)
+            table_data = await google_api.get_event_registration_table_data(table.table_url)
             await process_event_registration_table_persons(db=db, table_id=table.id, table_persons=table_data.persons,
                                                            event_type_id=table.event_type_id)
 
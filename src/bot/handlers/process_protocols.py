@@ -1,10 +1,12 @@
-from src.api import GoogleAPI
+from src.api import AsyncGoogleAPI
 from src.schemas import ProtocolPersonDTO
 from src.config_reader import settings
 from src.database import Database
 from src.bot.utils import find_best_matched_person
+from src.tracing import traced
 
 
+@traced()
 async def process_protocol_persons(db: Database, protocol_id: int, protocol_persons: list[ProtocolPersonDTO],
                                    committee_id: int):
     db_protocol_persons = await db.get_protocol_persons(protocol_id=protocol_id)
@@ -73,38 +75,52 @@ async def process_protocol_persons(db: Database, protocol_id: int, protocol_pers
         await db.batch_delete_protocol_person(to_delete)
 
 
-async def process_protocols(db: Database, google_api: GoogleAPI, committee_id: int, protocol_document_id: str):
-    google_doc_protocols = google_api.get_protocols_data(protocol_document_id)
+@traced()
+async def process_protocols(db: Database, google_api: AsyncGoogleAPI, committee_id: int, protocol_document_id: str):
+    protocol_records = await google_api.get_protocol_records(protocol_document_id)
+    db_protocols = await db.get_protocols_sync_state(committee_id=committee_id)
 
     # Delete protocols which are missed in google document, but exists in database.
-    google_doc_protocol_numbers = [protocol.number for protocol in google_doc_protocols]
-    db_protocols_numbers = await db.get_protocol_numbers(committee_id=committee_id)
-    missing_protocols_numbers = set(db_protocols_numbers) - set(google_doc_protocol_numbers)
+    google_doc_protocol_numbers = [int(record.number) for record in protocol_records if record.number]
+    missing_protocols_numbers = set(db_protocols) - set(google_doc_protocol_numbers)
     for number in missing_protocols_numbers:
         await db.delete_protocol(number=number, committee_id=committee_id)
 
-    for google_doc_protocol in google_doc_protocols:
+    for protocol_record in protocol_records:
+        fingerprint = protocol_record.fingerprint
+        db_protocol = db_protocols.get(int(protocol_record.number)) if protocol_record.number else None
+
+        # Skip a protocol which hasn't changed since the last sync.
+        # Protocols with unmatched persons are matched again, as the persons could have been added since then.
+        if db_protocol and db_protocol.fingerprint == fingerprint and not db_protocol.has_unmatched_persons:
+            continue
+
+        # Persons are validated only now, one protocol at a time.
+        google_doc_protocol = protocol_record.to_dto()
+
         # If protocol's fields aren't valid, then check number exists.
         # If it exists, then delete this protocol and continue loop.
         if not google_doc_protocol.is_valid():
             if google_doc_protocol.number:
-                await db.delete_protocol(number=google_doc_protocol.number, committee_id=committee_id)
+                if db_protocol:
+                    await db.delete_protocol(id=db_protocol.id)
                 continue
 
-        db_protocol = await db.get_protocol(number=google_doc_protocol.number, committee_id=committee_id)
         protocol_number = google_doc_protocol.number
         protocol_date = google_doc_protocol.protocol_date
 
         # If a number of the google document protocol equals to a number of the database protocol
         # and dates are the same, then delete this protocol.
         # And insert a last protocol with this number.
-        if db_protocol:
-            if db_protocol.date != google_doc_protocol.protocol_date:
-                await db.delete_protocol(id=db_protocol.id)
-                db_protocol = await db.insert_protocol(protocol_number=protocol_number, protocol_date=protocol_date,
-                                                       committee_id=committee_id)
+        if db_protocol and db_protocol.date == protocol_date:
+            protocol_id = db_protocol.id
         else:
-            db_protocol = await db.insert_protocol(protocol_number=protocol_number, protocol_date=protocol_date,
-                                                   committee_id=committee_id)
+            if db_protocol:
+                await db.delete_protocol(id=db_protocol.id)
+            new_protocol = await db.insert_protocol(protocol_number=protocol_number, protocol_date=protocol_date,
+                                                    committee_id=committee_id)
+            protocol_id = new_protocol.id
 
-        await process_protocol_persons(db, db_protocol.id, google_doc_protocol.persons, committee_id)
+        await process_protocol_persons(db, protocol_id, google_doc_protocol.persons, committee_id)
+        # Saved last, so a protocol whose processing failed is processed again on the next sync.
+        await db.update_protocol_fingerprint(protocol_id=protocol_id, fingerprint=fingerprint)
@@ -1,24 +1,94 @@
+from datetime import datetime, timedelta
+
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
-from src.vk_activities_checker import VkActivitiesChecker
+from src.config_reader import settings
+from src.database import Database
+from src.database.models import VkCheckerCycle
+from src.vk_activities_checker import VkActivitiesChecker, CHECKER_NAME
 
 router = Router()
 
 
+# The state is read from the database, as the checker may be started or stopped by another bot instance.
 @router.message(Command('start_vk_activities_checker'))
-async def start_vk_activities_checker(message: Message, vk_activities_checker: VkActivitiesChecker):
-    if vk_activities_checker.task_running:
-        await message.reply('Чекер уже запущен')
-    else:
-        vk_activities_checker.start_checking()
-        await message.reply('Чекер запущен')
+async def start_vk_activities_checker(message: Message, db: Database, vk_activities_checker: VkActivitiesChecker):
+    enabled = await db.get_vk_checker_enabled(CHECKER_NAME)
+    # Called anyway, so this instance can take over the checks if the one running them stops.
+    await vk_activities_checker.start_checking()
+    await message.reply('Чекер уже запущен' if enabled else 'Чекер запущен')
 
 
 @router.message(Command('stop_vk_activities_checker'))
-async def stop_vk_activities_checker(message: Message, vk_activities_checker: VkActivitiesChecker):
-    if not vk_activities_checker.task_running:
+async def stop_vk_activities_checker(message: Message, db: Database, vk_activities_checker: VkActivitiesChecker):
+    if not await db.get_vk_checker_enabled(CHECKER_NAME):
         await message.reply('Чекер не запущен')
     else:
-        vk_activities_checker.stop_checking()
+        await vk_activities_checker.stop_checking()
         await message.reply('Чекер остановлен')
+
+
+def format_checker_status(enabled: bool, is_leader: bool, cycles: list[VkCheckerCycle]) -> str:
+    """
+    Formats the state of the checker and the statistics of its latest cycles.
+    :param enabled: Whether the checker is started.
+    :param is_leader: Whether this bot instance runs the checks.
+    :param cycles: The latest cycles, the latest first.
+    :return: The text of the status message.
+    """
+    lines = [f"Чекер {'запущен' if enabled else 'остановлен'}"]
+    if enabled:
+        lines.append(f"Проверки выполняет {'этот' if is_leader else 'другой'} экземпляр бота")
+
+    if not cycles:
+        lines.append('Циклов проверки ещё не было')
+        return '\n'.join(lines)
+
+    now = datetime.now()
+    latest = cycles[0]
+    # A cycle whose leader died never gets finished: it's marked by the next leader, or it's considered
+    # abandoned if it runs much longer than expected.
+    abandoned_after = timedelta(seconds=settings.VK_ACTIVITIES_CHECKER_TIMEOUT + settings.VK_CHECKER_CYCLE_GRACE)
+    is_running = latest.finished_at is None and latest.error is None and now - latest.started_at < abandoned_after
+    if is_running:
+        lines.append(f"Текущий цикл идёт с {latest.started_at:%d.%m.%Y %H:%M:%S} ({latest.instance})")
+    elif latest.finished_at is None:
+        lines.append(f"Цикл с {latest.started_at:%d.%m.%Y %H:%M:%S} ({latest.instance}) прерван")
+
+    # The lag is how much later than expected the next cycle starts, the pause between cycles is expected.
+    # After an abandoned cycle it's counted from its start, as its end is unknown.
+    if enabled and not is_running:
+        lag = (now - (latest.finished_at or latest.started_at)).total_seconds() - settings.VK_ACTIVITIES_CHECKER_TIMEOUT
+        lines.append(f"Отставание: {max(lag, 0):.0f} с")
+
+    finished = [cycle for cycle in cycles if cycle.finished_at is not None]
+    if not finished:
+        return '\n'.join(lines)
+
+    last = finished[0]
+    lines += [
+        '',
+        f"Последний цикл: {last.started_at:%d.%m.%Y %H:%M:%S} – {last.finished_at:%H:%M:%S}, {last.duration:.1f} с",
+        f"Запросов к ВК: {last.requests} ({last.requests / max(last.duration, 0.001):.2f} в секунду)",
+        f"Начислено активностей: {last.awards}",
+    ]
+    if last.error:
+        lines.append(f"Ошибка: {last.error}")
+
+    total_duration = sum(cycle.duration for cycle in finished)
+    lines += [
+        '',
+        f"За последние {len(finished)} циклов:",
+        f"Средняя длительность: {total_duration / len(finished):.1f} с",
+        f"Запросов к ВК в секунду: {sum(cycle.requests for cycle in finished) / max(total_duration, 0.001):.2f}",
+        f"Начислено активностей: {sum(cycle.awards for cycle in finished)}",
+    ]
+    return '\n'.join(lines)
+
+
+@router.message(Command('vk_checker_status'))
+async def vk_checker_status(message: Message, db: Database, vk_activities_checker: VkActivitiesChecker):
+    enabled = await db.get_vk_checker_enabled(CHECKER_NAME)
+    cycles = await db.get_vk_checker_cycles(limit=settings.VK_CHECKER_STATUS_CYCLES)
+    await message.reply(format_checker_status(enabled, vk_activities_checker.is_leader, cycles))
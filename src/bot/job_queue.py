@@ -0,0 +1,233 @@
+import asyncio
+from contextlib import suppress
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from src.database import Database
+from src.database.identity_map import identity_map_scope
+from src.enums import JobType, JobStatus
+from src.logging_ import logger
+
+
+@dataclass
+class JobContext:
+    """
+    What a job handler gets besides its payload: the database and a way to report progress.
+    """
+    db: Database
+    bot: Bot
+    job_id: int
+    title: str
+    chat_id: int | None
+    message_id: int | None
+    progress_interval: float = 2.0
+    _last_progress_at: float = field(default=0.0, init=False, repr=False)
+
+    async def edit_message(self, text: str):
+        if self.chat_id is None or self.message_id is None:
+            return
+        with suppress(TelegramBadRequest):
+            await self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.message_id)
+
+    async def report_progress(self, done: int, total: int):
+        """
+        Edits the progress message, at most once per 'progress_interval' seconds and always at the end.
+        :param done: The number of processed items.
+        :param total: The number of all items.
+        """
+        now = asyncio.get_running_loop().time()
+        if done < total and now - self._last_progress_at < self.progress_interval:
+            return
+        self._last_progress_at = now
+        await self.edit_message(f"{self.title}: {done} из {total}")
+
+
+JobHandler = Callable[..., Awaitable[str]]
+
+
+@dataclass(frozen=True)
+class _JobRoute:
+    handler: JobHandler
+    title: str
+
+
+class JobQueue:
+    """
+    Runs long actions in the background instead of inside the update handlers.
+
+    Jobs are kept in the 'jobs' table: a job is claimed by a worker with 'FOR UPDATE SKIP LOCKED' and leased
+    for 'lease' seconds, the lease is extended while the job runs. A job whose worker died is claimed again
+    after the lease expires. The lease is fenced by the number of attempts the job had when it was claimed:
+    if it can't be extended in time, the handler is cancelled, as another worker may have claimed the job.
+    A failed job is retried with an exponential delay up to 'max_attempts' times, so handlers must be safe
+    to run again, even at the same time with themselves, e.g. by marking every item before processing it.
+    The progress of a job is shown in a message the queue sends when the job is enqueued.
+    """
+
+    def __init__(self):
+        self._routes: dict[JobType, _JobRoute] = {}
+        self._workers: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self.db: Database | None = None
+        self.bot: Bot | None = None
+        self.lease = timedelta(seconds=60)
+        self.poll_interval = 5.0
+        self.max_attempts = 3
+        self.retry_delay = timedelta(seconds=10)
+
+    def register(self, job_type: JobType, title: str) -> Callable[[JobHandler], JobHandler]:
+        """
+        Returns a decorator which registers the handler of the job type.
+        The handler is called with the JobContext and the payload of the job as keyword arguments,
+        and returns the text the progress message ends with.
+        :param job_type: The type of the job.
+        :param title: The name of the job shown to the user.
+        """
+        def decorator(handler: JobHandler) -> JobHandler:
+            self._routes[job_type] = _JobRoute(handler=handler, title=title)
+            return handler
+
+        return decorator
+
+    def start(self, db: Database, bot: Bot, workers: int, lease: timedelta, poll_interval: float,
+              max_attempts: int, retry_delay: timedelta):
+        """
+        Starts the workers. Jobs left from the previous run are picked up too.
+        """
+        self.db = db
+        self.bot = bot
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._workers = [asyncio.create_task(self._work()) for _ in range(workers)]
+
+    async def enqueue(self, job_type: JobType, idempotency_key: str, chat_id: int, **payload: Any) -> bool:
+        """
+        Sends a progress message to the chat and queues the job. Returns at once, the job runs in a worker.
+        :param job_type: The type of the job.
+        :param idempotency_key: The key identifying the work. While a job with the key is unfinished,
+            the same job isn't queued again.
+        :param chat_id: The ID of the chat to show the progress in.
+        :param payload: The JSON-serializable arguments of the handler.
+        :return: True if the job is queued, False if the same work is already queued or running.
+        """
+        title = self._routes[job_type].title
+        message = await self.bot.send_message(chat_id=chat_id, text=f"{title}: в очереди")
+
+        job_id = await self.db.enqueue_job(job_type=job_type, idempotency_key=idempotency_key, payload=payload,
+                                           max_attempts=self.max_attempts, chat_id=chat_id,
+                                           message_id=message.message_id)
+        if job_id is None:
+            with suppress(TelegramBadRequest):
+                await message.edit_text(f"{title}: уже выполняется")
+            return False
+
+        self._wakeup.set()
+        return True
+
+    async def _work(self):
+        while True:
+            try:
+                # Cleared before claiming, so a job queued meanwhile wakes the worker up at once.
+                self._wakeup.clear()
+                claimed_at = asyncio.get_running_loop().time()
+                job = await self.db.claim_job(self.lease)
+            except Exception as e:
+                logger.error(f"Error while claiming a job: {e}")
+                job = None
+
+            if job is None:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                continue
+
+            try:
+                await self._run(job, claimed_at)
+            except Exception as e:
+                # The job stays leased and is claimed again once the lease expires.
+                logger.error(f"Error while running job {job.id}: {e}")
+
+    async def _keep_lease(self, job: Any, claimed_at: float):
+        """
+        Extends the lease of the job while it runs. Returns when the job doesn't belong to the worker anymore:
+        the lease was taken over or it couldn't be extended before it expired.
+        """
+        loop = asyncio.get_running_loop()
+        interval = self.lease.total_seconds() / 3
+        # Counted from the moment the request was sent, the lease in the database may end a bit later.
+        expires_at = claimed_at + self.lease.total_seconds()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                started_at = loop.time()
+                if not await self.db.extend_job_lease(job.id, job.attempts, self.lease):
+                    logger.error(f"Lease of job {job.id} is taken over")
+                    return
+                expires_at = started_at + self.lease.total_seconds()
+            except Exception as e:
+                logger.error(f"Error while extending the lease of job {job.id}: {e}")
+                if loop.time() + interval >= expires_at:
+                    return
+
+    @staticmethod
+    async def _call_handler(route: _JobRoute, context: JobContext, payload: dict) -> str:
+        await context.edit_message(f"{context.title}: выполняется")
+        with identity_map_scope():
+            return await route.handler(context, **payload)
+
+    async def _run(self, job: Any, claimed_at: float):
+        route = self._routes.get(job.job_type)
+        title = route.title if route else job.job_type.value
+        context = JobContext(db=self.db, bot=self.bot, job_id=job.id, title=title, chat_id=job.chat_id,
+                             message_id=job.message_id)
+
+        if route is None or job.attempts > job.max_attempts:
+            error = "No handler registered" if route is None else "Attempts exhausted"
+            await self.db.finish_job(job.id, job.attempts, JobStatus.FAILED, error=error)
+            await context.edit_message(f"{title}: не удалось выполнить")
+            return
+
+        handler_task = asyncio.create_task(self._call_handler(route, context, job.payload))
+        lease_task = asyncio.create_task(self._keep_lease(job, claimed_at))
+        try:
+            await asyncio.wait({handler_task, lease_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (handler_task, lease_task):
+                task.cancel()
+            await asyncio.gather(handler_task, lease_task, return_exceptions=True)
+
+        if handler_task.cancelled():
+            # The job may be run by another worker already, its state is left to that worker.
+            logger.error(f"Job {job.id} '{job.job_type.value}' is cancelled, its lease is lost")
+            return
+
+        error = handler_task.exception()
+        if error is not None:
+            logger.error(f"Job {job.id} '{job.job_type.value}' failed on attempt {job.attempts}: {error}")
+            if job.attempts < job.max_attempts:
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                await self.db.retry_job(job.id, job.attempts, delay=delay, error=str(error))
+                await context.edit_message(f"{title}: ошибка, повтор через {int(delay.total_seconds())} с")
+            else:
+                await self.db.finish_job(job.id, job.attempts, JobStatus.FAILED, error=str(error))
+                await context.edit_message(f"{title}: не удалось выполнить")
+        else:
+            await self.db.finish_job(job.id, job.attempts, JobStatus.DONE)
+            await context.edit_message(handler_task.result())
+
+    async def close(self):
+        """
+        Stops the workers. A job interrupted here is claimed again after its lease expires.
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+job_queue = JobQueue()
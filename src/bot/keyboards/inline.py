@@ -1,20 +1,21 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.filters.callback_data import CallbackData
 
-from src.bot.utils.callback_fabrics import MenuCallback
+from src.bot.utils.callback_fabrics import MenuCallback, ActionLogsCallback
 from src.database.models import Person, Committee, Protocol, EventRegistrationTable, EventType
 from src.enums import MenuName
 
 
-def _create_inline_button(text: str, callback_data: MenuCallback | str) -> InlineKeyboardButton:
+def _create_inline_button(text: str, callback_data: CallbackData | str) -> InlineKeyboardButton:
     """
     Creates an inline keyboard button with the given text and callback data.
     :param text: The text to be displayed on the button.
     :param callback_data: The callback data to be sent when the button is clicked.
-        If the callback data is a MenuCallback, it will be packed into a string.
+        If the callback data is a CallbackData, it will be packed into a string.
     :return:
     """
-    if isinstance(callback_data, MenuCallback):
+    if isinstance(callback_data, CallbackData):
         callback_data = callback_data.pack()
     return InlineKeyboardButton(text=text, callback_data=callback_data)
 
@@ -41,7 +42,18 @@ def get_start_kb(level: int = 0) -> InlineKeyboardMarkup:
     kb.row(_create_inline_button("Таблицы регистраций",
                                  MenuCallback(level=level + 1, menu_name=MenuName.EVENT_REGISTRATION_TABLES_MAIN)))
     kb.row(_create_inline_button("Выгрузить статистику ГУСС-топа", "guss_top_stats"))
-    kb.row(_create_inline_button("Выгрузить историю действий", "action_logs"))
+    kb.row(_create_inline_button("Выгрузить историю действий", ActionLogsCallback()))
+
+    return kb.as_markup()
+
+
+def get_action_logs_kb(before_changed_at: int, before_id: int) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+
+    kb.row(_create_inline_button(
+        "Более ранние действия",
+        ActionLogsCallback(before_changed_at=before_changed_at, before_id=before_id)
+    ))
 
     return kb.as_markup()
 
@@ -0,0 +1,53 @@
+from collections import defaultdict
+from typing import Hashable
+
+from aiogram.types import InlineKeyboardMarkup
+from cachetools import TTLCache
+
+from src.bot.utils.callback_fabrics import MenuCallback
+from src.config_reader import settings
+
+
+class MenuCache:
+    """
+    Keeps rendered content of read-only menus. Every entry is bound to the tags of the data it was built from
+    and is dropped when a write to that data is reported via 'invalidate'.
+    Entries also expire after 'ttl' seconds to catch changes made bypassing the bot, e.g. by migrations.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._entries: TTLCache[Hashable, tuple[str, InlineKeyboardMarkup]] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._keys_by_tag: defaultdict[str, set[Hashable]] = defaultdict(set)
+
+    @staticmethod
+    def make_key(callback_data: MenuCallback) -> Hashable:
+        """
+        Builds a cache key from the menu name, the level, the ids and the page of the callback data.
+        The back button flag is left out, since it doesn't change the content.
+        """
+        return tuple(callback_data.model_dump(exclude={'is_back_button'}).items())
+
+    def get(self, key: Hashable) -> tuple[str, InlineKeyboardMarkup] | None:
+        return self._entries.get(key)
+
+    def set(self, key: Hashable, content: tuple[str, InlineKeyboardMarkup], tags: tuple[str, ...]):
+        self._entries[key] = content
+        for tag in tags:
+            self._keys_by_tag[tag].add(key)
+
+    def invalidate(self, tags: tuple[str, ...]):
+        """
+        Drops every entry built from any of the given tags.
+        :param tags: The tags of the changed data.
+        :return: None.
+        """
+        for tag in tags:
+            for key in self._keys_by_tag.pop(tag, ()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_tag.clear()
+
+
+menu_cache = MenuCache(maxsize=settings.MENU_CACHE_MAXSIZE, ttl=settings.MENU_CACHE_TTL)
@@ -0,0 +1,119 @@
+import inspect
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from src.bot.menu_cache import menu_cache
+from src.bot.utils.callback_fabrics import MenuCallback
+from src.enums import MenuName
+
+Prefetch = Callable[..., Awaitable[Any]]
+
+
+@dataclass(frozen=True)
+class _Param:
+    name: str
+    from_callback_data: bool
+    has_default: bool
+
+
+@dataclass(frozen=True)
+class MenuRoute:
+    handler: Callable
+    params: tuple[_Param, ...]
+    is_coroutine: bool
+    cache_tags: tuple[str, ...] | None = None
+    prefetch: Prefetch | None = None
+
+
+class MenuRouter:
+    """
+    Maps a level and a MenuName of the callback data to a handler.
+
+    The arguments of a handler are resolved by their names once, at registration: fields of MenuCallback
+    are taken from the callback data, anything else (db, google_api, fsm_data, ...) from the resources
+    passed to 'dispatch'. Resources missing in a call are skipped if the handler has a default for them.
+    """
+
+    def __init__(self):
+        self._routes: dict[tuple[int | None, MenuName | None], MenuRoute] = {}
+
+    def register(self, *menu_names: MenuName, level: int | None = None, cache_tags: tuple[str, ...] | None = None,
+                 prefetch: Prefetch | None = None) -> Callable[[Callable], Callable]:
+        """
+        Returns a decorator which registers the handler for the given menu names.
+        :param menu_names: The names of the menus. If empty, the handler serves every menu of the level.
+        :param level: The level of the menus. If None, the handler serves the menus at any level.
+        :param cache_tags: If set, the result is kept in the menu cache and invalidated by these tags.
+        :param prefetch: A coroutine function called with the same arguments as the handler before it,
+            e.g. to load the needed objects in one query.
+        """
+        def decorator(handler: Callable) -> Callable:
+            params = tuple(
+                _Param(name=name, from_callback_data=name in MenuCallback.model_fields,
+                       has_default=param.default is not inspect.Parameter.empty)
+                for name, param in inspect.signature(handler).parameters.items()
+            )
+            route = MenuRoute(handler=handler, params=params, is_coroutine=inspect.iscoroutinefunction(handler),
+                              cache_tags=cache_tags, prefetch=prefetch)
+            for menu_name in menu_names or (None,):
+                self._routes[(level, menu_name)] = route
+            return handler
+
+        return decorator
+
+    @property
+    def menu_names(self) -> set[MenuName]:
+        """
+        The names of the menus registered explicitly, i.e. not as a fallback for a level.
+        """
+        return {menu_name for _, menu_name in self._routes if menu_name is not None}
+
+    def resolve(self, level: int, menu_name: MenuName) -> MenuRoute | None:
+        return (
+            self._routes.get((level, menu_name))
+            or self._routes.get((None, menu_name))
+            or self._routes.get((level, None))
+        )
+
+    @staticmethod
+    def _build_kwargs(route: MenuRoute, callback_data: MenuCallback, resources: dict[str, Any]) -> dict[str, Any]:
+        kwargs = {}
+        for param in route.params:
+            if param.from_callback_data:
+                kwargs[param.name] = getattr(callback_data, param.name)
+            elif param.name in resources:
+                kwargs[param.name] = resources[param.name]
+            elif not param.has_default:
+                raise TypeError(f"Handler '{route.handler.__name__}' requires '{param.name}'")
+        return kwargs
+
+    async def dispatch(self, callback_data: MenuCallback, **resources: Any) -> Any:
+        """
+        Calls the handler registered for the callback data, or returns None if there is none.
+        Results of the handlers registered with cache tags are served from the menu cache when possible.
+        :param callback_data: The MenuCallback object.
+        :param resources: The objects the handlers may depend on, e.g. db or fsm_data.
+        :return: The result of the handler.
+        """
+        route = self.resolve(callback_data.level, callback_data.menu_name)
+        if route is None:
+            return None
+
+        key = None
+        if route.cache_tags is not None:
+            key = menu_cache.make_key(callback_data)
+            cached = menu_cache.get(key)
+            if cached is not None:
+                return cached
+
+        kwargs = self._build_kwargs(route, callback_data, {'callback_data': callback_data, **resources})
+        if route.prefetch is not None:
+            await route.prefetch(**kwargs)
+
+        result = route.handler(**kwargs)
+        if route.is_coroutine:
+            result = await result
+
+        if key is not None:
+            menu_cache.set(key, result, route.cache_tags)
+        return result
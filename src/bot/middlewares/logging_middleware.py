@@ -1,16 +1,46 @@
 from src.logging_ import logger
+from src.metrics import HANDLER_LATENCY, ERRORS
+from src.tracing import span
 
 import asyncio
+import functools
 import logging
 import os
 import inspect
-from typing import Callable, Dict, Any, Awaitable, Optional
+from typing import Callable, Dict, Any, Awaitable, Optional, NamedTuple
 
 from aiogram import BaseMiddleware
 from aiogram.dispatcher.event.handler import HandlerObject
 from aiogram.types import TelegramObject, CallbackQuery, Message
 
 
+class HandlerMeta(NamedTuple):
+    func_name: str
+    pathname: str
+    relative_path: str
+    lineno: int
+
+
+@functools.lru_cache(maxsize=None)
+def get_handler_meta(callback: Callable) -> HandlerMeta:
+    """
+    Returns a name, a path and a first line of the handler's callback.
+    It is computed once per callback from the code object, so source files are never read.
+    :param callback: The callback of the handler.
+    :return: The HandlerMeta object.
+    """
+    func = inspect.unwrap(callback)
+    func_name = getattr(func, '__name__', type(func).__name__)
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        pathname, lineno = code.co_filename, code.co_firstlineno
+    else:
+        pathname, lineno = inspect.getsourcefile(func) or '', inspect.getsourcelines(func)[1]
+
+    return HandlerMeta(func_name=func_name, pathname=pathname, relative_path=os.path.relpath(pathname),
+                       lineno=lineno)
+
+
 class LogAllEventsMiddleware(BaseMiddleware):
     async def __call__(
             self,
@@ -18,27 +48,26 @@ class LogAllEventsMiddleware(BaseMiddleware):
             event: TelegramObject,
             data: Dict[str, Any],
     ) -> Any:
+        # `aiogram.dispatcher.event.TelegramEventObserver.trigger` puts the matched handler into the data
+        _handler: HandlerObject | None = data.get("handler")
+        handler_name = get_handler_meta(_handler.callback).func_name if _handler is not None else "unknown"
+
         loop = asyncio.get_running_loop()
         start_time = loop.time()
-        r = await handler(event, data)
-        finish_time = loop.time()
-        duration = finish_time - start_time
         try:
-            # get to `aiogram.dispatcher.event.TelegramEventObserver.trigger` method
-            frame = inspect.currentframe()
-            frame_info = inspect.getframeinfo(frame)
-            while frame is not None:
-                if frame_info.function == "trigger":
-                    _handler = frame.f_locals.get("handler")
-                    if _handler is not None:
-                        _handler: HandlerObject
-                        record = self._create_log_record(_handler, event, data, duration=duration)
-                        logger.handle(record)
-                    break
-                frame = frame.f_back
-                frame_info = inspect.getframeinfo(frame)
+            with span(f"handler.{handler_name}"):
+                r = await handler(event, data)
+        except Exception:
+            ERRORS.labels(source="handler", name=handler_name).inc()
+            raise
         finally:
-            del frame
+            finish_time = loop.time()
+            duration = finish_time - start_time
+            HANDLER_LATENCY.labels(handler=handler_name).observe(duration)
+
+        if _handler is not None:
+            record = self._create_log_record(_handler, event, data, duration=duration)
+            logger.handle(record)
         return r
 
     @staticmethod
@@ -46,10 +75,8 @@ class LogAllEventsMiddleware(BaseMiddleware):
             handler: HandlerObject, event: TelegramObject, data: Dict[str, Any], *,
             duration: Optional[float] = None
     ) -> logging.LogRecord:
-        callback = handler.callback
-        func_name = callback.__name__
-        pathname = inspect.getsourcefile(callback)
-        lineno = inspect.getsourcelines(callback)[1]
+        handler_meta = get_handler_meta(handler.callback)
+        func_name = handler_meta.func_name
 
         event_type = type(event).__name__
         username = event.from_user.username
@@ -69,12 +96,12 @@ class LogAllEventsMiddleware(BaseMiddleware):
         record = logging.LogRecord(
             name="src.bot.middlewares.LogAllEventsMiddleware",
             level=logging.INFO,
-            pathname=pathname,
-            lineno=lineno,
+            pathname=handler_meta.pathname,
+            lineno=handler_meta.lineno,
             msg=msg,
             args=(),
             exc_info=None,
             func=func_name,
         )
-        record.relativePath = os.path.relpath(record.pathname)
+        record.relativePath = handler_meta.relative_path
         return record
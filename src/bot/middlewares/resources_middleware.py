@@ -5,11 +5,12 @@ from aiogram.types import TelegramObject
 
 from src.vk_activities_checker import VkActivitiesChecker
 from src.database.database import Database
-from src.api import VkAPI, GoogleAPI, TelegraphAPI
+from src.database.identity_map import identity_map_scope
+from src.api import VkAPI, AsyncGoogleAPI, TelegraphAPI
 
 
 class ResourcesMiddleware(BaseMiddleware):
-    def __init__(self, db: Database, vk_api: VkAPI, google_api: GoogleAPI, telegraph_api: TelegraphAPI,
+    def __init__(self, db: Database, vk_api: VkAPI, google_api: AsyncGoogleAPI, telegraph_api: TelegraphAPI,
                  vk_activities_checker: VkActivitiesChecker) -> None:
         self.db = db
         self.vk_api = vk_api
@@ -25,6 +26,7 @@ class ResourcesMiddleware(BaseMiddleware):
     ) -> Any:
         """
         Provides resources such as database, vk_api, google_api, telegraph_api.
+        The update is handled inside its own identity map, so the same rows are loaded from the database once.
         :param handler:
         :param event:
         :param data:
@@ -36,4 +38,5 @@ class ResourcesMiddleware(BaseMiddleware):
         data['telegraph_api'] = self.telegraph_api
         data['vk_activities_checker'] = self.vk_activities_checker
 
-        return await handler(event, data)
+        with identity_map_scope():
+            return await handler(event, data)
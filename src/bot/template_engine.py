@@ -1,19 +1,60 @@
-from typing import Any, Optional
+import asyncio
+from typing import Any, Iterable, Optional
 import os
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 from src.enums import MenuName
+from src.logging_ import logger
+from src.tracing import span
 
-template_folder = os.path.abspath("src/bot/menu_templates")
+template_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu_templates")
 
+# Templates are compiled once by 'precompile_templates' and never reloaded from disk afterwards.
 env = Environment(
     loader=FileSystemLoader(template_folder),
     autoescape=select_autoescape(["html"]),
     trim_blocks=True,
-    lstrip_blocks=True
+    lstrip_blocks=True,
+    auto_reload=False,
+    cache_size=-1
 )
 env.add_extension('jinja2.ext.do')
 
+# The same templates compiled for streaming rendering: loops over async iterables, e.g. database streams.
+async_env = env.overlay(enable_async=True)
+
+
+def _get_template_name(menu_name: MenuName | str) -> str:
+    name = menu_name.value if isinstance(menu_name, MenuName) else menu_name
+    if not name.endswith('.html'):
+        name += '.html'
+    return name
+
+
+def precompile_templates():
+    """
+    Compiles all templates ahead of time, so no update pays for reading and compiling a template.
+    :return: None.
+    """
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+        async_env.get_template(name)
+    logger.info(f"{len(names)} templates are compiled")
+
+
+def validate_templates(menu_names: Iterable[MenuName]):
+    """
+    Checks that every given menu has a template.
+    :param menu_names: The names of the menus.
+    :return: None.
+    :raises RuntimeError: If some templates are missing.
+    """
+    templates = set(env.list_templates(extensions=["html"]))
+    missing = sorted(name for name in map(_get_template_name, menu_names) if name not in templates)
+    if missing:
+        raise RuntimeError(f"Templates are missing in {template_folder}: {', '.join(missing)}")
+
 
 def render_template(menu_name: MenuName | str, values: Optional[dict[str, Any]] = None, **kwargs):
     """
@@ -22,16 +63,41 @@ def render_template(menu_name: MenuName | str, values: Optional[dict[str, Any]]
     :param values: Values for a template (optional).
     :param kwargs: Keyword-arguments for a template (high-priority).
     """
+    name = _get_template_name(menu_name)
 
-    name = menu_name.value if isinstance(menu_name, MenuName) else menu_name
-    if not name.endswith('.html'):
-        name += '.html'
-
-    template = env.get_template(name)
+    with span("render_template", template=name):
+        template = env.get_template(name)
 
-    if values:
-        rendered_template = template.render(values, **kwargs)
-    else:
-        rendered_template = template.render(**kwargs)
+        if values:
+            rendered_template = template.render(values, **kwargs)
+        else:
+            rendered_template = template.render(**kwargs)
 
     return rendered_template
+
+
+async def render_template_async(menu_name: MenuName | str, values: Optional[dict[str, Any]] = None, **kwargs):
+    """
+    Renders template in a thread & returns text. Use it for large reports, so they don't block other updates.
+    All the data used by the template must be loaded beforehand.
+    :param menu_name: A MenuName object meaning a name of template.
+    :param values: Values for a template (optional).
+    :param kwargs: Keyword-arguments for a template (high-priority).
+    """
+    return await asyncio.to_thread(render_template, menu_name, values, **kwargs)
+
+
+async def render_template_stream(menu_name: MenuName | str, **kwargs) -> str:
+    """
+    Renders template asynchronously & returns text. Async iterables passed to the template are consumed
+    while rendering, so rows of a database stream are never held in memory all at once.
+    :param menu_name: A MenuName object meaning a name of template.
+    :param kwargs: Keyword-arguments for a template.
+    """
+    name = _get_template_name(menu_name)
+
+    with span("render_template_stream", template=name):
+        template = async_env.get_template(name)
+        chunks = [chunk async for chunk in template.generate_async(**kwargs)]
+
+    return "".join(chunks)
@@ -7,5 +7,6 @@ async def set_bot_commands(bot: Bot):
         BotCommand(command="start", description="Главное меню"),
         BotCommand(command="start_vk_activities_checker", description="Запустить проверку активностей ВК"),
         BotCommand(command="stop_vk_activities_checker", description="Остановить проверку активностей ВК"),
+        BotCommand(command="vk_checker_status", description="Состояние проверки активностей ВК"),
     ]
     await bot.set_my_commands(commands=commands, scope=BotCommandScopeAllPrivateChats())
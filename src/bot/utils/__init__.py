@@ -1,4 +1,4 @@
-from .callback_fabrics import MenuCallback
+from .callback_fabrics import MenuCallback, ActionLogsCallback
 from .states import AddPerson, UpdatePerson, UpdatePersonPoints, AddEventRegistrationTable
 from .log_action import log_action, ContextData
 from .points_declension import points_declension
@@ -1,10 +1,69 @@
-from aiogram.filters.callback_data import CallbackData
+import base64
+import hashlib
+from enum import Enum
+from typing import Any, Literal, get_args
+
+from aiogram.filters.callback_data import CallbackData, CallbackQueryFilter
+from aiogram.types import CallbackQuery
+from magic_filter import MagicFilter
+
+from src.bot.callback_payload_store import callback_payload_store
 from src.enums import MenuName
+from src.logging_ import logger
+
+# Telegram limits callback data to 64 bytes.
+MAX_CALLBACK_DATA_LENGTH = 64
+
+COMPACT_PREFIX = "m~"
+STORED_PREFIX = "m!"
+
+
+def _write_varint(buffer: bytearray, value: int):
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(payload: bytes, pos: int) -> (int, int):
+    value, shift = 0, 0
+    while True:
+        if pos >= len(payload):
+            raise ValueError("Truncated callback data")
+        byte = payload[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _zigzag_encode(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _zigzag_decode(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def _b64encode(payload: bytes) -> str:
+    return base64.urlsafe_b64encode(payload).rstrip(b"=").decode()
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
 
 
 class MenuCallback(CallbackData, prefix="menu"):
     """
     A class representing a callback data for menu navigation.
+
+    It is packed compactly: a bitmap of fields which differ from their defaults, followed by their values as
+    varints (ints are zigzag-encoded, MenuName is its position in the enum), all base64url-encoded.
+    Payloads which still exceed the Telegram limit are kept in the 'callback_payloads' table and referenced by hash,
+    use 'MenuCallback.filter()' to load them before unpacking.
+    Buttons packed in the old colon-separated format are still accepted.
+    New MenuName members must be appended to the end of the enum to keep already sent buttons valid.
     """
     level: int
     menu_name: MenuName
@@ -21,3 +80,94 @@ class MenuCallback(CallbackData, prefix="menu"):
     current_points: int | None = None
     old_points: int | None = None
     edit_points: int | None = None
+
+    def _pack_compact(self) -> bytes:
+        values, bitmap = bytearray(), 0
+        for i, (name, field) in enumerate(self.model_fields.items()):
+            value = getattr(self, name)
+            if value == field.default and not field.is_required():
+                continue
+            bitmap |= 1 << i
+            if isinstance(value, Enum):
+                _write_varint(values, _MENU_NAMES.index(value))
+            else:
+                _write_varint(values, _zigzag_encode(int(value)))
+
+        payload = bytearray()
+        _write_varint(payload, bitmap)
+        return bytes(payload + values)
+
+    @classmethod
+    def _unpack_compact(cls, payload: bytes) -> "MenuCallback":
+        bitmap, pos = _read_varint(payload, 0)
+        kwargs: dict[str, Any] = {}
+        for i, (name, field) in enumerate(cls.model_fields.items()):
+            if not bitmap & (1 << i):
+                continue
+            value, pos = _read_varint(payload, pos)
+            field_types = get_args(field.annotation) or (field.annotation,)
+            if MenuName in field_types:
+                if value >= len(_MENU_NAMES):
+                    raise ValueError(f"Unknown menu name index {value}")
+                kwargs[name] = _MENU_NAMES[value]
+            elif bool in field_types:
+                kwargs[name] = bool(_zigzag_decode(value))
+            else:
+                kwargs[name] = _zigzag_decode(value)
+        if pos != len(payload):
+            raise ValueError("Trailing bytes in callback data")
+        return cls(**kwargs)
+
+    def pack(self) -> str:
+        payload = self._pack_compact()
+        packed = COMPACT_PREFIX + _b64encode(payload)
+        if len(packed.encode()) <= MAX_CALLBACK_DATA_LENGTH:
+            return packed
+
+        key = _b64encode(hashlib.blake2b(payload, digest_size=12).digest())
+        callback_payload_store.put(key, payload)
+        return STORED_PREFIX + key
+
+    @classmethod
+    def unpack(cls, value: str) -> "MenuCallback":
+        if value.startswith(COMPACT_PREFIX):
+            return cls._unpack_compact(_b64decode(value[len(COMPACT_PREFIX):]))
+        if value.startswith(STORED_PREFIX):
+            payload = callback_payload_store.get(value[len(STORED_PREFIX):])
+            if payload is None:
+                raise ValueError("Callback data payload has expired")
+            return cls._unpack_compact(payload)
+        return super().unpack(value)
+
+    @classmethod
+    def filter(cls, rule: MagicFilter | None = None) -> "MenuCallbackFilter":
+        return MenuCallbackFilter(callback_data=cls, rule=rule)
+
+
+class MenuCallbackFilter(CallbackQueryFilter):
+    """
+    Loads the stored payload of the callback data from the database before it's unpacked,
+    as unpacking is synchronous.
+    """
+
+    async def __call__(self, query: CallbackQuery) -> Literal[False] | dict[str, Any]:
+        if isinstance(query.data, str) and query.data.startswith(STORED_PREFIX):
+            key = query.data[len(STORED_PREFIX):]
+            try:
+                await callback_payload_store.load(key)
+            except Exception as e:
+                logger.error(f"Error while loading callback payload {key}: {e}")
+        return await super().__call__(query)
+
+
+# Aliases are skipped by iteration, so every position maps to one canonical member.
+_MENU_NAMES: list[MenuName] = list(MenuName)
+
+
+class ActionLogsCallback(CallbackData, prefix="action_logs"):
+    """
+    A class representing a callback data for browsing action logs page by page.
+    The page is addressed by a keyset of the last log on the previous page.
+    """
+    before_changed_at: int | None = None
+    before_id: int | None = None
@@ -0,0 +1,56 @@
+import asyncio
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from src.config_reader import settings
+from src.logging_ import logger
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, path: str, secret_token: str) -> web.Application:
+    """
+    Creates an aiohttp application which receives updates from Telegram.
+    Requests without the valid 'X-Telegram-Bot-Api-Secret-Token' header are rejected, accepted updates are
+    answered with 200 at once and processed in background tasks.
+    :param dp: The Dispatcher object.
+    :param bot: The Bot object.
+    :param path: The path of the webhook endpoint.
+    :param secret_token: The secret token which Telegram sends with every update.
+    :return: The aiohttp Application object.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token, handle_in_background=True).register(
+        app, path=path
+    )
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Registers the webhook in Telegram and serves updates until cancelled.
+    Pending updates are kept, so clicks made during a restart are processed after it.
+    :param dp: The Dispatcher object.
+    :param bot: The Bot object.
+    :return: None.
+    """
+    secret_token = settings.WEBHOOK_SECRET.get_secret_value()
+    app = create_webhook_app(dp, bot, path=settings.WEBHOOK_PATH, secret_token=secret_token)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, settings.WEBHOOK_HOST, settings.WEBHOOK_PORT).start()
+
+    await bot.set_webhook(
+        url=settings.webhook_url,
+        secret_token=secret_token,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False
+    )
+    logger.info(f"Webhook is listening on {settings.WEBHOOK_HOST}:{settings.WEBHOOK_PORT}{settings.WEBHOOK_PATH}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
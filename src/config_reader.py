@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
-from pydantic import SecretStr
+from pydantic import SecretStr, model_validator
+from typing import Literal
 import os
 
 
@@ -15,19 +16,74 @@ class Settings(BaseSettings):
     VK_GROUP_DOMAINS: list[int]
     PAGINATION_LOAD_LIMIT: int
     VK_GROUP_POSTS_COUNT: int
+    VK_POSTS_WINDOW_DAYS: int = 30
+    VK_RECENT_POSTS_HOURS: int = 48
+    VK_OLD_POSTS_RESCAN_INTERVAL: int = 24 * 60 * 60
     VK_LIKE_POINTS: int
     VK_COMMENT_POINTS: int
     VK_ACTIVITIES_CHECKER_TIMEOUT: int
+    VK_CHECKER_LOCK_RETRY_INTERVAL: float = 5.0
+    VK_CHECKER_LOCK_CHECK_INTERVAL: float = 5.0
+    VK_CHECKER_CYCLES_RETENTION_DAYS: int = 30
+    VK_CHECKER_STATUS_CYCLES: int = 10
+    VK_CHECKER_CYCLE_GRACE: int = 30 * 60
+    VK_API_RATE_LIMIT: float = 3.0
+    VK_API_MIN_RATE: float = 0.5
+    VK_API_MAX_RETRIES: int = 3
+    VK_API_MAX_CONCURRENCY: int = 4
+    VK_RESOLVER_CACHE_TTL: int = 24 * 60 * 60
+    VK_RESOLVER_NEGATIVE_TTL: int = 10 * 60
     ACTION_LOGS_LIMIT: int
+    AUDIT_LOGS_PARTITIONS_AHEAD: int = 2
+    AUDIT_LOGS_RETENTION_MONTHS: int = 0
+    FSM_STORAGE_TTL: int = 24 * 60 * 60
+    FSM_STORAGE_FLUSH_INTERVAL: float = 1.0
+    FSM_STORAGE_EXPIRY_INTERVAL: float = 10 * 60
+    FSM_STORAGE_CACHE_TTL: float = 5.0
+    CALLBACK_PAYLOADS_TTL: int = 7 * 24 * 60 * 60
+    CALLBACK_PAYLOADS_FLUSH_INTERVAL: float = 1.0
+    MENU_CACHE_MAXSIZE: int = 1024
+    MENU_CACHE_TTL: int = 60 * 60
     PERSON_MATCH_THRESHOLD: int
     COMMITTEE_ATTENDANCE_POINTS: int
     GOOGLE_CREDS_PATH: str
+    GOOGLE_API_MAX_WORKERS: int = 4
+    GOOGLE_API_TIMEOUT: int = 30
+    JOB_QUEUE_WORKERS: int = 2
+    JOB_QUEUE_LEASE: int = 60
+    JOB_QUEUE_POLL_INTERVAL: float = 5.0
+    JOB_QUEUE_MAX_ATTEMPTS: int = 3
+    JOB_QUEUE_RETRY_DELAY: int = 10
+    METRICS_ENABLED: bool = True
+    METRICS_HOST: str = '127.0.0.1'
+    METRICS_PORT: int = 9464
+    TRACING_EXPORTER: Literal['none', 'jsonl', 'otlp'] = 'none'
+    TRACING_SLOW_THRESHOLD_MS: int = 1000
+    TRACING_JSONL_PATH: str = 'traces.jsonl'
+    TRACING_OTLP_ENDPOINT: str = 'http://localhost:4318'
+    BOT_RUN_MODE: Literal['polling', 'webhook'] = 'polling'
+    WEBHOOK_BASE_URL: str | None = None
+    WEBHOOK_PATH: str = '/webhook'
+    WEBHOOK_SECRET: SecretStr | None = None
+    WEBHOOK_HOST: str = '0.0.0.0'
+    WEBHOOK_PORT: int = 8080
+    TELEGRAM_API_URL: str | None = None
+
+    @model_validator(mode='after')
+    def check_webhook_settings(self):
+        if self.BOT_RUN_MODE == 'webhook' and not (self.WEBHOOK_BASE_URL and self.WEBHOOK_SECRET):
+            raise ValueError("WEBHOOK_BASE_URL and WEBHOOK_SECRET are required in the webhook mode")
+        return self
 
     @property
     def database_url_asyncpg(self):
         return (f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:"
                 f"{self.POSTGRES_PORT}/{self.POSTGRES_DB}")
 
+    @property
+    def webhook_url(self):
+        return f"{self.WEBHOOK_BASE_URL.rstrip('/')}{self.WEBHOOK_PATH}"
+
     @property
     def google_creds_path(self):
         return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.GOOGLE_CREDS_PATH)
@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from src.logging_ import logger
+
+
+class AdvisoryLock:
+    """
+    A Postgres session-level advisory lock, e.g. to elect one leader among several bot instances.
+
+    The lock is held by a dedicated connection, so it is released by Postgres as soon as the holder
+    closes the connection or dies, and another instance can take it over.
+    """
+
+    def __init__(self, engine: AsyncEngine, name: str):
+        """
+        :param engine: The AsyncEngine object to take the connection from.
+        :param name: The name of the lock, the same name means the same lock for every instance.
+        """
+        self.engine = engine
+        self.name = name
+        self.key = int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), 'big', signed=True)
+        self._connection: AsyncConnection | None = None
+
+    @property
+    def is_acquired(self) -> bool:
+        return self._connection is not None
+
+    async def try_acquire(self) -> bool:
+        """
+        Takes the lock if no one holds it. Doesn't wait.
+        :return: True if the lock is held by this object now, False otherwise.
+        """
+        if self._connection is not None:
+            return True
+
+        connection = await self.engine.connect()
+        try:
+            # Autocommit, so the connection isn't left idle in a transaction while the lock is held.
+            connection = await connection.execution_options(isolation_level='AUTOCOMMIT')
+            acquired = await connection.scalar(text('SELECT pg_try_advisory_lock(:key)'), {'key': self.key})
+        except Exception:
+            await connection.close()
+            raise
+
+        if not acquired:
+            await connection.close()
+            return False
+
+        self._connection = connection
+        return True
+
+    async def wait_lost(self, check_interval: float):
+        """
+        Returns when the connection holding the lock is lost, so the lock may be held by someone else already.
+        :param check_interval: The number of seconds between checks of the connection.
+        """
+        while self._connection is not None:
+            await asyncio.sleep(check_interval)
+            try:
+                await self._connection.scalar(text('SELECT 1'))
+            except Exception as e:
+                logger.error(f"Connection holding the advisory lock '{self.name}' is lost: {e}")
+                await self._drop_connection()
+                return
+
+    async def release(self):
+        """
+        Releases the lock if it is held. Safe to call more than once.
+        """
+        if self._connection is None:
+            return
+        try:
+            await self._connection.scalar(text('SELECT pg_advisory_unlock(:key)'), {'key': self.key})
+        except Exception as e:
+            # The lock is released with the connection anyway.
+            logger.error(f"Error while releasing the advisory lock '{self.name}': {e}")
+        await self._drop_connection()
+
+    async def _drop_connection(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                await connection.close()
+            except Exception:
+                pass
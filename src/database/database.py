@@ -1,19 +1,65 @@
-from datetime import datetime, date
-from typing import Any, Callable
+import functools
+import re
+from datetime import datetime, date, timedelta
+from typing import Any, AsyncIterator, Callable
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, func, desc, asc, update
+from sqlalchemy import select, delete, func, desc, asc, update, text, tuple_, and_, or_
 from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from sqlalchemy.dialects.postgresql import insert
 
 from . import EventType
 from .models import Committee, Category, VkActivity, Person, PersonPoints, Protocol, ProtocolPerson, AuditLog, \
-    EventRegistrationTablePerson, EventRegistrationTable
-from src.enums import ActivityType, DocumentType
+    EventRegistrationTablePerson, EventRegistrationTable, FsmState, Membership, Job, \
+    VkCheckerState, VkCheckerCycle, CallbackPayload
+from .identity_map import get_identity_map
+from src.enums import ActivityType, DocumentType, ActionType, JobType, JobStatus
 from src.config_reader import settings
+from src.logging_ import logger
+from src.metrics import instrument
 
 
+# The error of the VK checker cycles left unfinished by a leader which died.
+ABANDONED_CYCLE_ERROR = 'Abandoned'
+
+# The SQLSTATE of a foreign key violation in Postgres.
+FOREIGN_KEY_VIOLATION = '23503'
+
+
+def _get_sqlstate(error: IntegrityError) -> str | None:
+    # The asyncpg adapter exposes the code as 'sqlstate', psycopg as 'pgcode'.
+    return getattr(error.orig, 'sqlstate', None) or getattr(error.orig, 'pgcode', None)
+
+
+def _add_months(month_start: date, months: int) -> date:
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def invalidates(*tags: str) -> Callable:
+    """
+    Marks a write method of the Database: after it succeeds, the identity map of the current update is cleared
+    and the write listeners are notified with the tags of the data it changed, e.g. to invalidate cached menus
+    built from that data.
+    :param tags: The names of the changed data, e.g. 'persons' or 'committees'.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(self: "Database", *args: Any, **kwargs: Any) -> Any:
+            result = await func(self, *args, **kwargs)
+            identity_map = get_identity_map()
+            if identity_map is not None:
+                identity_map.clear()
+            self._notify_write_listeners(tags)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+@instrument('db')
 class Database:
     def __init__(self, session_factory: Callable[[], AsyncSession]):
         """
@@ -21,6 +67,20 @@ class Database:
         :param session_factory: A function that returns a new asynchronous database session.
         """
         self.session_factory = session_factory
+        self._write_listeners: list[Callable[[tuple[str, ...]], None]] = []
+
+    def add_write_listener(self, listener: Callable[[tuple[str, ...]], None]):
+        """
+        Registers a function which is called with the tags of the changed data after every write
+        marked with 'invalidates'.
+        :param listener: The function accepting a tuple of tags.
+        :return: None.
+        """
+        self._write_listeners.append(listener)
+
+    def _notify_write_listeners(self, tags: tuple[str, ...]):
+        for listener in self._write_listeners:
+            listener(tags)
 
     async def rollback(self):
         async with self.session_factory() as session:
@@ -52,6 +112,7 @@ class Database:
 
             return (await session.execute(query)).fetchall() == 0
 
+    @invalidates('persons')
     async def insert_person(self, first_name: str, last_name: str, vk_id: int) -> int:
         """
         Inserts a new person into the database.
@@ -93,6 +154,7 @@ class Database:
             except IntegrityError:
                 return
 
+    @invalidates('person_points')
     async def insert_person_points(self, person_id: int):
         """
         Inserts a new set of person points for all categories in the database for a given person.
@@ -129,23 +191,25 @@ class Database:
             except IntegrityError:
                 return
 
+    @invalidates('persons')
     async def insert_membership(self, person_id: int, committee_id: int):
         """
         Inserts a new membership record in the database, associating a person with a committee.
+        Does nothing if the person is already a member of the committee.
         :param person_id: The ID of the person to be associated with the committee.
         :param committee_id: The ID of the committee to which the person will be associated.
         :return: None.
+        :raises NoResultFound: If the person or the committee doesn't exist.
         """
         async with self.session_factory() as session:
-            person = await self.get_person(id=person_id, join_committees=True)
-            committee = await self.get_committee(id=committee_id)
-            if not person or not committee:
-                raise NoResultFound(
-                    f"Person '{person.first_name} {person.last_name}' or Committee '{committee.name}' not found"
-                )
-            person.committees.append(committee)
-            await session.merge(person)
-            await session.commit()
+            query = insert(Membership).values(person_id=person_id, committee_id=committee_id).on_conflict_do_nothing()
+            try:
+                await session.execute(query)
+                await session.commit()
+            except IntegrityError as e:
+                if _get_sqlstate(e) == FOREIGN_KEY_VIOLATION:
+                    raise NoResultFound(f"Person '{person_id}' or Committee '{committee_id}' not found") from e
+                raise
 
     async def insert_vk_activity(self, person_id: int, post_url: str, activity_type: ActivityType) -> bool:
         """
@@ -189,6 +253,27 @@ class Database:
             protocol_numbers = result.scalars().all()
             return list(protocol_numbers)
 
+    async def get_protocols_sync_state(self, committee_id: int) -> dict[int, Any]:
+        """
+        Retrieves what is needed to sync the protocols of a committee with its document, in one query.
+        :param committee_id: The ID of the committee.
+        :return: A dictionary mapping protocol numbers to rows with 'id', 'date', 'fingerprint'
+            and 'has_unmatched_persons' attributes.
+        """
+        has_unmatched_persons = (
+            select(ProtocolPerson.id)
+            .where(ProtocolPerson.protocol_id == Protocol.id, ProtocolPerson.matched_person_id.is_(None))
+            .exists()
+        )
+        async with self.session_factory() as session:
+            query = (
+                select(Protocol.id, Protocol.number, Protocol.date, Protocol.fingerprint,
+                       has_unmatched_persons.label('has_unmatched_persons'))
+                .filter_by(committee_id=committee_id)
+            )
+            result = await session.execute(query)
+            return {row.number: row for row in result}
+
     async def get_protocols(self, committee_id: int) -> list[Protocol]:
         async with self.session_factory() as session:
             result = await session.execute(
@@ -241,7 +326,12 @@ class Database:
 
             result = await session.execute(query)
             committees = result.unique().scalars().all()
-            return list(committees)
+
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            for committee in committees:
+                identity_map.add(Committee, committee.id, committee)
+        return list(committees)
 
     async def get_categories(self) -> list[Category]:
         """
@@ -301,11 +391,14 @@ class Database:
             rows = result.fetchall()
             return {row.id: f"{row.first_name} {row.last_name}" for row in rows}
 
-    async def get_persons_ids_and_vk_ids(self) -> list[dict[str, Any]]:
+    async def get_person_ids_by_vk_ids(self) -> dict[int, int]:
+        """
+        Retrieves the IDs of all persons by their VK IDs.
+        :return: A dictionary mapping VK IDs to person IDs.
+        """
         async with self.session_factory() as session:
-            result = await session.execute(select(Person.id, Person.vk_id))
-            rows = result.fetchall()
-            return [{"person_id": row.id, "vk_id": row.vk_id} for row in rows]
+            result = await session.execute(select(Person.vk_id, Person.id))
+            return {row.vk_id: row.id for row in result}
 
     async def get_person(self, join_committees: bool = False, join_points: bool = False,
                          **kwargs: Any) -> Person | None:
@@ -317,14 +410,67 @@ class Database:
         :return: The Person object that matches the provided kwargs, or None if no match is found.
             The Person object includes associated committees and person points, with their respective categories.
         """
+        relationships = self._get_person_relationships(join_committees, join_points)
+        identity_map = get_identity_map()
+        if identity_map is not None and kwargs.keys() == {'id'}:
+            person = identity_map.get(Person, kwargs['id'], relationships)
+            if person is not None:
+                return person
+
         async with self.session_factory() as session:
-            query = select(Person).filter_by(**kwargs)
-            if join_committees:
-                query = query.options(selectinload(Person.committees))
-            if join_points:
-                query = query.options(selectinload(Person.points).joinedload(PersonPoints.category))
+            query = self._get_person_query(join_committees, join_points).filter_by(**kwargs)
             person = (await session.execute(query)).unique().scalars().one_or_none()
-            return person
+
+        if identity_map is not None and person is not None:
+            identity_map.add(Person, person.id, person, relationships)
+        return person
+
+    async def get_persons_by_ids(self, person_ids: list[int], join_committees: bool = False,
+                                 join_points: bool = False) -> dict[int, Person]:
+        """
+        Retrieves persons by their IDs. Persons already loaded during the current update are taken
+        from the identity map, the rest are fetched with one query.
+        :param person_ids: The IDs of the persons.
+        :param join_committees: If True, includes associated committees.
+        :param join_points: If True, includes associated person points with their categories.
+        :return: A dict mapping the IDs to the found Person objects.
+        """
+        relationships = self._get_person_relationships(join_committees, join_points)
+        identity_map = get_identity_map()
+        persons = {}
+        if identity_map is not None:
+            for person_id in person_ids:
+                person = identity_map.get(Person, person_id, relationships)
+                if person is not None:
+                    persons[person_id] = person
+
+        missing_ids = set(person_ids) - persons.keys()
+        if missing_ids:
+            async with self.session_factory() as session:
+                query = self._get_person_query(join_committees, join_points).where(Person.id.in_(missing_ids))
+                for person in (await session.execute(query)).unique().scalars():
+                    persons[person.id] = person
+                    if identity_map is not None:
+                        identity_map.add(Person, person.id, person, relationships)
+        return persons
+
+    @staticmethod
+    def _get_person_relationships(join_committees: bool, join_points: bool) -> frozenset[str]:
+        relationships = set()
+        if join_committees:
+            relationships.add('committees')
+        if join_points:
+            relationships.add('points')
+        return frozenset(relationships)
+
+    @staticmethod
+    def _get_person_query(join_committees: bool, join_points: bool):
+        query = select(Person)
+        if join_committees:
+            query = query.options(selectinload(Person.committees))
+        if join_points:
+            query = query.options(selectinload(Person.points).joinedload(PersonPoints.category))
+        return query
 
     async def get_person_id(self, **kwargs: Any) -> int | None:
         async with self.session_factory() as session:
@@ -359,10 +505,44 @@ class Database:
         :param kwargs: Keyword arguments to filter the committee. The keys should match the column names in the Committee model.
         :return: The Committee object that matches the provided kwargs, or None if no match is found.
         """
+        identity_map = get_identity_map()
+        if identity_map is not None and kwargs.keys() == {'id'}:
+            committee = identity_map.get(Committee, kwargs['id'])
+            if committee is not None:
+                return committee
+
         async with self.session_factory() as session:
             query = select(Committee).filter_by(**kwargs)
             committee = (await session.execute(query)).scalars().one_or_none()
-            return committee
+
+        if identity_map is not None and committee is not None:
+            identity_map.add(Committee, committee.id, committee)
+        return committee
+
+    async def get_committees_by_ids(self, committee_ids: list[int]) -> dict[int, Committee]:
+        """
+        Retrieves committees by their IDs. Committees already loaded during the current update are taken
+        from the identity map, the rest are fetched with one query.
+        :param committee_ids: The IDs of the committees.
+        :return: A dict mapping the IDs to the found Committee objects.
+        """
+        identity_map = get_identity_map()
+        committees = {}
+        if identity_map is not None:
+            for committee_id in committee_ids:
+                committee = identity_map.get(Committee, committee_id)
+                if committee is not None:
+                    committees[committee_id] = committee
+
+        missing_ids = set(committee_ids) - committees.keys()
+        if missing_ids:
+            async with self.session_factory() as session:
+                query = select(Committee).where(Committee.id.in_(missing_ids))
+                for committee in (await session.execute(query)).scalars():
+                    committees[committee.id] = committee
+                    if identity_map is not None:
+                        identity_map.add(Committee, committee.id, committee)
+        return committees
 
     async def get_committee_id(self, committee_name: str) -> int | None:
         async with self.session_factory() as session:
@@ -461,11 +641,156 @@ class Database:
         :param limit: The maximum number of audit logs to retrieve.
         :return: A list of AuditLogs objects retrieved from the database, limited by the provided limit.
         """
+        return await self.get_audit_logs_page(limit)
+
+    async def get_audit_logs_page(
+            self,
+            limit: int,
+            person_id: int | None = None,
+            changed_by: str | None = None,
+            action_type: ActionType | None = None,
+            changed_from: datetime | None = None,
+            changed_to: datetime | None = None,
+            before: tuple[datetime, int] | None = None
+    ) -> list[AuditLog]:
+        """
+        Retrieves a page of audit logs from the database, newest first, filtered by the provided arguments.
+        Pages are addressed by a keyset: pass '(changed_at, id)' of the last log on the previous page
+        as 'before' to get the next one.
+        :param limit: The maximum number of audit logs to retrieve.
+        :param person_id: The ID of the person associated with the logs. Defaults to None (any person).
+        :param changed_by: The username of the person who performed the actions. Defaults to None (anyone).
+        :param action_type: The type of the logged actions. Defaults to None (any type).
+        :param changed_from: The lower bound (inclusive) of the logs time window. Defaults to None.
+        :param changed_to: The upper bound (exclusive) of the logs time window. Defaults to None.
+        :param before: The '(changed_at, id)' keyset of the last log on the previous page. Defaults to None.
+        :return: A list of AuditLog objects, newest first.
+        """
         async with self.session_factory() as session:
-            query = select(AuditLog).order_by(desc(AuditLog.changed_at)).limit(limit)
+            query = select(AuditLog)
+            if person_id is not None:
+                query = query.filter(AuditLog.person_id == person_id)
+            if changed_by is not None:
+                query = query.filter(AuditLog.changed_by == changed_by)
+            if action_type is not None:
+                query = query.filter(AuditLog.action_type == action_type)
+            if changed_from is not None:
+                query = query.filter(AuditLog.changed_at >= changed_from)
+            if changed_to is not None:
+                query = query.filter(AuditLog.changed_at < changed_to)
+            if before is not None:
+                query = query.filter(tuple_(AuditLog.changed_at, AuditLog.id) < tuple_(*before))
+
+            query = query.order_by(desc(AuditLog.changed_at), desc(AuditLog.id)).limit(limit)
             audit_logs = (await session.execute(query)).scalars().all()
             return list(audit_logs)
 
+    async def get_person_audit_logs(self, person_id: int, limit: int) -> list[AuditLog]:
+        """
+        Retrieves the latest audit logs of a specific person from the database.
+        :param person_id: The ID of the person whose audit logs need to be retrieved.
+        :param limit: The maximum number of audit logs to retrieve.
+        :return: A list of AuditLog objects, newest first.
+        """
+        return await self.get_audit_logs_page(limit, person_id=person_id)
+
+    async def get_audit_logs_by_action_type(self, action_type: ActionType, limit: int) -> list[AuditLog]:
+        """
+        Retrieves the latest audit logs of a specific action type from the database.
+        :param action_type: The type of action whose audit logs need to be retrieved.
+        :param limit: The maximum number of audit logs to retrieve.
+        :return: A list of AuditLog objects, newest first.
+        """
+        return await self.get_audit_logs_page(limit, action_type=action_type)
+
+    @staticmethod
+    def _get_audit_log_partition_name(month_start: date) -> str:
+        return f"audit_logs_y{month_start:%Y}m{month_start:%m}"
+
+    async def create_audit_log_partitions(self, months_ahead: int) -> list[str]:
+        """
+        Creates monthly partitions of the audit logs table for the current month and the next months.
+        Partitions must exist before logs of their month are written, otherwise the logs fall into
+        the default partition. Logs of the month already in the default partition are moved to the new one.
+        Every month is created in its own transaction, so a failing month doesn't prevent the others.
+        :param months_ahead: The number of months after the current one to create partitions for.
+        :return: A list of created partition names.
+        """
+        created = []
+        month_start = date.today().replace(day=1)
+        for _ in range(months_ahead + 1):
+            next_month_start = _add_months(month_start, 1)
+            partition_name = self._get_audit_log_partition_name(month_start)
+            try:
+                if await self._create_audit_log_partition(partition_name, month_start, next_month_start):
+                    created.append(partition_name)
+            except Exception as e:
+                logger.error(f"Error while creating the audit log partition {partition_name}: {e}")
+            month_start = next_month_start
+        return created
+
+    async def _create_audit_log_partition(self, partition_name: str, month_start: date,
+                                          next_month_start: date) -> bool:
+        async with self.session_factory() as session:
+            if await session.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': partition_name}):
+                return False
+
+            bounds = {'month_start': month_start, 'next_month_start': next_month_start}
+            in_month = "changed_at >= :month_start AND changed_at < :next_month_start"
+            has_default_rows = await session.scalar(
+                text(f"SELECT EXISTS (SELECT 1 FROM audit_logs_default WHERE {in_month})"), bounds
+            )
+            # A partition can't be created while the default one holds rows of its range,
+            # so the default partition is detached until the rows are moved.
+            if has_default_rows:
+                await session.execute(text("ALTER TABLE audit_logs DETACH PARTITION audit_logs_default"))
+            await session.execute(text(
+                f"CREATE TABLE {partition_name} "
+                f"PARTITION OF audit_logs FOR VALUES FROM ('{month_start}') TO ('{next_month_start}')"
+            ))
+            if has_default_rows:
+                await session.execute(
+                    text(f"INSERT INTO {partition_name} SELECT * FROM audit_logs_default WHERE {in_month}"), bounds
+                )
+                await session.execute(text(f"DELETE FROM audit_logs_default WHERE {in_month}"), bounds)
+                await session.execute(text("ALTER TABLE audit_logs ATTACH PARTITION audit_logs_default DEFAULT"))
+            await session.commit()
+            return True
+
+    async def drop_expired_audit_log_partitions(self, retention_months: int) -> list[str]:
+        """
+        Drops monthly partitions of the audit logs table which are older than the retention period.
+        :param retention_months: The number of months, including the current one, to keep audit logs for.
+        :return: A list of dropped partition names.
+        """
+        cutoff = _add_months(date.today().replace(day=1), -(retention_months - 1))
+        async with self.session_factory() as session:
+            query = text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                "WHERE parent.relname = 'audit_logs'"
+            )
+            partition_names = (await session.execute(query)).scalars().all()
+
+            dropped = []
+            for partition_name in partition_names:
+                match = re.fullmatch(r'audit_logs_y(\d{4})m(\d{2})', partition_name)
+                if not match:
+                    continue
+                month_start = date(int(match.group(1)), int(match.group(2)), 1)
+                if month_start < cutoff:
+                    await session.execute(text(f"DROP TABLE {partition_name}"))
+                    dropped.append(partition_name)
+
+            await session.execute(
+                text("DELETE FROM audit_logs_default WHERE changed_at < :cutoff"),
+                {'cutoff': cutoff}
+            )
+            await session.commit()
+            return dropped
+
+    @invalidates('persons')
     async def delete_person(self, person_id: int):
         """
         Deletes a person from the database based on the provided ID.
@@ -473,9 +798,6 @@ class Database:
         :return: None.
         """
         async with self.session_factory() as session:
-            person = await self.get_person(id=person_id)
-            if not person:
-                return
             await session.execute(delete(Person).filter_by(id=person_id))
             await session.commit()
 
@@ -514,6 +836,7 @@ class Database:
             await session.execute(query)
             await session.commit()
 
+    @invalidates('person_points')
     async def update_person_points(self, person_id: int, category_id: int, points_value: int):
         """
         Updates the points value for a specific person in a given category.
@@ -531,6 +854,7 @@ class Database:
             except AttributeError:
                 return
 
+    @invalidates('persons')
     async def update_person_name(self, person_id: int, new_first_name: str | None = None,
                                  new_last_name: str | None = None):
         """
@@ -540,15 +864,19 @@ class Database:
         :param new_last_name: The new last name to be set for the person. If None, the last name remains unchanged.
         :return: None.
         """
+        values = {}
+        if new_first_name:
+            values['first_name'] = new_first_name
+        if new_last_name:
+            values['last_name'] = new_last_name
+        if not values:
+            return
+
         async with self.session_factory() as session:
-            person = await self.get_person(id=person_id)
-            if new_first_name:
-                person.first_name = new_first_name
-            if new_last_name:
-                person.last_name = new_last_name
-            session.add(person)
+            await session.execute(update(Person).filter_by(id=person_id).values(**values))
             await session.commit()
 
+    @invalidates('persons')
     async def update_person_committee(self, person_id: int, current_committee_id: int, new_committee_id: int):
         """
         Updates the committee association of a person in the database.
@@ -558,15 +886,17 @@ class Database:
         :return: None.
         """
         async with self.session_factory() as session:
-            person = await self.get_person(id=person_id, join_committees=True)
-            current_committee = await self.get_committee(id=current_committee_id)
-            new_committee = await self.get_committee(id=new_committee_id)
-            for committee in person.committees:
-                if committee.id == current_committee.id:
-                    person.committees.remove(committee)
-                    person.committees.append(new_committee)
+            query = (
+                update(Membership)
+                .filter_by(person_id=person_id, committee_id=current_committee_id)
+                .values(committee_id=new_committee_id)
+            )
+            await session.execute(query)
+            await session.commit()
 
-            await session.merge(person)
+    async def update_protocol_fingerprint(self, protocol_id: int, fingerprint: str):
+        async with self.session_factory() as session:
+            await session.execute(update(Protocol).filter_by(id=protocol_id).values(fingerprint=fingerprint))
             await session.commit()
 
     async def batch_update_protocol_persons(self, persons_data: list[dict]):
@@ -673,6 +1003,37 @@ class Database:
             session.add(table_person)
             await session.commit()
 
+    async def claim_points_of_protocol_person(self, protocol_person_id: int) -> bool:
+        """
+        Sets the 'points_added' mark of the ProtocolPerson record unless it's set already. Called before the points
+        are added, so of concurrent or retried jobs only one adds them.
+        :param protocol_person_id: The ID of the ProtocolPerson record.
+        :return: True if the mark was set by this call, False if it was set before.
+        """
+        return await self._claim_points(ProtocolPerson, protocol_person_id)
+
+    async def claim_points_of_table_person(self, table_person_id: int) -> bool:
+        """
+        Sets the 'points_added' mark of the EventRegistrationTablePerson record unless it's set already.
+        Called before the points are added, so of concurrent or retried jobs only one adds them.
+        :param table_person_id: The ID of the EventRegistrationTablePerson record.
+        :return: True if the mark was set by this call, False if it was set before.
+        """
+        return await self._claim_points(EventRegistrationTablePerson, table_person_id)
+
+    async def _claim_points(self, model: type[ProtocolPerson | EventRegistrationTablePerson], record_id: int) -> bool:
+        async with self.session_factory() as session:
+            query = (
+                update(model)
+                .where(model.id == record_id, model.points_added.is_(False))
+                .values(points_added=True)
+                .returning(model.id)
+            )
+            claimed = (await session.execute(query)).scalar_one_or_none() is not None
+            await session.commit()
+            return claimed
+
+    @invalidates('persons')
     async def delete_person_committee(self, person_id: int, committee_id: int):
         """
         Deletes a person's association with a specific committee in the database.
@@ -681,12 +1042,7 @@ class Database:
         :return: None.
         """
         async with self.session_factory() as session:
-            person = await self.get_person(id=person_id, join_committees=True)
-            committee = await self.get_committee(id=committee_id)
-            for com in person.committees:
-                if com.name == committee.name:
-                    person.committees.remove(com)
-            session.add(person)
+            await session.execute(delete(Membership).filter_by(person_id=person_id, committee_id=committee_id))
             await session.commit()
 
     async def get_person_points_top(self, top_count: int = 3) -> dict[str, list[(str, int)]]:
@@ -730,6 +1086,39 @@ class Database:
 
         return top_persons
 
+    async def stream_guss_top_stats_rows(self) -> AsyncIterator[Any]:
+        """
+        Streams flat rows for the GUSS-top statistics report with a server-side cursor, so no ORM objects
+        are built and the memory doesn't grow with the number of members.
+        Rows are ordered by committee, person and category. Empty committees come as one row with a None person,
+        persons without points as one row with a None category.
+        :return: An async iterator of rows with 'committee_id', 'committee_name', 'talisman', 'person_id',
+            'first_name', 'last_name', 'vk_id', 'category_name' and 'points'.
+        """
+        query = (
+            select(
+                Committee.id.label('committee_id'),
+                Committee.name.label('committee_name'),
+                Committee.talisman,
+                Person.id.label('person_id'),
+                Person.first_name,
+                Person.last_name,
+                Person.vk_id,
+                Category.name.label('category_name'),
+                PersonPoints.points_value.label('points')
+            )
+            .select_from(Committee)
+            .outerjoin(Membership, Membership.committee_id == Committee.id)
+            .outerjoin(Person, Person.id == Membership.person_id)
+            .outerjoin(PersonPoints, PersonPoints.person_id == Person.id)
+            .outerjoin(Category, Category.id == PersonPoints.category_id)
+            .order_by(Committee.id, Person.id, Category.id)
+        )
+        async with self.session_factory() as session:
+            result = await session.stream(query)
+            async for row in result:
+                yield row
+
     async def get_event_type_points(self, event_type_id: int) -> int:
         async with self.session_factory() as session:
             query = select(EventType.points).filter_by(id=event_type_id)
@@ -747,3 +1136,213 @@ class Database:
             query = select(EventType.name).filter_by(id=event_type_id)
             name = (await session.execute(query)).fetchone()
             return name[0]
+
+    async def get_fsm_state(self, key: str) -> FsmState | None:
+        async with self.session_factory() as session:
+            query = select(FsmState).where(FsmState.key == key, FsmState.expires_at > datetime.now())
+            return (await session.execute(query)).scalar_one_or_none()
+
+    async def upsert_fsm_states(self, states_data: list[dict]):
+        """
+        Inserts or replaces FSM states in one statement.
+        :param states_data: Dicts with 'key', 'state', 'data' and 'expires_at'.
+        """
+        async with self.session_factory() as session:
+            query = insert(FsmState).values(states_data)
+            query = query.on_conflict_do_update(
+                index_elements=[FsmState.key],
+                set_={'state': query.excluded.state, 'data': query.excluded.data,
+                      'expires_at': query.excluded.expires_at}
+            )
+            await session.execute(query)
+            await session.commit()
+
+    async def delete_fsm_states(self, keys: list[str]):
+        async with self.session_factory() as session:
+            await session.execute(delete(FsmState).where(FsmState.key.in_(keys)))
+            await session.commit()
+
+    async def delete_expired_fsm_states(self) -> int:
+        async with self.session_factory() as session:
+            result = await session.execute(delete(FsmState).where(FsmState.expires_at <= datetime.now()))
+            await session.commit()
+            return result.rowcount
+
+    async def get_callback_payload(self, key: str) -> bytes | None:
+        async with self.session_factory() as session:
+            query = select(CallbackPayload.payload).where(CallbackPayload.key == key,
+                                                          CallbackPayload.expires_at > datetime.now())
+            return await session.scalar(query)
+
+    async def upsert_callback_payloads(self, payloads_data: list[dict]):
+        """
+        Inserts callback payloads in one statement, the lifetime of already stored ones is extended.
+        :param payloads_data: Dicts with 'key', 'payload' and 'expires_at'.
+        """
+        async with self.session_factory() as session:
+            query = insert(CallbackPayload).values(payloads_data)
+            query = query.on_conflict_do_update(
+                index_elements=[CallbackPayload.key],
+                set_={'expires_at': func.greatest(CallbackPayload.expires_at, query.excluded.expires_at)}
+            )
+            await session.execute(query)
+            await session.commit()
+
+    async def delete_expired_callback_payloads(self) -> int:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(CallbackPayload).where(CallbackPayload.expires_at <= datetime.now())
+            )
+            await session.commit()
+            return result.rowcount
+
+    async def enqueue_job(self, job_type: JobType, idempotency_key: str, payload: dict, max_attempts: int,
+                          chat_id: int | None = None, message_id: int | None = None) -> int | None:
+        """
+        Inserts a new pending job unless an unfinished job with the same idempotency key exists.
+        :param job_type: The type of the job.
+        :param idempotency_key: The key identifying the work, e.g. 'protocol:12'.
+        :param payload: The JSON-serializable arguments of the job.
+        :param max_attempts: How many times the job is run before it is marked as failed.
+        :param chat_id: The ID of the chat with the progress message.
+        :param message_id: The ID of the progress message.
+        :return: The ID of the new job, or None if the same work is already queued or running.
+        """
+        async with self.session_factory() as session:
+            query = (
+                insert(Job)
+                .values(job_type=job_type, status=JobStatus.PENDING, payload=payload,
+                        idempotency_key=idempotency_key, attempts=0, max_attempts=max_attempts,
+                        run_at=datetime.now(), chat_id=chat_id, message_id=message_id)
+                .on_conflict_do_nothing(index_elements=[Job.idempotency_key],
+                                        index_where=Job.status.in_([JobStatus.PENDING, JobStatus.RUNNING]))
+                .returning(Job.id)
+            )
+            job_id = (await session.execute(query)).scalar_one_or_none()
+            await session.commit()
+            return job_id
+
+    async def claim_job(self, lease: timedelta) -> Any | None:
+        """
+        Takes the next due job and leases it to the caller. Jobs whose lease expired, e.g. because
+        the process died while running them, are taken again. Concurrent workers skip the rows locked by others.
+        :param lease: How long the job belongs to the caller unless the lease is extended.
+        :return: A row with 'id', 'job_type', 'payload', 'attempts', 'max_attempts', 'chat_id' and 'message_id',
+            or None if there are no due jobs.
+        """
+        now = datetime.now()
+        due_job_id = (
+            select(Job.id)
+            .where(or_(and_(Job.status == JobStatus.PENDING, Job.run_at <= now),
+                       and_(Job.status == JobStatus.RUNNING, Job.locked_until < now)))
+            .order_by(Job.run_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        async with self.session_factory() as session:
+            query = (
+                update(Job)
+                .where(Job.id == due_job_id)
+                .values(status=JobStatus.RUNNING, attempts=Job.attempts + 1, locked_until=now + lease)
+                .returning(Job.id, Job.job_type, Job.payload, Job.attempts, Job.max_attempts, Job.chat_id,
+                           Job.message_id)
+            )
+            job = (await session.execute(query)).one_or_none()
+            await session.commit()
+            return job
+
+    async def extend_job_lease(self, job_id: int, attempts: int, lease: timedelta) -> bool:
+        """
+        Extends the lease of a running job.
+        :param job_id: The ID of the job.
+        :param attempts: The number of attempts the job had when it was claimed. If the job was claimed again
+            since then, e.g. by another worker after the lease expired, the lease isn't extended.
+        :param lease: How long the job belongs to the caller from now on.
+        :return: True if the lease is extended, False if the job doesn't belong to the caller anymore.
+        """
+        async with self.session_factory() as session:
+            result = await session.execute(
+                update(Job).filter_by(id=job_id, attempts=attempts, status=JobStatus.RUNNING)
+                .values(locked_until=datetime.now() + lease)
+            )
+            await session.commit()
+            return result.rowcount > 0
+
+    async def finish_job(self, job_id: int, attempts: int, status: JobStatus, error: str | None = None):
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Job).filter_by(id=job_id, attempts=attempts)
+                .values(status=status, error=error, locked_until=None, finished_at=datetime.now())
+            )
+            await session.commit()
+
+    async def retry_job(self, job_id: int, attempts: int, delay: timedelta, error: str):
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Job).filter_by(id=job_id, attempts=attempts)
+                .values(status=JobStatus.PENDING, error=error, locked_until=None, run_at=datetime.now() + delay)
+            )
+            await session.commit()
+
+    async def get_vk_checker_enabled(self, name: str) -> bool:
+        async with self.session_factory() as session:
+            query = select(VkCheckerState.enabled).filter_by(name=name)
+            return bool((await session.execute(query)).scalar_one_or_none())
+
+    async def set_vk_checker_enabled(self, name: str, enabled: bool):
+        async with self.session_factory() as session:
+            query = insert(VkCheckerState).values(name=name, enabled=enabled)
+            query = query.on_conflict_do_update(
+                index_elements=[VkCheckerState.name],
+                set_={'enabled': query.excluded.enabled, 'updated_at': func.now()}
+            )
+            await session.execute(query)
+            await session.commit()
+
+    async def insert_vk_checker_cycle(self, instance: str, started_at: datetime) -> int:
+        async with self.session_factory() as session:
+            query = insert(VkCheckerCycle).values(instance=instance, started_at=started_at, requests=0, awards=0)
+            cycle_id = (await session.execute(query.returning(VkCheckerCycle.id))).scalar_one()
+            await session.commit()
+            return cycle_id
+
+    async def finish_vk_checker_cycle(self, cycle_id: int, finished_at: datetime, duration: float, requests: int,
+                                      awards: int, error: str | None = None):
+        async with self.session_factory() as session:
+            await session.execute(
+                update(VkCheckerCycle).filter_by(id=cycle_id)
+                .values(finished_at=finished_at, duration=duration, requests=requests, awards=awards, error=error)
+            )
+            await session.commit()
+
+    async def abandon_vk_checker_cycles(self) -> int:
+        """
+        Marks the unfinished cycles of the VK activities checker as abandoned. Called by a new leader,
+        so they can only be left by a leader which died.
+        :return: The number of abandoned cycles.
+        """
+        async with self.session_factory() as session:
+            result = await session.execute(
+                update(VkCheckerCycle)
+                .where(VkCheckerCycle.finished_at.is_(None), VkCheckerCycle.error.is_(None))
+                .values(error=ABANDONED_CYCLE_ERROR)
+            )
+            await session.commit()
+            return result.rowcount
+
+    async def get_vk_checker_cycles(self, limit: int) -> list[VkCheckerCycle]:
+        """
+        Retrieves the latest cycles of the VK activities checker.
+        :param limit: The maximum number of cycles to retrieve.
+        :return: A list of VkCheckerCycle objects, the latest first.
+        """
+        async with self.session_factory() as session:
+            query = select(VkCheckerCycle).order_by(desc(VkCheckerCycle.started_at)).limit(limit)
+            return list((await session.execute(query)).scalars().all())
+
+    async def delete_vk_checker_cycles_before(self, started_before: datetime) -> int:
+        async with self.session_factory() as session:
+            result = await session.execute(delete(VkCheckerCycle).where(VkCheckerCycle.started_at < started_before))
+            await session.commit()
+            return result.rowcount
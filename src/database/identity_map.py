@@ -0,0 +1,52 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+from .models import Base
+
+
+class IdentityMap:
+    """
+    Keeps the rows loaded by their primary key during one update, so each of them is fetched at most once.
+    Every entry remembers which relationships were loaded with it: an entry loaded with more relationships
+    serves lighter lookups too, but not the other way round.
+    """
+
+    def __init__(self):
+        self._entries: dict[tuple[type[Base], Any], tuple[Base, frozenset[str]]] = {}
+
+    def get(self, model: type[Base], pk: Any, relationships: frozenset[str] = frozenset()) -> Base | None:
+        entry = self._entries.get((model, pk))
+        if entry is None or not relationships <= entry[1]:
+            return None
+        return entry[0]
+
+    def add(self, model: type[Base], pk: Any, obj: Base, relationships: frozenset[str] = frozenset()):
+        entry = self._entries.get((model, pk))
+        if entry is None or relationships >= entry[1]:
+            self._entries[(model, pk)] = (obj, relationships)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_identity_map: ContextVar[IdentityMap | None] = ContextVar("identity_map", default=None)
+
+
+def get_identity_map() -> IdentityMap | None:
+    """
+    Returns the identity map of the current update, or None outside an update.
+    """
+    return _identity_map.get()
+
+
+@contextmanager
+def identity_map_scope() -> Iterator[IdentityMap]:
+    """
+    Opens a new identity map for the code inside, e.g. for handling one update.
+    """
+    token = _identity_map.set(IdentityMap())
+    try:
+        yield _identity_map.get()
+    finally:
+        _identity_map.reset(token)
@@ -0,0 +1,44 @@
+"""add fsm states
+
+Revision ID: 3e7d51b0c6a4
+Revises: 8c1f4e2a9b37
+Create Date: 2024-10-16 20:41:27.905114
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3e7d51b0c6a4"
+down_revision: Union[str, None] = "8c1f4e2a9b37"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "fsm_states",
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("state", sa.String(), nullable=True),
+        sa.Column(
+            "data", postgresql.JSONB(astext_type=sa.Text()), nullable=False
+        ),
+        sa.Column("expires_at", sa.TIMESTAMP(), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index(
+        op.f("ix_fsm_states_expires_at"),
+        "fsm_states",
+        ["expires_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_fsm_states_expires_at"), table_name="fsm_states")
+    op.drop_table("fsm_states")
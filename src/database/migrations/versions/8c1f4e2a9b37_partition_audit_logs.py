@@ -0,0 +1,176 @@
+"""partition audit logs
+
+Revision ID: 8c1f4e2a9b37
+Revises: 5019b9dcd585
+Create Date: 2024-10-14 19:12:05.418203
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8c1f4e2a9b37"
+down_revision: Union[str, None] = "5019b9dcd585"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE audit_logs RENAME TO audit_logs_unpartitioned")
+    op.execute(
+        "ALTER TABLE audit_logs_unpartitioned "
+        "RENAME CONSTRAINT audit_logs_pkey TO audit_logs_unpartitioned_pkey"
+    )
+    op.execute(
+        "ALTER TABLE audit_logs_unpartitioned "
+        "RENAME CONSTRAINT audit_logs_person_id_fkey "
+        "TO audit_logs_unpartitioned_person_id_fkey"
+    )
+    op.execute(
+        "ALTER INDEX ix_audit_logs_id RENAME TO ix_audit_logs_unpartitioned_id"
+    )
+    # Keep the id sequence alive when the old table is dropped.
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY NONE")
+
+    op.execute(
+        """
+        CREATE TABLE audit_logs (
+            id INTEGER NOT NULL DEFAULT nextval('audit_logs_id_seq'),
+            action_type actiontype NOT NULL,
+            person_id INTEGER,
+            old_data JSONB,
+            new_data JSONB,
+            comment TEXT,
+            changed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+            changed_by VARCHAR(100) NOT NULL,
+            CONSTRAINT audit_logs_pkey PRIMARY KEY (id, changed_at),
+            CONSTRAINT audit_logs_person_id_fkey FOREIGN KEY (person_id)
+                REFERENCES persons (id) ON DELETE SET NULL
+        ) PARTITION BY RANGE (changed_at)
+        """
+    )
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id")
+    op.execute("CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT")
+
+    # One partition per month from the oldest log up to two months ahead.
+    op.execute(
+        """
+        DO $$
+        DECLARE
+            month_start DATE;
+            last_month DATE := date_trunc('month', now()) + interval '2 months';
+        BEGIN
+            SELECT COALESCE(date_trunc('month', min(changed_at)), date_trunc('month', now()))
+            INTO month_start
+            FROM audit_logs_unpartitioned;
+
+            WHILE month_start <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF audit_logs FOR VALUES FROM (%L) TO (%L)',
+                    'audit_logs_y' || to_char(month_start, 'YYYY') || 'm' || to_char(month_start, 'MM'),
+                    month_start,
+                    month_start + interval '1 month'
+                );
+                month_start := month_start + interval '1 month';
+            END LOOP;
+        END $$
+        """
+    )
+
+    op.execute(
+        """
+        INSERT INTO audit_logs (id, action_type, person_id, old_data, new_data,
+                                comment, changed_at, changed_by)
+        SELECT id, action_type, person_id, old_data::jsonb, new_data::jsonb,
+               comment, changed_at, changed_by
+        FROM audit_logs_unpartitioned
+        """
+    )
+    op.drop_table("audit_logs_unpartitioned")
+
+    op.create_index(
+        op.f("ix_audit_logs_id"), "audit_logs", ["id"], unique=False
+    )
+    op.create_index(
+        "ix_audit_logs_changed_at",
+        "audit_logs",
+        [sa.text("changed_at DESC")],
+        unique=False,
+    )
+    op.create_index(
+        "ix_audit_logs_person_id_changed_at",
+        "audit_logs",
+        ["person_id", sa.text("changed_at DESC")],
+        unique=False,
+    )
+    op.create_index(
+        "ix_audit_logs_action_type_changed_at",
+        "audit_logs",
+        ["action_type", sa.text("changed_at DESC")],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE audit_logs RENAME TO audit_logs_partitioned")
+    op.execute(
+        "ALTER TABLE audit_logs_partitioned "
+        "RENAME CONSTRAINT audit_logs_pkey TO audit_logs_partitioned_pkey"
+    )
+    op.execute(
+        "ALTER TABLE audit_logs_partitioned "
+        "RENAME CONSTRAINT audit_logs_person_id_fkey "
+        "TO audit_logs_partitioned_person_id_fkey"
+    )
+    op.drop_index("ix_audit_logs_id", table_name="audit_logs_partitioned")
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY NONE")
+
+    op.create_table(
+        "audit_logs",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text("nextval('audit_logs_id_seq')"),
+            nullable=False,
+        ),
+        sa.Column(
+            "action_type",
+            postgresql.ENUM(name="actiontype", create_type=False),
+            nullable=False,
+        ),
+        sa.Column("person_id", sa.Integer(), nullable=True),
+        sa.Column("old_data", sa.JSON(), nullable=True),
+        sa.Column("new_data", sa.JSON(), nullable=True),
+        sa.Column("comment", sa.Text(), nullable=True),
+        sa.Column(
+            "changed_at",
+            sa.TIMESTAMP(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("changed_by", sa.String(length=100), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["person_id"], ["persons.id"], ondelete="SET NULL"
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id")
+    op.execute(
+        """
+        INSERT INTO audit_logs (id, action_type, person_id, old_data, new_data,
+                                comment, changed_at, changed_by)
+        SELECT id, action_type, person_id, old_data::json, new_data::json,
+               comment, changed_at, changed_by
+        FROM audit_logs_partitioned
+        """
+    )
+    # Dropping the partitioned table drops all of its partitions.
+    op.drop_table("audit_logs_partitioned")
+    op.create_index(
+        op.f("ix_audit_logs_id"), "audit_logs", ["id"], unique=False
+    )
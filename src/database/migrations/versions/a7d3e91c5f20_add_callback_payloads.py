@@ -0,0 +1,42 @@
+"""add callback payloads
+
+Revision ID: a7d3e91c5f20
+Revises: f2c8a05b7e13
+Create Date: 2024-10-26 18:12:40.318406
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a7d3e91c5f20"
+down_revision: Union[str, None] = "f2c8a05b7e13"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "callback_payloads",
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("payload", sa.LargeBinary(), nullable=False),
+        sa.Column("expires_at", sa.TIMESTAMP(), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index(
+        op.f("ix_callback_payloads_expires_at"),
+        "callback_payloads",
+        ["expires_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_callback_payloads_expires_at"), table_name="callback_payloads"
+    )
+    op.drop_table("callback_payloads")
@@ -0,0 +1,30 @@
+"""add protocol fingerprint
+
+Revision ID: b6e2c94d1f08
+Revises: 3e7d51b0c6a4
+Create Date: 2024-10-18 14:05:52.318640
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b6e2c94d1f08"
+down_revision: Union[str, None] = "3e7d51b0c6a4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "protocols",
+        sa.Column("fingerprint", sa.String(length=64), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("protocols", "fingerprint")
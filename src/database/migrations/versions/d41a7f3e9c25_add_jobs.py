@@ -0,0 +1,83 @@
+"""add jobs
+
+Revision ID: d41a7f3e9c25
+Revises: b6e2c94d1f08
+Create Date: 2024-10-19 11:27:03.540918
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d41a7f3e9c25"
+down_revision: Union[str, None] = "b6e2c94d1f08"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "jobs",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column(
+            "job_type",
+            sa.Enum(
+                "ADD_COMMITTEE_ATTENDANCE_POINTS",
+                "ADD_EVENT_ATTENDANCE_POINTS",
+                name="jobtype",
+            ),
+            nullable=False,
+        ),
+        sa.Column(
+            "status",
+            sa.Enum(
+                "PENDING", "RUNNING", "DONE", "FAILED", name="jobstatus"
+            ),
+            nullable=False,
+        ),
+        sa.Column(
+            "payload", postgresql.JSONB(astext_type=sa.Text()), nullable=False
+        ),
+        sa.Column("idempotency_key", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("max_attempts", sa.Integer(), nullable=False),
+        sa.Column("run_at", sa.TIMESTAMP(), nullable=False),
+        sa.Column("locked_until", sa.TIMESTAMP(), nullable=True),
+        sa.Column("chat_id", sa.BigInteger(), nullable=True),
+        sa.Column("message_id", sa.Integer(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("finished_at", sa.TIMESTAMP(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_jobs_idempotency_key_active",
+        "jobs",
+        ["idempotency_key"],
+        unique=True,
+        postgresql_where=sa.text("status IN ('PENDING', 'RUNNING')"),
+    )
+    op.create_index(
+        "ix_jobs_status_run_at",
+        "jobs",
+        ["status", "run_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_jobs_status_run_at", table_name="jobs")
+    op.drop_index("ix_jobs_idempotency_key_active", table_name="jobs")
+    op.drop_table("jobs")
+    sa.Enum(name="jobstatus").drop(op.get_bind(), checkfirst=False)
+    sa.Enum(name="jobtype").drop(op.get_bind(), checkfirst=False)
@@ -0,0 +1,60 @@
+"""add vk checker state
+
+Revision ID: f2c8a05b7e13
+Revises: d41a7f3e9c25
+Create Date: 2024-10-20 16:52:41.083127
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f2c8a05b7e13"
+down_revision: Union[str, None] = "d41a7f3e9c25"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "vk_checker_state",
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("enabled", sa.Boolean(), nullable=False),
+        sa.Column(
+            "updated_at",
+            sa.TIMESTAMP(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.create_table(
+        "vk_checker_cycles",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("instance", sa.String(length=100), nullable=False),
+        sa.Column("started_at", sa.TIMESTAMP(), nullable=False),
+        sa.Column("finished_at", sa.TIMESTAMP(), nullable=True),
+        sa.Column("duration", sa.Float(), nullable=True),
+        sa.Column("requests", sa.Integer(), nullable=False),
+        sa.Column("awards", sa.Integer(), nullable=False),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_vk_checker_cycles_started_at"),
+        "vk_checker_cycles",
+        ["started_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_vk_checker_cycles_started_at"), table_name="vk_checker_cycles"
+    )
+    op.drop_table("vk_checker_cycles")
+    op.drop_table("vk_checker_state")
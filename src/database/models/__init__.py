@@ -10,6 +10,11 @@ from .protocol_person import ProtocolPerson
 from .event_registration_table_person import EventRegistrationTablePerson
 from .event_registration_table import EventRegistrationTable
 from .event_type import EventType
+from .fsm_state import FsmState
+from .job import Job
+from .vk_checker_state import VkCheckerState
+from .vk_checker_cycle import VkCheckerCycle
+from .callback_payload import CallbackPayload
 from .base import Base
 
 
@@ -1,4 +1,7 @@
-from sqlalchemy import String, JSON, TIMESTAMP, func, Text, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import String, TIMESTAMP, func, Text, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .base import Base
@@ -7,14 +10,23 @@ from src.enums import ActionType
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
+    # The table is partitioned by month on 'changed_at', so the partition key is a part of the primary key.
+    # Partitions are created and dropped by 'Database.create_audit_log_partitions' and
+    # 'Database.drop_expired_audit_log_partitions'.
+    __table_args__ = (
+        Index('ix_audit_logs_changed_at', text('changed_at DESC')),
+        Index('ix_audit_logs_person_id_changed_at', 'person_id', text('changed_at DESC')),
+        Index('ix_audit_logs_action_type_changed_at', 'action_type', text('changed_at DESC')),
+        {'postgresql_partition_by': 'RANGE (changed_at)'},
+    )
 
-    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True, index=True)
     action_type: Mapped[ActionType]
     person_id: Mapped[int] = mapped_column(ForeignKey("persons.id", ondelete="SET NULL"), nullable=True)
-    old_data: Mapped[dict | None] = mapped_column(JSON)
-    new_data: Mapped[dict | None] = mapped_column(JSON)
+    old_data: Mapped[dict | None] = mapped_column(JSONB)
+    new_data: Mapped[dict | None] = mapped_column(JSONB)
     comment: Mapped[str | None] = mapped_column(Text)
-    changed_at: Mapped[str] = mapped_column(TIMESTAMP, server_default=func.now())
+    changed_at: Mapped[datetime] = mapped_column(TIMESTAMP, primary_key=True, server_default=func.now())
     changed_by: Mapped[str] = mapped_column(String(100))
 
     person: Mapped["Person"] = relationship("Person", back_populates="audit_logs")
@@ -0,0 +1,14 @@
+from datetime import datetime
+
+from sqlalchemy import String, TIMESTAMP, LargeBinary
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class CallbackPayload(Base):
+    __tablename__ = "callback_payloads"
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    payload: Mapped[bytes] = mapped_column(LargeBinary)
+    expires_at: Mapped[datetime] = mapped_column(TIMESTAMP, index=True)
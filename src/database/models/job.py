@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from sqlalchemy import String, TIMESTAMP, BigInteger, Text, Index, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+from src.enums import JobType, JobStatus
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # One active job per key: pressing a button twice doesn't run the work twice,
+        # but the same work can be run again once the job is finished.
+        Index('ix_jobs_idempotency_key_active', 'idempotency_key', unique=True,
+              postgresql_where=text("status IN ('PENDING', 'RUNNING')")),
+        Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    job_type: Mapped[JobType]
+    status: Mapped[JobStatus] = mapped_column(default=JobStatus.PENDING)
+    payload: Mapped[dict] = mapped_column(JSONB, default=dict)
+    idempotency_key: Mapped[str] = mapped_column(String)
+    attempts: Mapped[int] = mapped_column(default=0)
+    max_attempts: Mapped[int]
+    run_at: Mapped[datetime] = mapped_column(TIMESTAMP)
+    locked_until: Mapped[datetime | None] = mapped_column(TIMESTAMP)
+    chat_id: Mapped[int | None] = mapped_column(BigInteger)
+    message_id: Mapped[int | None]
+    error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now())
+    finished_at: Mapped[datetime | None] = mapped_column(TIMESTAMP)
@@ -1,4 +1,4 @@
-from sqlalchemy import ForeignKey, Date, UniqueConstraint
+from sqlalchemy import ForeignKey, Date, UniqueConstraint, String
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
 
@@ -13,6 +13,8 @@ class Protocol(Base):
     number: Mapped[int]
     date: Mapped[datetime] = mapped_column(Date())
     committee_id: Mapped[int] = mapped_column(ForeignKey("committees.id", ondelete="CASCADE"))
+    # A hash of the number, the date and the persons of the protocol as they were processed last time.
+    fingerprint: Mapped[str | None] = mapped_column(String(64))
 
     committee: Mapped["Committee"] = relationship("Committee", back_populates="protocols")
     persons: Mapped[list["ProtocolPerson"]] = relationship("ProtocolPerson", back_populates="protocol")
@@ -0,0 +1,19 @@
+from datetime import datetime
+
+from sqlalchemy import String, TIMESTAMP, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class VkCheckerCycle(Base):
+    __tablename__ = "vk_checker_cycles"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    instance: Mapped[str] = mapped_column(String(100))
+    started_at: Mapped[datetime] = mapped_column(TIMESTAMP, index=True)
+    finished_at: Mapped[datetime | None] = mapped_column(TIMESTAMP)
+    duration: Mapped[float | None]
+    requests: Mapped[int] = mapped_column(default=0)
+    awards: Mapped[int] = mapped_column(default=0)
+    error: Mapped[str | None] = mapped_column(Text)
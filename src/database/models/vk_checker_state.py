@@ -0,0 +1,14 @@
+from datetime import datetime
+
+from sqlalchemy import String, TIMESTAMP, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class VkCheckerState(Base):
+    __tablename__ = "vk_checker_state"
+
+    name: Mapped[str] = mapped_column(String, primary_key=True)
+    enabled: Mapped[bool] = mapped_column(default=False)
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
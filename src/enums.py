@@ -11,6 +11,18 @@ class DocumentType(Enum):
     EVENT_REGISTRATION_TABLE = 'event_registration_table'
 
 
+class JobType(Enum):
+    ADD_COMMITTEE_ATTENDANCE_POINTS = 'add_committee_attendance_points'
+    ADD_EVENT_ATTENDANCE_POINTS = 'add_event_attendance_points'
+
+
+class JobStatus(Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
 class ActionType(Enum):
     INSERT_PERSON = 'Добавление человека'
     DELETE_PERSON = 'Удаление человека'
@@ -1,2 +1,11 @@
 class GoogleAPIError(Exception):
     """When raised APIError"""
+
+
+class VkAPIError(Exception):
+    """When VK API returned an error"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"VK API error {code}: {message}")
+        self.code = code
+        self.message = message
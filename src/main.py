@@ -1,32 +1,87 @@
 import asyncio
+from contextlib import suppress
+from datetime import timedelta
 
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from aiogram import Bot
 from aiogram.enums import ParseMode
 from aiogram.client.bot import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
 from src.logging_ import logger
 from src.config_reader import settings
 from src.bot.custom_dispatcher import CustomDispatcher
+from src.bot.webhook import run_webhook
+from src.bot.fsm_storage import PostgresStorage
+from src.bot.menu_cache import menu_cache
+from src.bot.job_queue import job_queue
+from src.bot.callback_payload_store import callback_payload_store
+from src.bot.handlers.menu_content import menu_router
+from src.bot.template_engine import precompile_templates, validate_templates
 from src.bot.ui_commands import set_bot_commands
 from src.bot.middlewares import AdminUserMiddleware, ResourcesMiddleware, LogAllEventsMiddleware
 from src.bot import handlers, callbacks
-from src.api import VkAPI, GoogleAPI, TelegraphAPI
-from src.vk_activities_checker import VkActivitiesChecker
+from src.api import VkAPI, GoogleAPI, AsyncGoogleAPI, TelegraphAPI
+from src.vk_activities_checker import VkActivitiesChecker, CHECKER_NAME
 from src.database import Database
+from src.database.advisory_lock import AdvisoryLock
+from src.enums import MenuName
+from src.metrics import start_metrics_server
+from src.tracing import configure_tracing, shutdown_tracing
+
+
+async def maintain_audit_logs(db: Database):
+    """
+    Keeps monthly partitions of the audit logs ahead of time and drops expired ones once a day.
+    :param db: The Database object.
+    :return: None.
+    """
+    while True:
+        try:
+            created = await db.create_audit_log_partitions(settings.AUDIT_LOGS_PARTITIONS_AHEAD)
+            if created:
+                logger.info(f"Audit log partitions created: {', '.join(created)}")
+            if settings.AUDIT_LOGS_RETENTION_MONTHS > 0:
+                dropped = await db.drop_expired_audit_log_partitions(settings.AUDIT_LOGS_RETENTION_MONTHS)
+                if dropped:
+                    logger.info(f"Expired audit log partitions dropped: {', '.join(dropped)}")
+        except Exception as e:
+            logger.error(f"Error while maintaining audit log partitions: {e}")
+        await asyncio.sleep(24 * 60 * 60)
 
 
 async def main():
+    configure_tracing(exporter=settings.TRACING_EXPORTER, slow_threshold_ms=settings.TRACING_SLOW_THRESHOLD_MS,
+                      jsonl_path=settings.TRACING_JSONL_PATH, otlp_endpoint=settings.TRACING_OTLP_ENDPOINT)
+    precompile_templates()
+    validate_templates(menu_router.menu_names | {MenuName.START})
     engine = create_async_engine(url=settings.database_url_asyncpg, echo=False)
     async_session = async_sessionmaker(bind=engine, class_=AsyncSession)
     db = Database(async_session)
-    vk_api = VkAPI(settings.VK_TOKEN.get_secret_value())
-    google_api = GoogleAPI(settings.google_creds_path)
+    db.add_write_listener(menu_cache.invalidate)
+    vk_api = VkAPI(settings.VK_TOKEN.get_secret_value(), max_rate=settings.VK_API_RATE_LIMIT,
+                   min_rate=settings.VK_API_MIN_RATE, max_retries=settings.VK_API_MAX_RETRIES,
+                   resolver_ttl=settings.VK_RESOLVER_CACHE_TTL,
+                   resolver_negative_ttl=settings.VK_RESOLVER_NEGATIVE_TTL)
+    google_api = AsyncGoogleAPI(GoogleAPI(settings.google_creds_path), max_workers=settings.GOOGLE_API_MAX_WORKERS,
+                                timeout=settings.GOOGLE_API_TIMEOUT)
     telegraph_api = TelegraphAPI()
-    vk_activities_checker = VkActivitiesChecker(db=db, vk_api=vk_api)
+    vk_activities_checker = VkActivitiesChecker(db=db, vk_api=vk_api,
+                                                lock=AdvisoryLock(engine, CHECKER_NAME))
+
+    # A custom Bot API server, e.g. a local one or a fake Telegram for testing the webhook mode
+    session = None
+    if settings.TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL))
 
-    bot = Bot(token=settings.BOT_TOKEN.get_secret_value(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = CustomDispatcher()
+    bot = Bot(token=settings.BOT_TOKEN.get_secret_value(), session=session,
+              default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    storage = PostgresStorage(db=db, ttl=timedelta(seconds=settings.FSM_STORAGE_TTL),
+                              flush_interval=settings.FSM_STORAGE_FLUSH_INTERVAL,
+                              expiry_interval=settings.FSM_STORAGE_EXPIRY_INTERVAL,
+                              cache_ttl=settings.FSM_STORAGE_CACHE_TTL)
+    dp = CustomDispatcher(storage=storage)
 
     log_all_middleware = LogAllEventsMiddleware()
     dp.message.middleware(log_all_middleware)
@@ -47,9 +102,38 @@ async def main():
         handlers.vk_activities_check.router
     )
 
+    audit_logs_task = asyncio.create_task(maintain_audit_logs(db))
+    callback_payload_store.start(db=db, ttl=timedelta(seconds=settings.CALLBACK_PAYLOADS_TTL),
+                                 flush_interval=settings.CALLBACK_PAYLOADS_FLUSH_INTERVAL)
+    job_queue.start(db=db, bot=bot, workers=settings.JOB_QUEUE_WORKERS,
+                    lease=timedelta(seconds=settings.JOB_QUEUE_LEASE),
+                    poll_interval=settings.JOB_QUEUE_POLL_INTERVAL, max_attempts=settings.JOB_QUEUE_MAX_ATTEMPTS,
+                    retry_delay=timedelta(seconds=settings.JOB_QUEUE_RETRY_DELAY))
+
+    metrics_runner = None
+    if settings.METRICS_ENABLED:
+        metrics_runner = await start_metrics_server(settings.METRICS_HOST, settings.METRICS_PORT)
+        logger.info(f"Metrics are exposed on http://{settings.METRICS_HOST}:{settings.METRICS_PORT}/metrics")
+
     await set_bot_commands(bot)
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    await vk_activities_checker.resume()
+    try:
+        if settings.BOT_RUN_MODE == 'webhook':
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        audit_logs_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await audit_logs_task
+        await job_queue.close()
+        await storage.close()
+        await callback_payload_store.close()
+        google_api.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await shutdown_tracing()
 
 
 if __name__ == '__main__':
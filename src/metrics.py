@@ -0,0 +1,180 @@
+__all__ = ["HANDLER_LATENCY", "MENU_LATENCY", "EXTERNAL_CALL_LATENCY", "ERRORS", "VK_RATE_LIMIT", "VK_THROTTLED",
+           "VK_RETRIES", "observe", "instrument", "track_menu", "start_metrics_server"]
+
+import functools
+import inspect
+import time
+from contextlib import aclosing
+from typing import Callable, Any
+
+from aiohttp import web
+from prometheus_client import Histogram, Counter, Gauge, CONTENT_TYPE_LATEST, generate_latest
+
+from src.tracing import span
+
+HANDLER_LATENCY = Histogram(
+    "guss_handler_duration_seconds",
+    "Duration of Telegram update handlers",
+    ["handler"]
+)
+MENU_LATENCY = Histogram(
+    "guss_menu_duration_seconds",
+    "Duration of building menu content",
+    ["menu_name"]
+)
+EXTERNAL_CALL_LATENCY = Histogram(
+    "guss_external_call_duration_seconds",
+    "Duration of calls to the database and external APIs",
+    ["service", "method"]
+)
+ERRORS = Counter(
+    "guss_errors_total",
+    "Number of errors raised by handlers, menus, the database and external APIs",
+    ["source", "name"]
+)
+VK_RATE_LIMIT = Gauge(
+    "guss_vk_rate_limit",
+    "Current number of VK API requests per second allowed by the governor"
+)
+VK_THROTTLED = Counter(
+    "guss_vk_throttled_total",
+    "Number of VK API answers reporting too many requests",
+    ["code"]
+)
+VK_RETRIES = Counter(
+    "guss_vk_retries_total",
+    "Number of retried VK API requests",
+    ["method"]
+)
+
+
+def observe(service: str, method: str) -> Callable:
+    """
+    Returns a decorator which measures a duration of the function, counts its errors and wraps every call
+    with a tracing span named '<service>.<method>'. Works with regular, coroutine, generator and async generator
+    functions, generators are measured until they are exhausted or closed. Generators get no span: it would stay
+    the current span of the caller while the generator is suspended.
+    :param service: The name of the service the function belongs to, e.g. 'db' or 'vk'.
+    :param method: The name of the method.
+    """
+    histogram = EXTERNAL_CALL_LATENCY.labels(service=service, method=method)
+    errors = ERRORS.labels(source=service, name=method)
+    span_name = f"{service}.{method}"
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                start_time = time.perf_counter()
+                try:
+                    with span(span_name):
+                        return await func(*args, **kwargs)
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start_time)
+
+            return async_wrapper
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args: Any, **kwargs: Any) -> Any:
+                start_time = time.perf_counter()
+                try:
+                    async with aclosing(func(*args, **kwargs)) as items:
+                        async for item in items:
+                            yield item
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start_time)
+
+            return async_gen_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args: Any, **kwargs: Any) -> Any:
+                start_time = time.perf_counter()
+                try:
+                    yield from func(*args, **kwargs)
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start_time)
+
+            return gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start_time = time.perf_counter()
+            try:
+                with span(span_name):
+                    return func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start_time)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument(service: str) -> Callable[[type], type]:
+    """
+    Returns a class decorator which wraps every public method of the class with 'observe'.
+    Static and class methods are left as they are.
+    :param service: The name of the service, used as a label of the metrics.
+    """
+    def decorator(cls: type) -> type:
+        for name, attr in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.isfunction(attr):
+                continue
+            setattr(cls, name, observe(service, name)(attr))
+        return cls
+
+    return decorator
+
+
+def track_menu(func: Callable) -> Callable:
+    """
+    Decorates a function which builds menu content from 'MenuCallback' and measures it per menu name.
+    """
+    @functools.wraps(func)
+    async def wrapper(callback_data, *args: Any, **kwargs: Any) -> Any:
+        menu_name = callback_data.menu_name.value
+        start_time = time.perf_counter()
+        try:
+            with span(f"menu.{menu_name}", level=callback_data.level):
+                return await func(callback_data, *args, **kwargs)
+        except Exception:
+            ERRORS.labels(source="menu", name=menu_name).inc()
+            raise
+        finally:
+            MENU_LATENCY.labels(menu_name=menu_name).observe(time.perf_counter() - start_time)
+
+    return wrapper
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """
+    Starts an HTTP server exposing metrics in Prometheus text format on '/metrics'.
+    :param host: The host to listen on.
+    :param port: The port to listen on.
+    :return: The AppRunner object, call 'cleanup()' on it to stop the server.
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
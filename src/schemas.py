@@ -96,11 +96,9 @@ class EventRegistrationTablePersonDTO(BaseModel):
 
     @field_validator('status', mode='before')
     @classmethod
-    def check_valid_status(cls, status: str) -> bool:
-        if status == 'TRUE':
-            return True
-        else:
-            return False
+    def check_valid_status(cls, status: str | bool) -> bool:
+        # Checkboxes come as booleans when read unformatted and as 'TRUE'/'FALSE' when formatted.
+        return status is True or status == 'TRUE'
 
 
 class GoogleDocProtocolDTO(BaseModel):
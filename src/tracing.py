@@ -0,0 +1,312 @@
+__all__ = ["Span", "Trace", "span", "start_trace", "traced", "format_waterfall", "JsonLinesExporter",
+           "OtlpHttpExporter", "configure_tracing", "shutdown_tracing"]
+
+import asyncio
+import functools
+import inspect
+import json
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Iterator, Protocol
+
+import aiofiles
+import aiohttp
+
+from src.logging_ import logger
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_time: float
+    start_counter: float
+    duration: float | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    spans: list[Span] = field(default_factory=list)
+    # Set when the root span ends. Tasks started during the trace inherit it with their context,
+    # their later spans must not be added to it.
+    finished: bool = False
+
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+
+
+class Exporter(Protocol):
+    async def export(self, trace: Trace): ...
+
+    async def close(self): ...
+
+
+_current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+_exporter: Exporter | None = None
+_slow_threshold: float = 1.0
+_export_tasks: set[asyncio.Task] = set()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    """
+    Opens a span as a child of the current one. Outside a trace or after it finished it does nothing
+    and yields None. Spans propagate through contextvars, so they follow awaits, tasks and 'asyncio.to_thread'
+    calls. Long-lived tasks should be started with an empty context, not to be bound to the trace they start in.
+    :param name: The name of the span.
+    :param attributes: Attributes of the span.
+    """
+    trace = _current_trace.get()
+    if trace is None or trace.finished:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        trace_id=trace.trace_id,
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent else None,
+        start_time=time.time(),
+        start_counter=time.perf_counter(),
+        attributes=attributes
+    )
+    trace.spans.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start_counter
+        _current_span.reset(token)
+
+
+@contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Starts a new trace with a root span. When the root span ends, the trace is exported
+    only if it took longer than the slow threshold (tail sampling).
+    :param name: The name of the root span.
+    :param attributes: Attributes of the root span.
+    """
+    trace = Trace(trace_id=secrets.token_hex(16))
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        trace.finished = True
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        _finish_trace(trace)
+
+
+def traced(name: str | None = None) -> Callable:
+    """
+    Returns a decorator which wraps every call of the function with a span.
+    Works with both regular and coroutine functions.
+    :param name: The name of the span. Defaults to the qualified name of the function.
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(span_name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _get_span_depth(trace: Trace, current: Span) -> int:
+    spans = {s.span_id: s for s in trace.spans}
+    depth = 0
+    while current.parent_id in spans:
+        current = spans[current.parent_id]
+        depth += 1
+    return depth
+
+
+def format_waterfall(trace: Trace, width: int = 40) -> str:
+    """
+    Formats the spans of a trace as a text waterfall: offset, bar, nested name and duration of each span.
+    :param trace: The Trace object.
+    :param width: The width of the bars in characters.
+    :return: The waterfall text.
+    """
+    root = trace.root
+    total = root.duration or 1e-9
+    lines = [f"Trace {trace.trace_id} `{root.name}` took {root.duration * 1000:.1f} ms"]
+    for s in trace.spans:
+        offset = s.start_counter - root.start_counter
+        duration = s.duration or 0.0
+        bar_start = int(offset / total * width)
+        bar_length = max(1, int(duration / total * width))
+        bar = " " * bar_start + "█" * bar_length
+        indent = "  " * _get_span_depth(trace, s)
+        error = f" ERROR {s.error}" if s.error else ""
+        lines.append(f"{offset * 1000:>8.1f} ms |{bar:<{width}}| {indent}{s.name} {duration * 1000:.1f} ms{error}")
+    return "\n".join(lines)
+
+
+def _finish_trace(trace: Trace):
+    root = trace.root
+    if _exporter is None or root.duration is None or root.duration < _slow_threshold:
+        return
+
+    logger.warning(f"Slow update:\n{format_waterfall(trace)}")
+    try:
+        task = asyncio.get_running_loop().create_task(_exporter.export(trace))
+    except RuntimeError:
+        return
+    _export_tasks.add(task)
+    task.add_done_callback(_export_tasks.discard)
+
+
+def _span_to_dict(trace: Trace, s: Span) -> dict[str, Any]:
+    return {
+        "name": s.name,
+        "span_id": s.span_id,
+        "parent_id": s.parent_id,
+        "offset_ms": round((s.start_counter - trace.root.start_counter) * 1000, 3),
+        "duration_ms": round((s.duration or 0.0) * 1000, 3),
+        "attributes": s.attributes,
+        "error": s.error,
+    }
+
+
+class JsonLinesExporter:
+    """
+    Appends every exported trace to a local file as one JSON line with its span waterfall.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def export(self, trace: Trace):
+        root = trace.root
+        record = {
+            "trace_id": trace.trace_id,
+            "name": root.name,
+            "started_at": datetime.fromtimestamp(root.start_time).isoformat(),
+            "duration_ms": round((root.duration or 0.0) * 1000, 3),
+            "spans": [_span_to_dict(trace, s) for s in trace.spans],
+        }
+        try:
+            async with aiofiles.open(self.path, "a", encoding="utf-8") as f:
+                await f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            logger.error(f"Error while exporting trace {trace.trace_id} to {self.path}: {e}")
+
+    async def close(self):
+        pass
+
+
+class OtlpHttpExporter:
+    """
+    Sends every exported trace to an OTLP-compatible collector with the OTLP/HTTP JSON protocol.
+    """
+
+    def __init__(self, endpoint: str, service_name: str = "guss-telegram-bot"):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self._session: aiohttp.ClientSession | None = None
+
+    @staticmethod
+    def _to_attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+        return [{"key": key, "value": {"stringValue": str(value)}} for key, value in attributes.items()]
+
+    def _to_otlp_span(self, s: Span) -> dict[str, Any]:
+        start_ns = int(s.start_time * 1e9)
+        otlp_span = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int((s.duration or 0.0) * 1e9)),
+            "attributes": self._to_attributes(s.attributes),
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        }
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+        return otlp_span
+
+    async def export(self, trace: Trace):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": self._to_attributes({"service.name": self.service_name})},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [self._to_otlp_span(s) for s in trace.spans],
+                }],
+            }]
+        }
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        try:
+            async with self._session.post(self.url, json=payload) as response:
+                response.raise_for_status()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Error while exporting trace {trace.trace_id} to {self.url}: {e}")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def configure_tracing(exporter: str, slow_threshold_ms: int, jsonl_path: str, otlp_endpoint: str):
+    """
+    Configures exporting of slow traces.
+    :param exporter: 'jsonl' to append traces to a local file, 'otlp' to send them to a collector,
+        'none' to disable exporting.
+    :param slow_threshold_ms: Only traces whose root span took at least that long are exported.
+    :param jsonl_path: The path of the JSON-lines file.
+    :param otlp_endpoint: The base URL of the OTLP/HTTP collector.
+    :return: None.
+    """
+    global _exporter, _slow_threshold
+
+    _slow_threshold = slow_threshold_ms / 1000
+    if exporter == "jsonl":
+        _exporter = JsonLinesExporter(jsonl_path)
+    elif exporter == "otlp":
+        _exporter = OtlpHttpExporter(otlp_endpoint)
+    else:
+        _exporter = None
+
+
+async def shutdown_tracing():
+    """
+    Waits for pending exports and closes the exporter.
+    """
+    if _export_tasks:
+        await asyncio.gather(*_export_tasks, return_exceptions=True)
+    if _exporter is not None:
+        await _exporter.close()
@@ -1,92 +1,279 @@
 import asyncio
-from typing import Any
-
-import pandas as pd
-from pandas import DataFrame
+import contextvars
+import os
+import socket
+import time
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import Any, Callable, NamedTuple
 
 from src.config_reader import settings
 from src.enums import ActivityType, ActionType
 from src.bot.utils import log_action, ContextData
 from src.api import VkAPI
+from src.api.vk_session import VkPost
 from src.database import Database
+from src.database.advisory_lock import AdvisoryLock
+from src.database.identity_map import identity_map_scope
 from src.logging_ import logger
 
 
+# The name of the checker state and of its lock, the same for all bot instances.
+CHECKER_NAME = 'vk_activities_checker'
+
+
+class Activity(NamedTuple):
+    vk_id: int
+    post_url: str
+    activity_type: ActivityType
+
+
 class VkActivitiesChecker:
-    def __init__(self, db: Database, vk_api: VkAPI):
+    def __init__(self, db: Database, vk_api: VkAPI, lock: AdvisoryLock):
+        """
+        :param db: The Database object.
+        :param vk_api: The VkAPI object.
+        :param lock: The lock shared by all bot instances, only the holder runs the checks.
+        """
         self.task_running = False
-        self._loop = asyncio.new_event_loop()
+        self.instance = f"{socket.gethostname()}:{os.getpid()}"
         self.db = db
         self.vk_api = vk_api
+        self.lock = lock
+        self._task: asyncio.Task | None = None
+        self._stopped = asyncio.Event()
+        # Incremented by 'start_checking', so a loop which has just read the old state doesn't stop a new start.
+        self._starts = 0
+        # VkAPI is blocking, its calls run in threads. The rate is limited by its governor,
+        # the semaphore only bounds the number of threads waiting for it.
+        self._vk_semaphore = asyncio.Semaphore(settings.VK_API_MAX_CONCURRENCY)
+        # When the likes and comments of a post were checked last time, by the post URL.
+        self._posts_checked_at: dict[str, datetime] = {}
+
+    async def _call_vk(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        async with self._vk_semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    @property
+    def is_leader(self) -> bool:
+        return self.lock.is_acquired
+
+    async def _sleep(self, seconds: float):
+        # Woken up by 'stop_checking', so the lock is released at once.
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._stopped.wait(), seconds)
+
+    async def _check_enabled(self) -> bool:
+        """
+        Reads the state of the checker from the database and stops the local checks if the checker was stopped,
+        possibly by another bot instance. If the state can't be read, the checks go on.
+        :return: True if the checks should go on, False otherwise.
+        """
+        starts = self._starts
+        try:
+            enabled = await self.db.get_vk_checker_enabled(CHECKER_NAME)
+        except Exception as e:
+            logger.error(f"Error while reading the VkActivityChecker state: {e}")
+            return self.task_running
+
+        if not enabled and self.task_running and self._starts == starts:
+            self.task_running = False
+            logger.info('VKActivityChecker has been stopped by another instance')
+        return self.task_running
 
     async def process_groups(self):
+        """
+        Runs the check cycles while this instance holds the lock. Other instances try to take the lock every
+        'VK_CHECKER_LOCK_RETRY_INTERVAL' seconds, so one of them takes over soon after the holder stops or dies.
+        If the connection holding the lock is lost, the current cycle is cancelled, as another instance
+        may be running the checks already.
+        The state in the database is checked before taking the lock and before every cycle, so the checks
+        are stopped on every instance when any of them handles the stop command.
+        """
         while self.task_running:
+            if not await self._check_enabled():
+                break
+
+            try:
+                acquired = await self.lock.try_acquire()
+            except Exception as e:
+                logger.error(f"Error while acquiring the VkActivityChecker lock: {e}")
+                acquired = False
+
+            if not acquired:
+                await self._sleep(settings.VK_CHECKER_LOCK_RETRY_INTERVAL)
+                continue
+
+            logger.info('VkActivityChecker has acquired the lock')
+            try:
+                abandoned = await self.db.abandon_vk_checker_cycles()
+                if abandoned:
+                    logger.warning(f"VkActivityChecker cycles abandoned by the previous leader: {abandoned}")
+            except Exception as e:
+                logger.error(f"Error while closing abandoned VkActivityChecker cycles: {e}")
+            cycles = asyncio.create_task(self._run_cycles())
+            lock_lost = asyncio.create_task(self.lock.wait_lost(settings.VK_CHECKER_LOCK_CHECK_INTERVAL))
+            try:
+                await asyncio.wait({cycles, lock_lost}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in (cycles, lock_lost):
+                    task.cancel()
+                results = await asyncio.gather(cycles, lock_lost, return_exceptions=True)
+                await self.lock.release()
+
+            if isinstance(results[0], Exception):
+                logger.error(f"VkActivityChecker cycle failed: {results[0]}")
+                await self._sleep(settings.VK_CHECKER_LOCK_RETRY_INTERVAL)
+
+    async def _run_cycles(self):
+        while await self._check_enabled():
+            await self.run_cycle()
+            await self._sleep(settings.VK_ACTIVITIES_CHECKER_TIMEOUT)
+
+    async def run_cycle(self):
+        """
+        Checks all the groups once and records the cycle in the database: its start, end and duration,
+        the number of VK requests made and of activities awarded. Cycles older than
+        'VK_CHECKER_CYCLES_RETENTION_DAYS' are deleted.
+        Every cycle has its own identity map, so the rows changed since the previous cycle are loaded again.
+        :return: None.
+        """
+        with identity_map_scope():
+            await self._run_cycle()
+
+    async def _run_cycle(self):
+        started_at = datetime.now()
+        start_time = time.perf_counter()
+        requests_before = self.vk_api.requests_count
+        cycle_id = await self.db.insert_vk_checker_cycle(instance=self.instance, started_at=started_at)
+
+        awards, error = 0, None
+        try:
             tasks = [self.check_activities(domain) for domain in settings.VK_GROUP_DOMAINS]
-            await asyncio.gather(*tasks)
-            await asyncio.sleep(settings.VK_ACTIVITIES_CHECKER_TIMEOUT)
-            logger.info('VkActivityChecker is iterating')
+            awards = sum(await asyncio.gather(*tasks))
+        except asyncio.CancelledError:
+            error = 'Cancelled'
+            raise
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            duration = time.perf_counter() - start_time
+            requests = self.vk_api.requests_count - requests_before
+            await self.db.finish_vk_checker_cycle(cycle_id, finished_at=datetime.now(), duration=duration,
+                                                  requests=requests, awards=awards, error=error)
+            logger.info(f"VkActivityChecker cycle took {duration:.1f} s: {requests} requests, {awards} awards")
+
+        try:
+            await self.db.delete_vk_checker_cycles_before(
+                started_at - timedelta(days=settings.VK_CHECKER_CYCLES_RETENTION_DAYS)
+            )
+        except Exception as e:
+            logger.error(f"Error while deleting old VkActivityChecker cycles: {e}")
 
-    async def check_activities(self, domain: str | int):
+    async def check_activities(self, domain: str | int) -> int:
+        """
+        Checks the group and awards the new activities.
+        :return: The number of awarded activities.
+        """
+        # A set, because a one person can only have one activity of a type under a post
         activities = await self.process_group(domain)
-        # Create a DataFrame and drop duplicates because a one person can only have one activity under a post
-        if activities:
-            activities_df = pd.DataFrame(activities).drop_duplicates(subset=['vk_id', 'post_url', 'activity_type'])
-
-            persons = await self.db.get_persons_ids_and_vk_ids()
-            persons_df = pd.DataFrame(persons)
-
-            merged_df = pd.merge(activities_df, persons_df, on='vk_id', how='inner').drop(columns='vk_id')
-            promotion_category = await self.db.get_category(name='Пиар ГУСС')
-
-            await self.process_new_records(merged_df, promotion_category.id)
-
-    async def process_new_records(self, new_records: DataFrame, promotion_category_id: int):
-        for _, row in new_records.iterrows():
-            person_id = row['person_id']
-            post_url = row['post_url']
-            activity_type = row['activity_type']
-            context_data = ContextData(person_id=person_id, comment=f'Лайк поста в ВК. Ссылка {post_url}')
-
-            if await self.db.insert_vk_activity(person_id, post_url, activity_type):
-                if activity_type == ActivityType.VK_LIKE:
-                    context_data.comment = f'Лайк поста в ВК. Ссылка {post_url}'
-                    async with log_action(db=self.db, action_type=ActionType.UPDATE_PERSON_POINTS, username='ГУСС-топ',
-                                          context_data=context_data):
-                        await self.db.update_person_points(person_id, promotion_category_id, settings.VK_LIKE_POINTS)
-                else:
-                    context_data.comment = f'Комментирование поста в ВК. Ссылка {post_url}'
-                    async with log_action(db=self.db, action_type=ActionType.UPDATE_PERSON_POINTS, username='ГУСС-топ',
-                                          context_data=context_data):
-                        await self.db.update_person_points(person_id, promotion_category_id, settings.VK_COMMENT_POINTS)
-
-    async def process_group(self, domain: str | int) -> list[dict[str, Any]]:
-        group_data = []
+        if not activities:
+            return 0
+
+        person_ids = await self.db.get_person_ids_by_vk_ids()
+        promotion_category = await self.db.get_category(name='Пиар ГУСС')
+
+        return await self.process_new_records(activities, person_ids, promotion_category.id)
+
+    async def process_new_records(self, activities: set[Activity], person_ids: dict[int, int],
+                                  promotion_category_id: int) -> int:
+        awards = 0
+        for activity in activities:
+            person_id = person_ids.get(activity.vk_id)
+            if person_id is None:
+                continue
+
+            post_url = activity.post_url
+            if activity.activity_type == ActivityType.VK_LIKE:
+                comment, points = f'Лайк поста в ВК. Ссылка {post_url}', settings.VK_LIKE_POINTS
+            else:
+                comment, points = f'Комментирование поста в ВК. Ссылка {post_url}', settings.VK_COMMENT_POINTS
+
+            if await self.db.insert_vk_activity(person_id, post_url, activity.activity_type):
+                context_data = ContextData(person_id=person_id, comment=comment)
+                async with log_action(db=self.db, action_type=ActionType.UPDATE_PERSON_POINTS, username='ГУСС-топ',
+                                      context_data=context_data):
+                    await self.db.update_person_points(person_id, promotion_category_id, points)
+                awards += 1
+
+        return awards
+
+    def _is_post_due(self, post: VkPost, post_url: str, now: datetime) -> bool:
+        """
+        Decides if the likes and comments of the post should be checked in this cycle. Recent posts are checked
+        every cycle, older ones within the window once per 'VK_OLD_POSTS_RESCAN_INTERVAL' seconds,
+        as they rarely get new activities.
+        """
+        if now - post.date <= timedelta(hours=settings.VK_RECENT_POSTS_HOURS):
+            return True
+        checked_at = self._posts_checked_at.get(post_url)
+        return checked_at is None or now - checked_at >= timedelta(seconds=settings.VK_OLD_POSTS_RESCAN_INTERVAL)
+
+    async def process_post(self, group_id: int, post_id: int) -> set[Activity]:
+        """
+        Gets the likes and comments of the post. The post is marked as checked only if both are fetched,
+        otherwise it's checked again in the next cycle. The activities of the fetched part are returned anyway.
+        """
+        post_url = self.vk_api.get_post_url(owner_id=-group_id, post_id=post_id)
+        checked_at = datetime.now()
+
+        liked_ids, commented_ids = await asyncio.gather(
+            self._call_vk(self.vk_api.get_post_liked_ids, owner_id=-group_id, item_id=post_id),
+            self._call_vk(self.vk_api.get_post_commented_ids, owner_id=-group_id, post_id=post_id),
+            return_exceptions=True
+        )
+
+        activities = set()
+        if isinstance(liked_ids, Exception):
+            logger.error(f"Error while getting likes for post {post_url}: {liked_ids}")
+        else:
+            activities.update(Activity(user_id, post_url, ActivityType.VK_LIKE) for user_id in liked_ids)
+        if isinstance(commented_ids, Exception):
+            logger.error(f"Error while getting comments for post {post_url}: {commented_ids}")
+        else:
+            activities.update(Activity(user_id, post_url, ActivityType.VK_COMMENT) for user_id in commented_ids)
+
+        if not isinstance(liked_ids, Exception) and not isinstance(commented_ids, Exception):
+            self._posts_checked_at[post_url] = checked_at
+        return activities
+
+    def _forget_posts_before(self, window_start: datetime):
+        # A post is checked after it's published, so a check before the window start means the post
+        # is out of the window too and won't be checked again.
+        for post_url in [url for url, checked_at in self._posts_checked_at.items() if checked_at < window_start]:
+            del self._posts_checked_at[post_url]
+
+    async def process_group(self, domain: str | int) -> set[Activity]:
+        group_data = set()
         try:
-            group_id = self.vk_api.get_group_id(domain)
-            group_screen_name = self.vk_api.get_group_screen_name(domain)
-            post_ids = self.vk_api.get_group_posts_ids(group_screen_name, count=settings.VK_GROUP_POSTS_COUNT)
-
-            for post_id in post_ids:
-                post_url = self.vk_api.get_post_url(owner_id=-group_id, post_id=post_id)
-
-                liked_ids = self.vk_api.get_post_liked_ids(owner_id=-group_id, item_id=post_id)
-                commented_ids = self.vk_api.get_post_commented_ids(owner_id=-group_id, post_id=post_id)
-
-                for user_id in set(liked_ids + commented_ids):
-                    if user_id in liked_ids:
-                        activity_type = ActivityType.VK_LIKE
-                        group_data.append({
-                            'vk_id': user_id,
-                            'post_url': post_url,
-                            'activity_type': activity_type.name
-                        })
-                    if user_id in commented_ids:
-                        activity_type = ActivityType.VK_COMMENT
-                        group_data.append({
-                            'vk_id': user_id,
-                            'post_url': post_url,
-                            'activity_type': activity_type.name
-                        })
+            group = await self._call_vk(self.vk_api.resolve_group, domain)
+            if group is None:
+                return group_data
+
+            now = datetime.now()
+            window_start = now - timedelta(days=settings.VK_POSTS_WINDOW_DAYS)
+            posts = await self._call_vk(self.vk_api.get_group_posts, group.screen_name, since=window_start,
+                                        limit=settings.VK_GROUP_POSTS_COUNT)
+            self._forget_posts_before(window_start)
+
+            due_posts = [
+                post for post in posts
+                if self._is_post_due(post, self.vk_api.get_post_url(owner_id=-group.id, post_id=post.id), now)
+            ]
+            posts_data = await asyncio.gather(*[self.process_post(group.id, post.id) for post in due_posts])
+            for post_data in posts_data:
+                group_data.update(post_data)
 
             return group_data
         except Exception as e:
@@ -94,16 +281,35 @@ class VkActivitiesChecker:
 
         return group_data
 
-    def start_checking(self):
+    async def start_checking(self):
+        """
+        Starts the checks and remembers it in the database, so the checks are resumed after a restart.
+        """
+        await self.db.set_vk_checker_enabled(CHECKER_NAME, True)
+        self._starts += 1
         if not self.task_running:
             self.task_running = True
-            asyncio.create_task(self.process_groups())
+            self._stopped.clear()
+            # A task stopped a moment ago may still be finishing its cycle, then it just goes on.
+            if self._task is None or self._task.done():
+                # An empty context, so the task isn't bound to the trace of the update it's started in.
+                self._task = asyncio.create_task(self.process_groups(), context=contextvars.Context())
             logger.info("VKActivityChecker has been started")
 
-    def stop_checking(self):
+    async def stop_checking(self):
+        """
+        Stops the checks and remembers it in the database, so they aren't resumed after a restart.
+        Other bot instances stop before their next cycle or attempt to take the lock.
+        """
+        await self.db.set_vk_checker_enabled(CHECKER_NAME, False)
         if self.task_running:
             self.task_running = False
+            self._stopped.set()
             logger.info('VKActivityChecker has been stopped')
 
-    def shutdown(self):
-        self._loop.stop()
+    async def resume(self):
+        """
+        Starts the checks if they were running before the restart.
+        """
+        if await self.db.get_vk_checker_enabled(CHECKER_NAME):
+            await self.start_checking()